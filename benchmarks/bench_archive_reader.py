@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+归档读取基准：原始 .jsonl vs gzip vs 普通 zstd vs seekable zstd
+
+对同一个 transcript 的各种格式报告：
+- 压缩后大小
+- 顺序读取的吞吐（按解压后字节计算 MB/s，JsonlTailReader + open_transcript，只切分行）
+- 尾部读取耗时（read_tail_lines 最后 50 行；seekable zstd 只解压最后的帧）
+- 从中间位置续读的定位耗时
+
+用法：
+    python benchmarks/bench_archive_reader.py [--size-mb 256]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_bulk_reader import make_transcript  # noqa: E402
+from src.utils import archive_reader  # noqa: E402
+from src.utils.jsonl_reader import JsonlTailReader, read_tail_lines  # noqa: E402
+
+
+def read_all(path: str) -> int:
+    """顺序读取全部行，返回行数"""
+    reader = JsonlTailReader(opener=archive_reader.open_transcript)
+    count = 0
+    more = True
+    while more:
+        lines, more = reader.read_lines(path, 16 * 1024 * 1024)
+        count += len(lines)
+    reader.close_all()
+    return count
+
+
+def seek_middle(path: str, offset: int) -> float:
+    """定位到 offset 并读取 1 MB 的耗时"""
+    start = time.perf_counter()
+    with archive_reader.open_transcript(path) as f:
+        f.seek(offset)
+        f.read(1024 * 1024)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=256)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        src = os.path.join(root, 'session.jsonl')
+        make_transcript(src, args.size_mb)
+        size = os.path.getsize(src)
+        size_mb = size / 1024 / 1024
+
+        formats = [('jsonl', src)]
+        gz_path = os.path.join(root, 'gz', 'session.jsonl.gz')
+        os.makedirs(os.path.dirname(gz_path))
+        archive_reader.write_gzip(src, gz_path)
+        formats.append(('gzip', gz_path))
+
+        if archive_reader.zstandard is not None:
+            zst_path = os.path.join(root, 'zst', 'session.jsonl.zst')
+            os.makedirs(os.path.dirname(zst_path))
+            compressor = archive_reader.zstandard.ZstdCompressor(level=3)
+            with open(src, 'rb') as f_in, open(zst_path, 'wb') as f_out:
+                compressor.copy_stream(f_in, f_out)
+            formats.append(('zstd', zst_path))
+
+            seekable_path = os.path.join(root, 'seekable', 'session.jsonl.zst')
+            os.makedirs(os.path.dirname(seekable_path))
+            archive_reader.write_seekable_zstd(src, seekable_path)
+            formats.append(('zstd-seek', seekable_path))
+        else:
+            print('zstandard 未安装，跳过 zstd 格式')
+
+        print(f"transcript: {size_mb:.0f} MB")
+        print(f"{'format':<10} {'size':>9} {'read MB/s':>10} {'tail ms':>9} {'seek ms':>9}")
+        for name, path in formats:
+            start = time.perf_counter()
+            read_all(path)
+            read_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            read_tail_lines(path, 50)
+            tail_seconds = time.perf_counter() - start
+
+            seek_seconds = seek_middle(path, size // 2)
+
+            print(f"{name:<10} {os.path.getsize(path) / 1024 / 1024:>7.1f}MB "
+                  f"{size_mb / read_seconds:>10.0f} {tail_seconds * 1000:>9.1f} {seek_seconds * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
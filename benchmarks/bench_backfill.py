@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+历史回填基准：吞吐随工作进程数的变化
+
+生成一个模拟的 projects 目录（多个项目、会话和子 Agent，大小不一），
+分别用 1、2、4 … CPU 数个工作进程回填（不使用检查点），报告 MB/s 和加速比。
+
+用法：
+    python benchmarks/bench_backfill.py [--size-mb 512] [--files 400]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.plugins.claude_backfill import BackfillEngine
+
+
+def make_corpus(root: str, size_mb: int, files: int):
+    """按对数正态分布生成大小不一的 transcript（少数大文件 + 大量小文件）"""
+    random.seed(0)
+    weights = [random.lognormvariate(0, 1.2) for _ in range(files)]
+    total = sum(weights)
+    tools = ['Read', 'Edit', 'Bash', 'Grep', 'Glob', 'Write', 'TodoWrite']
+
+    for i, weight in enumerate(weights):
+        project = os.path.join(root, f'project-{i % 20}')
+        if i % 10 == 9:
+            path = os.path.join(project, f'session-{i - 1}', 'subagents', f'agent-{i}.jsonl')
+        else:
+            path = os.path.join(project, f'session-{i}.jsonl')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        target = int(size_mb * 1024 * 1024 * weight / total)
+        written = 0
+        n = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            while written < target:
+                n += 1
+                usage = {'input_tokens': 3, 'output_tokens': 200,
+                         'cache_creation_input_tokens': 500, 'cache_read_input_tokens': 20000}
+                lines = [
+                    {'type': 'user', 'uuid': f'u-{n}', 'message': {'role': 'user', 'content': [
+                        {'type': 'tool_result', 'tool_use_id': f't-{n}', 'content': 'x' * 2000}]}},
+                    {'type': 'assistant', 'uuid': f'a-{n}', 'message': {
+                        'id': f'msg-{i}-{n}', 'model': 'claude', 'stop_reason': None, 'usage': usage,
+                        'content': [{'type': 'tool_use', 'id': f't-{n}', 'name': random.choice(tools),
+                                     'input': {'file_path': '/src/app.py'}}]}},
+                    {'type': 'system', 'subtype': 'turn_duration', 'durationMs': 1200},
+                ]
+                data = ''.join(json.dumps(line) + '\n' for line in lines)
+                f.write(data)
+                written += len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--files', type=int, default=400)
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    counts = sorted({1, *[n for n in (2, 4, 8, 16, 32) if n <= cpus], cpus})
+
+    with tempfile.TemporaryDirectory() as root:
+        make_corpus(root, args.size_mb, args.files)
+        print(f"corpus: {args.files} files, {args.size_mb} MB, {cpus} CPUs")
+        print(f"{'workers':>8} {'seconds':>8} {'MB/s':>8} {'speedup':>8}")
+
+        baseline = None
+        for workers in counts:
+            engine = BackfillEngine(root, workers=workers)
+            engine.run()
+            seconds = engine.stats['seconds']
+            baseline = baseline or seconds
+            print(f"{workers:>8} {seconds:>8.2f} {engine.stats['mb_per_second']:>8.1f} {baseline / seconds:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
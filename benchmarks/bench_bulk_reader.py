@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+批量读取基准：文本 readlines() vs 二进制分块读取 vs 内存映射
+
+对同一个 transcript 分别在子进程中执行：
+- readlines: 文本模式 f.readlines()（整个文件解码为 str 列表）
+- chunked:   JsonlTailReader 二进制分块读取（每批 8 MB）
+- mmap:      MmapLineReader 在映射上切分，memoryview 直接交给解码器
+
+每种方式报告只切分行（split）和切分 + 解码（decode，与历史回填相同的解码器配置）
+的吞吐（MB/s），以及解码过程中的峰值 RSS。
+
+用法：
+    python benchmarks/bench_bulk_reader.py [--size-mb 512]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+MODES = ('readlines', 'chunked', 'mmap')
+
+
+def make_transcript(path: str, size_mb: int):
+    """assistant / user(tool_result) / progress / system 混合"""
+    lines = [
+        {'type': 'user', 'uuid': 'u-1', 'message': {'role': 'user', 'content': [
+            {'type': 'tool_result', 'tool_use_id': 't-1', 'content': 'x' * 4000}]}},
+        {'type': 'assistant', 'uuid': 'a-1', 'message': {
+            'id': 'msg-1', 'model': 'claude', 'stop_reason': None,
+            'usage': {'input_tokens': 3, 'output_tokens': 200,
+                      'cache_creation_input_tokens': 500, 'cache_read_input_tokens': 20000},
+            'content': [{'type': 'tool_use', 'id': 't-1', 'name': 'Read', 'input': {'file_path': '/a.py'}}]}},
+        {'type': 'progress', 'data': {'type': 'hook_progress', 'status': 'started', 'hookName': 'lint'}},
+        {'type': 'system', 'subtype': 'turn_duration', 'durationMs': 1200},
+    ]
+    block = ''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8') * 256
+    with open(path, 'wb') as f:
+        for _ in range(size_mb * 1024 * 1024 // len(block) + 1):
+            f.write(block)
+
+
+def iter_lines(mode: str, path: str):
+    """按模式产出行（bytes 或 memoryview）"""
+    if mode == 'readlines':
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f.readlines():
+                yield line.encode('utf-8')
+
+    elif mode == 'chunked':
+        from src.utils.jsonl_reader import JsonlTailReader
+        reader = JsonlTailReader()
+        more = True
+        while more:
+            lines, more = reader.read_lines(path, 8 * 1024 * 1024)
+            yield from lines
+        reader.close_all()
+
+    else:
+        from src.utils.mmap_reader import MmapLineReader
+        with MmapLineReader(path) as reader:
+            yield from reader.iter_lines()
+
+
+def child(mode: str, path: str, decode: bool):
+    """子进程：执行一种读取方式，输出耗时和峰值 RSS"""
+    from src.plugins.claude_backfill import BACKFILL_RECORD_TYPES
+    from src.plugins.claude_records import RECORD_SCHEMAS
+    from src.utils.jsonl_decoder import RecordDecoder
+
+    decoder = RecordDecoder(BACKFILL_RECORD_TYPES, schemas=RECORD_SCHEMAS)
+
+    start = time.perf_counter()
+    count = 0
+    for line in iter_lines(mode, path):
+        if decode:
+            if decoder.decode(line) is not None:
+                count += 1
+        else:
+            count += 1
+    elapsed = time.perf_counter() - start
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024
+    print(json.dumps({'seconds': elapsed, 'count': count, 'maxrss_mb': maxrss / 1024}))
+
+
+def run_child(mode: str, path: str, decode: bool) -> dict:
+    output = subprocess.check_output([sys.executable, __file__, '--child', mode, path, str(int(decode))])
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'PATH', 'DECODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], args.child[1], args.child[2] == '1')
+        return
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'session.jsonl')
+        make_transcript(path, args.size_mb)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+
+        # 预热页缓存（各方式都从页缓存读取）
+        with open(path, 'rb') as f:
+            while f.read(16 * 1024 * 1024):
+                pass
+
+        print(f"transcript: {size_mb:.0f} MB")
+        print(f"{'mode':<10} {'split MB/s':>11} {'decode MB/s':>12} {'peak RSS':>10}")
+        for mode in MODES:
+            split = run_child(mode, path, False)
+            decoded = run_child(mode, path, True)
+            print(f"{mode:<10} {size_mb / split['seconds']:>11.0f} {size_mb / decoded['seconds']:>12.0f} "
+                  f"{decoded['maxrss_mb']:>8.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
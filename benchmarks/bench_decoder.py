@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+解码器微基准：完整 json.loads vs 预分类 + 快速后端 vs 类型化记录
+
+用法：
+    python benchmarks/bench_decoder.py [--lines 20000] [--tool-result-kb 256]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.plugins.claude_log import ClaudeLogPlugin
+from src.plugins.claude_records import RECORD_SCHEMAS, msgspec
+from src.utils.jsonl_decoder import BACKEND, RecordDecoder
+
+
+def make_corpus(count: int, tool_result_kb: int) -> list:
+    """生成与真实 transcript 比例相近的合成记录"""
+    header = {
+        'parentUuid': 'a1b2c3d4-0000-0000-0000-000000000000',
+        'isSidechain': False,
+        'userType': 'external',
+        'cwd': '/home/dev/project',
+        'sessionId': 'f00dfeed-0000-0000-0000-000000000000',
+        'version': '2.0.0',
+        'gitBranch': 'main',
+    }
+    assistant = dict(header, message={
+        'id': 'msg_01', 'type': 'message', 'role': 'assistant', 'model': 'claude-sonnet',
+        'content': [{'type': 'tool_use', 'id': 'toolu_01', 'name': 'Read',
+                     'input': {'file_path': '/home/dev/project/main.py'}}],
+        'stop_reason': None,
+        'usage': {'input_tokens': 12, 'output_tokens': 80,
+                  'cache_creation_input_tokens': 300, 'cache_read_input_tokens': 9000},
+    }, type='assistant', uuid='u-1')
+    tool_result = dict(header, message={
+        'role': 'user',
+        'content': [{'type': 'tool_result', 'tool_use_id': 'toolu_01',
+                     'content': 'x' * (tool_result_kb * 1024)}],
+    }, type='user', uuid='u-2', toolUseResult={'stdout': 'y' * (tool_result_kb * 1024)})
+    snapshot = {'type': 'file-history-snapshot', 'messageId': 'm-1',
+                'snapshot': {'trackedFileBackups': {f'f{i}.py': {'backupFileName': 'z' * 64}
+                                                    for i in range(500)}}}
+    progress = dict(header, type='progress', data={'type': 'bash_progress', 'status': 'started',
+                                                   'command': 'pytest'})
+    queue = {'type': 'queue-operation', 'operation': 'enqueue', 'content': 'q' * 2048}
+
+    pattern = [assistant, tool_result, assistant, progress, snapshot, queue]
+    encoded = [json.dumps(r, separators=(',', ':')).encode('utf-8') for r in pattern]
+    return [encoded[i % len(encoded)] for i in range(count)]
+
+
+def bench(name: str, func, lines: list) -> float:
+    start = time.perf_counter()
+    for line in lines:
+        func(line)
+    elapsed = time.perf_counter() - start
+    total_mb = sum(len(line) for line in lines) / 1024 / 1024
+    rate = len(lines) / elapsed
+    print(f"{name:<28} {rate:>12,.0f} lines/s  {total_mb / elapsed:>9,.1f} MB/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--tool-result-kb', type=int, default=256)
+    args = parser.parse_args()
+
+    lines = make_corpus(args.lines, args.tool_result_kb)
+    print(f"corpus: {len(lines):,} lines, {sum(map(len, lines)) / 1024 / 1024:,.1f} MB, backend: {BACKEND}")
+
+    def baseline(line):
+        return json.loads(line).get('type')
+
+    decoder = RecordDecoder(ClaudeLogPlugin.HANDLED_RECORD_TYPES)
+    typed = RecordDecoder(ClaudeLogPlugin.HANDLED_RECORD_TYPES, schemas=RECORD_SCHEMAS)
+    typed_backend = 'msgspec' if msgspec is not None else f'{BACKEND}+slots'
+
+    before = bench('json.loads (before)', baseline, lines)
+    after = bench(f'RecordDecoder/{BACKEND} (after)', decoder.decode, lines)
+    bench(f'typed/{typed_backend}', typed.decode, lines)
+    print(f"speedup: {after / before:.1f}x  stats: {decoder.stats}")
+
+
+if __name__ == '__main__':
+    main()
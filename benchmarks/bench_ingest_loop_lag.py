@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+大量追加时的事件循环延迟：I/O 线程池 vs 在事件循环中直接读取
+
+向 transcript 追加约 100 MB 记录（含大体积 tool_result），插件读取期间
+从开始写入到读取位置追上文件末尾，用 LoopLagMonitor 测量事件循环延迟。
+
+用法：
+    python benchmarks/bench_ingest_loop_lag.py [--mb 100] [--workers 2]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.plugins.claude_log import ClaudeLogPlugin
+from src.utils.loop_monitor import LoopLagMonitor
+
+
+def make_block(target_bytes: int) -> bytes:
+    """生成约 target_bytes 的记录块（assistant / 大 tool_result 交替）"""
+    tools = ['Bash', 'Read', 'Edit', 'Grep']
+    records = []
+    size = 0
+    i = 0
+    while size < target_bytes:
+        if i % 4 == 3:
+            record = {'type': 'user', 'sessionId': 'bench', 'uuid': f'u-{i}',
+                      'message': {'role': 'user', 'content': [
+                          {'type': 'tool_result', 'tool_use_id': f't-{i}', 'content': 'x' * 256 * 1024}]}}
+        else:
+            record = {'type': 'assistant', 'sessionId': 'bench', 'uuid': f'a-{i}',
+                      'message': {'role': 'assistant', 'content': [
+                          {'type': 'tool_use', 'id': f't-{i}', 'name': tools[i % len(tools)], 'input': {}}],
+                          'usage': {'input_tokens': 10, 'output_tokens': 20}}}
+        line = json.dumps(record).encode('utf-8') + b'\n'
+        records.append(line)
+        size += len(line)
+        i += 1
+    return b''.join(records)
+
+
+def append(path: str, block: bytes, total: int) -> int:
+    written = 0
+    with open(path, 'ab') as f:
+        while written < total:
+            f.write(block)
+            written += len(block)
+    return written
+
+
+async def run_mode(workers: int, args, block: bytes) -> dict:
+    with tempfile.TemporaryDirectory() as root:
+        project = os.path.join(root, 'project')
+        os.mkdir(project)
+        path = os.path.join(project, 'session.jsonl')
+        open(path, 'wb').close()
+
+        plugin = ClaudeLogPlugin({
+            'projects_dir': root,
+            'checkpoint_file': '',
+            'io_workers': workers,
+            'watch_debounce_ms': 0,
+        })
+        monitor = LoopLagMonitor(interval=0.005, window=100000)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            await plugin.start()
+
+            # 写入放在单独线程，只测量插件读取对事件循环的影响（读取由文件通知触发）
+            monitor.start()
+            start = time.perf_counter()
+            size = await asyncio.to_thread(append, path, block, args.mb * 1024 * 1024)
+            while plugin.file_positions.get(path, 0) < size:
+                await asyncio.sleep(0.01)
+            elapsed = time.perf_counter() - start
+            # 让被阻塞的最后一次测量完成
+            await asyncio.sleep(monitor.interval * 2)
+            await monitor.close()
+
+            await plugin.stop()
+
+    stats = monitor.get_stats()
+    stats['seconds'] = elapsed
+    stats['mb_per_s'] = size / elapsed / 1024 / 1024
+    return stats
+
+
+async def run(args):
+    block = make_block(4 * 1024 * 1024)
+
+    print(f"append: {args.mb} MB")
+    print(f"{'mode':<16} {'seconds':>8} {'MB/s':>8} {'lag p50':>9} {'lag p99':>9} {'lag max':>9} {'stalls':>7}")
+    for name, workers in ((f'executor ({args.workers})', args.workers), ('on loop', 0)):
+        stats = await run_mode(workers, args, block)
+        print(f"{name:<16} {stats['seconds']:>8.2f} {stats['mb_per_s']:>8.1f} "
+              f"{stats['lag_p50_ms']:>7.2f}ms {stats['lag_p99_ms']:>7.2f}ms "
+              f"{stats['lag_max_ms']:>7.2f}ms {stats['stalls']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mb', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=2)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
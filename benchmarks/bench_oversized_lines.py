@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+超长行基准：完整读入 vs 前缀 + 流式跳过
+
+生成包含若干超大 tool_result / file-history-snapshot 行的 transcript，
+分别在子进程中用不同的 max_line_bytes 读取并解码，报告峰值 RSS 和耗时。
+
+用法：
+    python benchmarks/bench_oversized_lines.py [--line-mb 200] [--limit-mb 1]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def make_transcript(path: str, line_mb: int):
+    """普通记录 + 一条 line_mb 大小的 tool_result + 一条大快照"""
+    assistant = json.dumps({
+        'type': 'assistant', 'sessionId': 'bench',
+        'message': {'content': [{'type': 'tool_use', 'name': 'Read', 'input': {}}]},
+    }).encode('utf-8') + b'\n'
+
+    with open(path, 'wb') as f:
+        for _ in range(1000):
+            f.write(assistant)
+
+        # 大 tool_result：分段写入，生成时也不占用大量内存
+        f.write(b'{"type":"user","uuid":"u-1","message":{"role":"user","content":'
+                b'[{"type":"tool_result","tool_use_id":"toolu_1","content":"')
+        block = b'x' * (1024 * 1024)
+        for _ in range(line_mb):
+            f.write(block)
+        f.write(b'","is_error":false}]}}\n')
+
+        f.write(b'{"type":"file-history-snapshot","messageId":"m-1","snapshot":{"data":"')
+        for _ in range(line_mb // 2):
+            f.write(block)
+        f.write(b'"}}\n')
+
+        for _ in range(1000):
+            f.write(assistant)
+
+
+def child(path: str, limit: int):
+    """子进程：读取并解码整个文件，输出峰值 RSS"""
+    from src.plugins.claude_records import RECORD_SCHEMAS
+    from src.utils.jsonl_decoder import RecordDecoder
+    from src.utils.jsonl_reader import JsonlTailReader
+
+    reader = JsonlTailReader(max_line_bytes=limit or None)
+    decoder = RecordDecoder(schemas=RECORD_SCHEMAS)
+
+    start = time.perf_counter()
+    decoded = 0
+    more = True
+    while more:
+        lines, more = reader.read_lines(path, 4 * 1024 * 1024)
+        for line in lines:
+            if decoder.decode(line) is not None:
+                decoded += 1
+    elapsed = time.perf_counter() - start
+    reader.close_all()
+
+    # Linux: KB；macOS: 字节
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024
+    print(json.dumps({'seconds': elapsed, 'decoded': decoded, 'maxrss_mb': maxrss / 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--line-mb', type=int, default=200)
+    parser.add_argument('--limit-mb', type=float, default=1)
+    parser.add_argument('--child', nargs=2, metavar=('PATH', 'LIMIT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], int(args.child[1]))
+        return
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'session.jsonl')
+        make_transcript(path, args.line_mb)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+
+        print(f"transcript: {size_mb:.0f} MB, largest line {args.line_mb} MB")
+        print(f"{'max_line_bytes':<16} {'seconds':>8} {'decoded':>8} {'peak RSS':>10}")
+        for name, limit in (('unlimited', 0), (f'{args.limit_mb:g} MB', int(args.limit_mb * 1024 * 1024))):
+            output = subprocess.check_output([sys.executable, __file__, '--child', path, str(limit)])
+            result = json.loads(output)
+            print(f"{name:<16} {result['seconds']:>8.2f} {result['decoded']:>8} {result['maxrss_mb']:>8.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Token 持久化基准：追加、批量 fsync、启动恢复
+
+报告：
+- append() 的单条耗时（只写内存缓冲）
+- 每批 fsync 的耗时
+- 启动恢复耗时：日志尾部长度不同（0 / 1 万 / 10 万条）、快照相同时，
+  恢复时间只随日志尾部增长，与累计的历史记录数无关
+
+用法：
+    python benchmarks/bench_token_store.py [--records 200000] [--sessions 2000]
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.middleware.token_store import TokenStore  # noqa: E402
+from src.plugins.base import UsageDelta  # noqa: E402
+
+
+def make_deltas(count: int, sessions: int):
+    rng = random.Random(0)
+    start = time.time() - 30 * 86400
+    models = ['claude-opus', 'claude-sonnet', 'claude-haiku']
+    return [
+        UsageDelta(
+            source='bench',
+            project=f'project-{rng.randrange(20)}',
+            session_id=f'session-{rng.randrange(sessions)}',
+            model=rng.choice(models),
+            input=rng.randrange(1, 5000),
+            output=rng.randrange(1, 2000),
+            cache_read=rng.randrange(0, 50000),
+            timestamp=start + i * (30 * 86400 / count),
+        )
+        for i in range(count)
+    ]
+
+
+def restore_seconds(path: str) -> float:
+    start = time.perf_counter()
+    store = TokenStore(path)
+    store.open()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=200_000)
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    deltas = make_deltas(args.records, args.sessions)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TokenStore(tmp)
+        store.open()
+
+        # 追加 + 批量 fsync
+        append_seconds = 0.0
+        flush_seconds = 0.0
+        batches = 0
+        for i in range(0, len(deltas), args.batch):
+            start = time.perf_counter()
+            for delta in deltas[i:i + args.batch]:
+                store.append(delta)
+            append_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            store.flush()
+            flush_seconds += time.perf_counter() - start
+            batches += 1
+
+        print(f"records: {args.records:,}  sessions: {args.sessions:,}  cells: {len(store.cells):,}")
+        print(f"append: {append_seconds / args.records * 1e6:.2f} µs/record")
+        print(f"fsync:  {flush_seconds / batches * 1000:.2f} ms/batch ({args.batch} records)")
+        print(f"restore (full journal, no snapshot): {restore_seconds(tmp) * 1000:.1f} ms")
+
+        # 压缩后再追加不同长度的日志尾部
+        store.compact()
+        print(f"{'tail records':>12} {'restore ms':>11}")
+        written = 0
+        for tail in (0, 10_000, 100_000):
+            for delta in deltas[written:tail]:
+                store.append(delta)
+            written = max(written, tail)
+            store.flush()
+            print(f"{tail:>12,} {restore_seconds(tmp) * 1000:>11.1f}")
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
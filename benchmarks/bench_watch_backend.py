@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+文件监控后端基准：inotify（事件循环内） vs watchdog（Observer 线程） vs stat 轮询
+
+向临时目录中的 transcript 追加记录，统计从写入到插件发出状态事件的延迟，
+以及整个过程的 CPU 时间（包含 Observer 线程）。轮询模式另外报告每轮 CPU 时间。
+
+用法：
+    python benchmarks/bench_watch_backend.py [--events 500] [--interval-ms 5] [--files 20]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.plugins.claude_log import ClaudeLogPlugin
+from src.utils import inotify_watcher
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def make_record(tool: str) -> bytes:
+    record = {
+        'type': 'assistant',
+        'sessionId': 'bench',
+        'message': {'content': [{'type': 'tool_use', 'name': tool, 'input': {}}]},
+    }
+    return json.dumps(record).encode('utf-8') + b'\n'
+
+
+async def run_backend(backend: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as root:
+        # 多个项目目录，模拟真实的 watch 数量
+        paths = []
+        for i in range(args.files):
+            project = os.path.join(root, f'project-{i}')
+            os.mkdir(project)
+            path = os.path.join(project, 'session.jsonl')
+            open(path, 'wb').close()
+            paths.append(path)
+
+        plugin = ClaudeLogPlugin({
+            'projects_dir': root,
+            'checkpoint_file': '',
+            'watch_backend': backend,
+            'watch_debounce_ms': 0,
+        })
+
+        received = asyncio.Event()
+        arrivals = []
+
+        def on_event(event):
+            arrivals.append(time.perf_counter())
+            received.set()
+
+        plugin.register_callback(on_event)
+
+        # 每条记录都会打印工具名，基准期间静默
+        with contextlib.redirect_stdout(io.StringIO()):
+            await plugin.start()
+
+            # 交替写入 Bash / Read，保证每条记录都会改变状态
+            records = [make_record('Bash'), make_record('Read')]
+            latencies = []
+            missed = 0
+
+            cpu_start = time.process_time()
+            for i in range(args.events):
+                received.clear()
+                path = paths[0]
+                t0 = time.perf_counter()
+                with open(path, 'ab') as f:
+                    f.write(records[i % 2])
+                try:
+                    await asyncio.wait_for(received.wait(), 2.0)
+                    latencies.append(arrivals[-1] - t0)
+                except asyncio.TimeoutError:
+                    missed += 1
+                await asyncio.sleep(args.interval_ms / 1000)
+            cpu = time.process_time() - cpu_start
+
+            stats = plugin.get_watch_stats()
+            await plugin.stop()
+
+    return {
+        'latencies': latencies,
+        'missed': missed,
+        'cpu': cpu,
+        'poll_cycle_us': stats.get('poll_avg_cycle_cpu_us') if backend == 'poll' else None,
+    }
+
+
+async def run(args):
+    backends = ['watchdog', 'poll']
+    if inotify_watcher.is_available():
+        backends.insert(0, 'inotify')
+    else:
+        print("inotify not available on this platform, benchmarking watchdog only\n")
+
+    print(f"{'backend':<10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'missed':>7} {'cpu ms':>8} {'cpu/event us':>13}")
+    for backend in backends:
+        result = await run_backend(backend, args)
+        latencies = result['latencies']
+        print(f"{backend:<10} "
+              f"{percentile(latencies, 0.50) * 1000:>8.3f} "
+              f"{percentile(latencies, 0.99) * 1000:>8.3f} "
+              f"{max(latencies, default=0) * 1000:>8.3f} "
+              f"{result['missed']:>7} "
+              f"{result['cpu'] * 1000:>8.1f} "
+              f"{result['cpu'] / args.events * 1e6:>13.1f}")
+        if result['poll_cycle_us'] is not None:
+            print(f"{'':<10} poll cycle cpu: {result['poll_cycle_us']:.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--interval-ms', type=float, default=5)
+    parser.add_argument('--files', type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+WebSocket 广播负载测试：数百个本地客户端，统计投递延迟
+
+可选加入若干"慢客户端"（连接后不读取），验证它们不会拖慢其他客户端。
+
+用法：
+    python benchmarks/bench_websocket_broadcast.py [--clients 300] [--events 200] [--rate 200] [--slow 5]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import socket
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import websockets
+
+from src.adapters.websocket_adapter import WebSocketAdapter
+from src.plugins.base import StateEvent, Status
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+async def fast_client(uri: str, latencies: list, received: list, done: asyncio.Event):
+    async with websockets.connect(uri, max_queue=None, compression=None) as ws:
+        count = 0
+        while not done.is_set():
+            try:
+                message = await asyncio.wait_for(ws.recv(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            except websockets.exceptions.ConnectionClosed:
+                break
+            sent_at = json.loads(message)['details']['sent_at']
+            latencies.append(time.perf_counter() - sent_at)
+            count += 1
+        received.append(count)
+
+
+async def slow_client(uri: str, done: asyncio.Event):
+    # 不读取消息：接收缓冲区填满后服务端发送会阻塞
+    async with websockets.connect(uri, max_queue=1, compression=None) as ws:
+        await done.wait()
+
+
+async def run(args):
+    port = free_port()
+    uri = f'ws://127.0.0.1:{port}'
+    adapter = WebSocketAdapter({
+        'port': port,
+        'client_queue_size': args.queue_size,
+        'max_lag_seconds': args.max_lag,
+    })
+
+    # 连接/断开日志太多，基准期间静默
+    with contextlib.redirect_stdout(io.StringIO()):
+        await adapter.start()
+
+        latencies, received = [], []
+        done = asyncio.Event()
+        clients = [asyncio.create_task(fast_client(uri, latencies, received, done))
+                   for _ in range(args.clients)]
+        clients += [asyncio.create_task(slow_client(uri, done)) for _ in range(args.slow)]
+
+        deadline = time.monotonic() + 30
+        while len(adapter.clients) < args.clients + args.slow:
+            failed = [task for task in clients if task.done()]
+            if failed or time.monotonic() > deadline:
+                done.set()
+                await adapter.stop()
+                raise RuntimeError(f"clients failed to connect: {failed[0].exception() if failed else 'timeout'}")
+            await asyncio.sleep(0.05)
+
+        payload = 'x' * args.payload
+        interval = 1 / args.rate
+        send_times = []
+        start = time.perf_counter()
+        for i in range(args.events):
+            event = StateEvent(status=Status.WORKING, confidence=1.0, source='bench',
+                               details={'seq': i, 'sent_at': time.perf_counter(), 'pad': payload})
+            t0 = time.perf_counter()
+            await adapter.send(event)
+            send_times.append(time.perf_counter() - t0)
+            await asyncio.sleep(max(0.0, start + (i + 1) * interval - time.perf_counter()))
+
+        await asyncio.sleep(1.0)
+        stats = adapter.get_stats()
+        done.set()
+        await asyncio.gather(*clients, return_exceptions=True)
+        await adapter.stop()
+
+    print(f"clients:          {args.clients} (+{args.slow} slow)")
+    print(f"events:           {args.events} @ {args.rate}/s, payload {args.payload} B")
+    print(f"deliveries:       {len(latencies)} / {args.clients * args.events}")
+    print(f"latency p50:      {percentile(latencies, 0.50) * 1000:.2f} ms")
+    print(f"latency p99:      {percentile(latencies, 0.99) * 1000:.2f} ms")
+    print(f"latency max:      {max(latencies, default=0) * 1000:.2f} ms")
+    print(f"send() p99:       {percentile(send_times, 0.99) * 1000:.3f} ms")
+    print(f"coalesced:        {stats['coalesced']}")
+    print(f"lagged clients:   {stats['lagged_disconnects']} disconnected")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=300)
+    parser.add_argument('--slow', type=int, default=5)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=200)
+    parser.add_argument('--payload', type=int, default=512)
+    parser.add_argument('--queue-size', type=int, default=32)
+    parser.add_argument('--max-lag', type=float, default=0.5)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
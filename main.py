@@ -3,6 +3,7 @@
 AI-ClaudeCat v4.0 - 主程序入口
 """
 
+import argparse
 import asyncio
 import json
 import signal
@@ -15,6 +16,81 @@ from src.middleware import Middleware
 from src.adapters import WebSocketAdapter, HTTPAdapter, StdoutAdapter
 
 
+def load_config(config_path: str) -> dict:
+    """加载配置文件"""
+    config_file = Path(config_path)
+
+    if not config_file.exists():
+        print(f"WARNING: Config file not found: {config_path}")
+        print("Using default configuration...")
+        return get_default_config()
+
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        print(f"[OK] Loaded config: {config_path}")
+        return config
+
+    except Exception as e:
+        print(f"[ERROR] Error loading config: {e}")
+        print("Using default configuration...")
+        return get_default_config()
+
+def get_default_config() -> dict:
+    """默认配置"""
+    return {
+        "version": "4.0.0",
+        "claude": {
+            "projects_dir": "auto"
+        },
+        "plugins": {
+            "claude_log": {
+                "enabled": True
+            }
+        },
+        "middleware": {
+            "privacy_filter": {
+                "enabled": True,
+                "level": "internal",
+                "dev_mode": False
+            },
+            "token_stats": {
+                "enabled": True
+            },
+            "token_store": {
+                "enabled": True,
+                "path": "auto"
+            }
+        },
+        "adapters": {
+            "websocket": {
+                "enabled": True,
+                "host": "127.0.0.1",
+                "port": 8765
+            },
+            "http": {
+                "enabled": True,
+                "host": "127.0.0.1",
+                "port": 8080,
+                "cors": True
+            },
+            "stdout": {
+                "enabled": True,
+                "format": "simple"
+            }
+        }
+    }
+
+
+def claude_log_config_of(config: dict) -> dict:
+    """ClaudeLogPlugin 配置（合并 Claude 配置和全局 debug 配置）"""
+    claude_log_config = config.get('plugins', {}).get('claude_log', {})
+    claude_config = config.get('claude', {})
+    plugin_config = {**claude_log_config, **claude_config}
+    plugin_config['debug'] = config.get('debug', False)
+    return plugin_config
+
+
 class Application:
     """应用主类"""
     
@@ -42,64 +118,7 @@ class Application:
     
     def _load_config(self) -> dict:
         """加载配置文件"""
-        config_file = Path(self.config_path)
-        
-        if not config_file.exists():
-            print(f"WARNING: Config file not found: {self.config_path}")
-            print("Using default configuration...")
-            return self._get_default_config()
-        
-        try:
-            with open(config_file, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-            print(f"[OK] Loaded config: {self.config_path}")
-            return config
-        
-        except Exception as e:
-            print(f"[ERROR] Error loading config: {e}")
-            print("Using default configuration...")
-            return self._get_default_config()
-    
-    def _get_default_config(self) -> dict:
-        """默认配置"""
-        return {
-            "version": "4.0.0",
-            "claude": {
-                "projects_dir": "auto"
-            },
-            "plugins": {
-                "claude_log": {
-                    "enabled": True
-                }
-            },
-            "middleware": {
-                "privacy_filter": {
-                    "enabled": True,
-                    "level": "internal",
-                    "dev_mode": False
-                },
-                "token_stats": {
-                    "enabled": True
-                }
-            },
-            "adapters": {
-                "websocket": {
-                    "enabled": True,
-                    "host": "127.0.0.1",
-                    "port": 8765
-                },
-                "http": {
-                    "enabled": True,
-                    "host": "127.0.0.1",
-                    "port": 8080,
-                    "cors": True
-                },
-                "stdout": {
-                    "enabled": True,
-                    "format": "simple"
-                }
-            }
-        }
+        return load_config(self.config_path)
     
     def _create_plugins(self):
         """创建插件"""
@@ -108,14 +127,7 @@ class Application:
         # ClaudeLogPlugin
         claude_log_config = plugins_config.get('claude_log', {})
         if claude_log_config.get('enabled', True):
-            # 合并 Claude 配置
-            claude_config = self.config.get('claude', {})
-            plugin_config = {**claude_log_config, **claude_config}
-            
-            # 传递全局 debug 配置
-            plugin_config['debug'] = self.config.get('debug', False)
-            
-            plugin = ClaudeLogPlugin(plugin_config)
+            plugin = ClaudeLogPlugin(claude_log_config_of(self.config))
             self.plugins.append(plugin)
         
         # ClaudeProcessPlugin
@@ -161,7 +173,14 @@ class Application:
         print(f"   - HTTP API:  http://127.0.0.1:8080")
         print("\nAPI Endpoints:")
         print(f"   - GET /api/status  - Current status")
-        print(f"   - GET /api/tokens  - Token statistics")
+        print(f"   - GET /api/tokens  - Token statistics (?window=5m&step=10s)")
+        print(f"   - GET /api/usage   - Token usage by model/project/session/agent_type (?group_by=model,project&rollup=1)")
+        print(f"   - GET /api/history - Daily token usage (?days=7&group_by=project)")
+        print(f"   - GET /api/cache   - Prompt cache efficiency (/api/cache/events?since=0)")
+        print(f"   - GET /api/sessions - Session list")
+        print(f"   - GET /api/pipeline - Event pipeline stats")
+        print(f"   - GET /api/loop    - Event loop lag")
+        print(f"   - GET /api/backfill - History backfill")
         print(f"   - GET /api/health  - Health check")
         print("\nPress Ctrl+C to stop")
         print("=" * 60)
@@ -177,10 +196,67 @@ class Application:
             print("\n[OK] Application stopped")
 
 
+def run_backfill(args):
+    """backfill 子命令：并行扫描全部历史 transcript 并输出聚合结果"""
+    config = load_config(args.config)
+    plugin = ClaudeLogPlugin(claude_log_config_of(config))
+    
+    if args.reset and plugin.backfill_file and Path(plugin.backfill_file).exists():
+        Path(plugin.backfill_file).unlink()
+    
+    engine = plugin.create_backfill_engine(workers=args.workers)
+    print(f"[BACKFILL] {plugin.projects_dir} ({engine.workers} workers)")
+    
+    def progress(stats):
+        print(f"[BACKFILL] {stats['files_scanned']} files, "
+              f"{stats['bytes_scanned'] / 1024 / 1024:.1f} MB, {stats['mb_per_second']} MB/s", end='\r')
+    
+    try:
+        engine.run(progress=None if args.json else progress)
+    except KeyboardInterrupt:
+        engine.cancel()
+        print("\n[BACKFILL] Interrupted, progress saved (run again to resume)")
+        sys.exit(130)
+    
+    stats = engine.get_stats()
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        return
+    
+    result = stats['result']
+    tokens = result['tokens']
+    print()
+    print(f"[BACKFILL] {stats['files']} files ({stats['files_scanned']} scanned, {stats['files_unchanged']} unchanged) "
+          f"in {stats['seconds']:.1f}s")
+    print(f"   Sessions:   {result['sessions']:,} ({result['subagents']:,} sub-agents)")
+    print(f"   Turns:      {result['turns']:,}")
+    print(f"   Messages:   {result['messages']:,}")
+    print(f"   Tool calls: {result['tool_calls']:,}")
+    print(f"   Tokens:     input {tokens['input']:,} / output {tokens['output']:,} / "
+          f"cache write {tokens['cache_write']:,} / cache read {tokens['cache_read']:,}")
+    for name, count in list(result['tools'].items())[:10]:
+        print(f"      {name:<24} {count:,}")
+
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='AI-ClaudeCat')
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    subparsers = parser.add_subparsers(dest='command')
+    
+    backfill_parser = subparsers.add_parser('backfill', help='并行扫描全部历史 transcript（可中断续跑）')
+    backfill_parser.add_argument('--workers', type=int, default=None, help='工作进程数（默认全部 CPU）')
+    backfill_parser.add_argument('--reset', action='store_true', help='丢弃回填进度，从头扫描')
+    backfill_parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    
+    args = parser.parse_args()
+    
+    if args.command == 'backfill':
+        run_backfill(args)
+        return
+    
     # 创建应用
-    app = Application()
+    app = Application(args.config)
     
     # 运行应用
     try:
@@ -30,3 +30,7 @@ class OutputAdapter(ABC):
     async def send(self, event: StateEvent):
         """发送事件"""
         pass
+    
+    async def send_message(self, message: Dict):
+        """发送非状态消息（如缓存失效事件，message['event'] 为消息类型）；默认忽略"""
+        pass
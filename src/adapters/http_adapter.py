@@ -49,13 +49,129 @@ class HTTPAdapter(OutputAdapter):
         
         @self.app.route('/api/tokens', methods=['GET'])
         def get_tokens():
-            """获取 Token 统计"""
+            """获取 Token 统计（?window=5m 附带最近窗口的合计，&step=10s 附带时间序列）"""
             if self.middleware is None:
                 return jsonify({'error': 'Middleware not available'}), 500
             
-            stats = self.middleware.get_token_stats()
+            try:
+                stats = self.middleware.get_token_stats(
+                    window=request.args.get('window'),
+                    step=request.args.get('step')
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             return jsonify(stats)
         
+        @self.app.route('/api/usage', methods=['GET'])
+        def get_usage():
+            """
+            按维度分组的 Token 用量
+            
+            ?group_by=model,project（model / project / session / agent_type）
+            &rollup=1（附带各层小计和总计）&limit=20
+            其余同名参数作为过滤条件（如 &agent_type=main）
+            """
+            if self.middleware is None:
+                return jsonify({'error': 'Middleware not available'}), 500
+            
+            group_by = [name for name in request.args.get('group_by', '').split(',') if name]
+            filters = {
+                name: value for name, value in request.args.items()
+                if name not in ('group_by', 'rollup', 'limit')
+            }
+            try:
+                limit = request.args.get('limit', type=int)
+                usage = self.middleware.get_usage(
+                    group_by,
+                    filters,
+                    rollup=request.args.get('rollup', '0') not in ('0', 'false', ''),
+                    limit=limit
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            return jsonify(usage)
+        
+        @self.app.route('/api/history', methods=['GET'])
+        def get_history():
+            """按天的 Token 用量历史（?days=7&group_by=project|model）"""
+            if self.middleware is None:
+                return jsonify({'error': 'Middleware not available'}), 500
+            
+            try:
+                history = self.middleware.get_token_history(
+                    days=request.args.get('days', 7, type=int),
+                    group_by=request.args.get('group_by') or None
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if history is None:
+                return jsonify({'error': 'Token store not enabled'}), 404
+            return jsonify(history)
+        
+        @self.app.route('/api/cache', methods=['GET'])
+        def get_cache():
+            """
+            Prompt 缓存统计
+            
+            无参数：全局指标 + 缓存最浪费的会话（&limit=20）
+            ?project=...&session_id=...[&agent_id=...]：单个会话的指标和最近各轮明细
+            """
+            if self.middleware is None:
+                return jsonify({'error': 'Middleware not available'}), 500
+            
+            session_id = request.args.get('session_id')
+            if session_id:
+                session = self.middleware.get_cache_session(
+                    request.args.get('project', ''),
+                    session_id,
+                    request.args.get('agent_id') or None
+                )
+                if session is None:
+                    return jsonify({'error': 'Session not found'}), 404
+                return jsonify(session)
+            
+            return jsonify(self.middleware.get_cache_stats(request.args.get('limit', 20, type=int)))
+        
+        @self.app.route('/api/cache/events', methods=['GET'])
+        def get_cache_events():
+            """缓存失效事件（?since=<上次返回的 last_seq> 增量拉取）"""
+            if self.middleware is None:
+                return jsonify({'error': 'Middleware not available'}), 500
+            
+            return jsonify(self.middleware.get_cache_events(request.args.get('since', 0, type=int)))
+        
+        @self.app.route('/api/sessions', methods=['GET'])
+        def get_sessions():
+            """获取会话列表"""
+            if self.middleware is None:
+                return jsonify({'error': 'Middleware not available'}), 500
+            
+            return jsonify(self.middleware.get_sessions())
+        
+        @self.app.route('/api/pipeline', methods=['GET'])
+        def get_pipeline():
+            """获取事件流水线统计"""
+            if self.middleware is None:
+                return jsonify({'error': 'Middleware not available'}), 500
+            
+            return jsonify(self.middleware.get_pipeline_stats())
+        
+        @self.app.route('/api/loop', methods=['GET'])
+        def get_loop():
+            """获取事件循环延迟统计"""
+            if self.middleware is None:
+                return jsonify({'error': 'Middleware not available'}), 500
+            
+            return jsonify(self.middleware.get_loop_stats())
+        
+        @self.app.route('/api/backfill', methods=['GET'])
+        def get_backfill():
+            """获取历史回填进度和结果"""
+            if self.middleware is None:
+                return jsonify({'error': 'Middleware not available'}), 500
+            
+            return jsonify(self.middleware.get_backfill_stats())
+        
         @self.app.route('/api/health', methods=['GET'])
         def health_check():
             """健康检查"""
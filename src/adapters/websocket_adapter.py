@@ -1,15 +1,106 @@
 # -*- coding: utf-8 -*-
 """
 WebSocketAdapter - WebSocket 实时推送适配器
+
+每个客户端拥有独立的有界发送队列和写任务：
+- 事件只序列化一次，广播时只是入队，不等待任何客户端
+- 客户端跟不上时按会话合并状态消息：同一 (session, agent) 的旧状态被最新状态替换，
+  否则丢弃最旧的状态消息；非状态消息（缓存分析等）不会被替换或丢弃
+- 持续落后超过 max_lag_seconds 的客户端被断开
 """
 
 import asyncio
+import json
+import time
+from collections import deque
 import websockets
-from typing import Set, Optional, Dict
+from typing import Deque, Dict, Hashable, Optional, Tuple
 from src.plugins.base import StateEvent
 from .base import OutputAdapter
 
 
+class _ClientChannel:
+    """单个客户端的发送队列 + 写任务"""
+    
+    def __init__(self, websocket, queue_size: int, send_timeout: float):
+        self.websocket = websocket
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        
+        # (合并键, 消息)：合并键为 None 的消息不可合并
+        self.queue: Deque[Tuple[Optional[Hashable], str]] = deque()
+        self.ready = asyncio.Event()
+        # 队列满的起始时间（None 表示未落后）
+        self.lagging_since: Optional[float] = None
+        self.task = asyncio.create_task(self._run())
+        
+        # 统计
+        self.sent = 0
+        self.coalesced = 0
+    
+    def push(self, message: str, key: Optional[Hashable] = None):
+        """
+        入队（不等待）
+
+        Args:
+            message: 已序列化的消息
+            key: 合并键（同键的新消息可以替换队列中的旧消息）；None 表示必须送达
+        """
+        if len(self.queue) >= self.queue_size:
+            # 落后：先合并同键的旧消息，否则丢弃最旧的可合并消息；
+            # 队列中全是不可合并的消息时照常入队（持续落后的客户端会被断开）
+            if self.lagging_since is None:
+                self.lagging_since = time.monotonic()
+            index = self._find(key) if key is not None else None
+            if index is None:
+                index = self._find_coalescible()
+            if index is not None:
+                del self.queue[index]
+                self.coalesced += 1
+        self.queue.append((key, message))
+        self.ready.set()
+    
+    def _find(self, key: Hashable) -> Optional[int]:
+        """队列中同键消息的位置"""
+        for index, (queued_key, _) in enumerate(self.queue):
+            if queued_key == key:
+                return index
+        return None
+    
+    def _find_coalescible(self) -> Optional[int]:
+        """最旧的可合并消息的位置"""
+        for index, (queued_key, _) in enumerate(self.queue):
+            if queued_key is not None:
+                return index
+        return None
+    
+    def lag(self, now: float) -> float:
+        """持续落后的时长（秒）"""
+        return 0.0 if self.lagging_since is None else now - self.lagging_since
+    
+    async def close(self, code: int = 1000, reason: str = ''):
+        """停止写任务并关闭连接"""
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        try:
+            await asyncio.wait_for(self.websocket.close(code, reason), self.send_timeout)
+        except Exception:
+            pass
+    
+    async def _run(self):
+        """写循环：按顺序发送队列中的消息"""
+        while True:
+            await self.ready.wait()
+            
+            while self.queue:
+                _, message = self.queue.popleft()
+                await asyncio.wait_for(self.websocket.send(message), self.send_timeout)
+                self.sent += 1
+            
+            self.ready.clear()
+            self.lagging_since = None
+
+
 class WebSocketAdapter(OutputAdapter):
     """WebSocket 实时推送适配器"""
     
@@ -17,9 +108,19 @@ class WebSocketAdapter(OutputAdapter):
         super().__init__(config)
         self.host = self.config.get('host', '127.0.0.1')
         self.port = self.config.get('port', 8765)
+        self.client_queue_size = max(self.config.get('client_queue_size', 32), 1)
+        self.send_timeout = self.config.get('send_timeout', 5.0)
+        self.max_lag_seconds = self.config.get('max_lag_seconds', 10.0)
         
-        self.clients: Set[websockets.WebSocketServerProtocol] = set()
+        self.clients: Dict[websockets.WebSocketServerProtocol, _ClientChannel] = {}
         self.server: Optional[websockets.WebSocketServer] = None
+        
+        # 断开落后客户端的任务（强引用）
+        self._closing: set = set()
+        
+        # 统计
+        self.broadcasts = 0
+        self.lagged_disconnects = 0
     
     async def start(self):
         """启动 WebSocket 服务器"""
@@ -48,8 +149,11 @@ class WebSocketAdapter(OutputAdapter):
         print("[WebSocket] Stopping...")
         
         # 关闭所有客户端
-        for client in self.clients:
-            await client.close()
+        channels = list(self.clients.values())
+        self.clients.clear()
+        await asyncio.gather(*(channel.close() for channel in channels), return_exceptions=True)
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
         
         # 关闭服务器
         if self.server:
@@ -60,33 +164,86 @@ class WebSocketAdapter(OutputAdapter):
         print("[WebSocket] [OK] Stopped")
     
     async def send(self, event: StateEvent):
-        """广播事件到所有客户端"""
+        """广播事件到所有客户端（只入队，不等待发送）"""
         if not self.running or not self.clients:
             return
         
+        # 只序列化一次；同一会话 / Agent 的状态可合并
         message = event.to_json()
+        key = ('status', event.details.get('session_id'), event.details.get('agent_id'))
+        self.broadcasts += 1
+        
+        now = time.monotonic()
+        lagged = []
+        
+        for websocket, channel in self.clients.items():
+            if channel.task.done():
+                # 写任务已结束（发送超时 / 连接断开）
+                lagged.append(websocket)
+                continue
+            
+            channel.push(message, key)
+            if channel.lag(now) > self.max_lag_seconds:
+                lagged.append(websocket)
+        
+        for websocket in lagged:
+            self._disconnect(websocket, 'client lagging')
+    
+    async def send_message(self, message: Dict):
+        """广播非状态消息（JSON，只入队，不合并）"""
+        if not self.running or not self.clients:
+            return
+        
+        data = json.dumps(message, ensure_ascii=False)
+        now = time.monotonic()
+        lagged = []
+        
+        for websocket, channel in self.clients.items():
+            if channel.task.done():
+                lagged.append(websocket)
+                continue
+            
+            channel.push(data)
+            if channel.lag(now) > self.max_lag_seconds:
+                lagged.append(websocket)
         
-        # 广播到所有客户端
-        disconnected_clients = set()
+        for websocket in lagged:
+            self._disconnect(websocket, 'client lagging')
+    
+    def get_stats(self) -> Dict:
+        """获取广播统计"""
+        now = time.monotonic()
+        channels = list(self.clients.values())
+        return {
+            'clients': len(channels),
+            'broadcasts': self.broadcasts,
+            'sent': sum(channel.sent for channel in channels),
+            'coalesced': sum(channel.coalesced for channel in channels),
+            'queued': sum(len(channel.queue) for channel in channels),
+            'lagging': sum(1 for channel in channels if channel.lag(now) > 0),
+            'lagged_disconnects': self.lagged_disconnects,
+        }
+    
+    def _disconnect(self, websocket, reason: str):
+        """在后台断开客户端"""
+        channel = self.clients.pop(websocket, None)
+        if channel is None:
+            return
         
-        for client in self.clients:
-            try:
-                await client.send(message)
-            except websockets.exceptions.ConnectionClosed:
-                disconnected_clients.add(client)
-            except Exception as e:
-                print(f"[WebSocket] Error sending to client: {e}")
-                disconnected_clients.add(client)
+        self.lagged_disconnects += 1
+        print(f"[WebSocket] Disconnecting {websocket.remote_address}: {reason}")
         
-        # 移除断开的客户端
-        self.clients -= disconnected_clients
+        # 1013: Try Again Later
+        task = asyncio.create_task(channel.close(1013, reason))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
     
-    async def _handle_client(self, websocket: websockets.WebSocketServerProtocol, path: str):
-        """处理客户端连接"""
+    async def _handle_client(self, websocket: websockets.WebSocketServerProtocol, path: Optional[str] = None):
+        """处理客户端连接（新版 websockets 不再传入 path）"""
         print(f"[WebSocket] Client connected: {websocket.remote_address}")
         
         # 添加到客户端集合
-        self.clients.add(websocket)
+        self.clients[websocket] = _ClientChannel(websocket, self.client_queue_size, self.send_timeout)
         
         try:
             # 保持连接（等待客户端消息）
@@ -99,5 +256,7 @@ class WebSocketAdapter(OutputAdapter):
         
         finally:
             # 移除客户端
-            self.clients.discard(websocket)
+            channel = self.clients.pop(websocket, None)
+            if channel is not None:
+                channel.task.cancel()
             print(f"[WebSocket] Client disconnected: {websocket.remote_address}")
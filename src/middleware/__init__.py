@@ -8,6 +8,13 @@ from .event_bus import EventBus
 from .fusion import StateFusion
 from .privacy import PrivacyFilter
 from .token_stats import TokenStats
+from .token_ledger import TokenLedger
+from .token_rollup import TokenRollup
+from .usage_cube import UsageCube
+from .token_store import TokenStore
+from .cache_analytics import CacheAnalytics
+from .session_manager import SessionManager
+from .pipeline import EventPipeline
 
 __all__ = [
     'Middleware',
@@ -15,4 +22,11 @@ __all__ = [
     'StateFusion',
     'PrivacyFilter',
     'TokenStats',
+    'TokenLedger',
+    'TokenRollup',
+    'UsageCube',
+    'TokenStore',
+    'CacheAnalytics',
+    'SessionManager',
+    'EventPipeline',
 ]
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+CacheAnalytics - 按会话 / 按轮次的 Prompt 缓存分析
+
+由 UsageDelta 增量计算（每条 assistant 消息 = 一轮 API 调用），不重新解析日志。
+按 (project, session_id, agent_id) 分别统计（子 Agent 有自己的缓存前缀）：
+
+- 命中率：cache_read / (input + cache_write + cache_read)，包括累计值和最近 window_turns 轮的滚动值
+- 写放大：cache_write / cache_read（每读取 1 个缓存 token 写入了多少；前缀写入后被反复复用时远小于 1）
+- 净节省：按 input 价格折算，cache_write 为 1.25 倍、cache_read 为 0.1 倍，频繁失效时可能为负
+
+缓存失效（cache bust）检测：上一轮结束时已缓存的前缀为 cache_read + cache_write，
+本轮 cache_read 比它少了至少 bust_min_tokens 且至少 bust_drop_ratio，同时有新的 cache_write，
+说明前缀被重新写入。原因按以下顺序推断：
+- model_changed：换了模型（缓存按模型隔离）
+- ttl_expired：距上一轮超过 cache_ttl（默认 5 分钟）
+- context_shrunk：本轮 prompt 不到上一轮的一半（上下文压缩 / 清空）
+- prefix_changed：其他（CLAUDE.md、系统提示或工具列表变化等导致前缀不同）
+
+每一轮的指标通过 'cache_turn' 回调发送；失效事件通过 'cache_bust' 回调发送，
+并保存在最近 max_events 个事件的环形缓冲中（按序号增量拉取）。
+
+增量在事件循环中累加，查询来自 HTTP 线程：两者共用一把锁（回调在锁外触发）。
+"""
+
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from src.plugins.base import UsageDelta
+
+# 相对 input 价格的倍数
+CACHE_WRITE_MULTIPLIER = 1.25
+CACHE_READ_MULTIPLIER = 0.1
+
+CacheKey = Tuple[str, str, Optional[str]]
+
+
+def _ratio(numerator: int, denominator: int) -> Optional[float]:
+    return round(numerator / denominator, 4) if denominator else None
+
+
+class SessionCache:
+    """单个 (project, session, agent) 的缓存统计"""
+
+    __slots__ = (
+        'project', 'session_id', 'agent_id', 'window_turns',
+        'input', 'output', 'cache_write', 'cache_read', 'turns', 'busts', 'wasted_write',
+        'recent', 'recent_prompt', 'recent_read',
+        'last_message_id', 'last_model', 'last_time',
+    )
+
+    def __init__(self, project: str, session_id: str, agent_id: Optional[str], window_turns: int):
+        self.project = project
+        self.session_id = session_id
+        self.agent_id = agent_id
+        self.window_turns = window_turns
+
+        self.input = 0
+        self.output = 0
+        self.cache_write = 0
+        self.cache_read = 0
+        self.turns = 0
+        self.busts = 0
+        # 失效后重新写入的缓存 token
+        self.wasted_write = 0
+
+        # 最近 window_turns 轮：[timestamp, input, output, cache_write, cache_read, bust 原因]
+        self.recent: Deque[list] = deque(maxlen=window_turns)
+        self.recent_prompt = 0
+        self.recent_read = 0
+
+        self.last_message_id = ''
+        self.last_model = ''
+        self.last_time: Optional[float] = None
+
+    def add_turn(self, delta: UsageDelta, bust: Optional[str]):
+        if len(self.recent) == self.window_turns:
+            _, old_input, _, old_write, old_read, _ = self.recent[0]
+            self.recent_prompt -= old_input + old_write + old_read
+            self.recent_read -= old_read
+        self.recent.append([delta.timestamp, delta.input, delta.output, delta.cache_write, delta.cache_read, bust])
+        self.recent_prompt += delta.input + delta.cache_write + delta.cache_read
+        self.recent_read += delta.cache_read
+
+        self.turns += 1
+        self.last_message_id = delta.message_id
+        if delta.model:
+            self.last_model = delta.model
+        self.last_time = delta.timestamp
+
+    def update_turn(self, delta: UsageDelta):
+        """同一消息后续行的增量（通常只有 output 增加）"""
+        turn = self.recent[-1]
+        turn[1] += delta.input
+        turn[2] += delta.output
+        turn[3] += delta.cache_write
+        turn[4] += delta.cache_read
+        self.recent_prompt += delta.input + delta.cache_write + delta.cache_read
+        self.recent_read += delta.cache_read
+
+    @property
+    def prompt(self) -> int:
+        return self.input + self.cache_write + self.cache_read
+
+    @property
+    def cost_savings(self) -> float:
+        """相对不使用缓存节省的 input 等效 token（负数表示缓存写入的溢价超过了读取节省）"""
+        return (self.cache_read * (1 - CACHE_READ_MULTIPLIER)
+                - self.cache_write * (CACHE_WRITE_MULTIPLIER - 1))
+
+    def to_dict(self, turns: bool = False) -> Dict:
+        data = {
+            'project': self.project,
+            'session_id': self.session_id,
+            'agent_id': self.agent_id,
+            'model': self.last_model,
+            'turns': self.turns,
+            'input': self.input,
+            'output': self.output,
+            'cache_write': self.cache_write,
+            'cache_read': self.cache_read,
+            'hit_ratio': _ratio(self.cache_read, self.prompt),
+            'rolling_hit_ratio': _ratio(self.recent_read, self.recent_prompt),
+            'write_amplification': _ratio(self.cache_write, self.cache_read),
+            'cost_savings': round(self.cost_savings, 2),
+            'busts': self.busts,
+            'wasted_write_tokens': self.wasted_write,
+        }
+        if turns:
+            data['recent_turns'] = [
+                {
+                    'timestamp': timestamp,
+                    'input': input_tokens,
+                    'output': output_tokens,
+                    'cache_write': cache_write,
+                    'cache_read': cache_read,
+                    'hit_ratio': _ratio(cache_read, input_tokens + cache_write + cache_read),
+                    'bust': bust,
+                }
+                for timestamp, input_tokens, output_tokens, cache_write, cache_read, bust in self.recent
+            ]
+        return data
+
+
+class CacheAnalytics:
+    """Prompt 缓存分析"""
+
+    def __init__(self, config: Optional[dict] = None):
+        self.config = config or {}
+        self.enabled = self.config.get('enabled', True)
+        self.window_turns = max(1, self.config.get('window_turns', 20))
+        self.bust_min_tokens = self.config.get('bust_min_tokens', 2048)
+        self.bust_drop_ratio = self.config.get('bust_drop_ratio', 0.5)
+        self.cache_ttl = self.config.get('cache_ttl', 300)
+        self.max_sessions = self.config.get('max_sessions', 1024)
+
+        # (project, session_id, agent_id) → SessionCache（LRU 有界）
+        self.sessions: 'OrderedDict[CacheKey, SessionCache]' = OrderedDict()
+
+        # 最近的失效事件（序号递增）
+        self.events: Deque[Dict] = deque(maxlen=self.config.get('max_events', 256))
+        self.sequence = 0
+        self._lock = threading.Lock()
+
+        # 回调
+        self.callbacks: Dict[str, list] = {
+            'cache_turn': [],
+            'cache_bust': [],
+        }
+
+        # 全局统计（包括已淘汰的会话）
+        self.input = 0
+        self.cache_write = 0
+        self.cache_read = 0
+        self.turns = 0
+        self.busts = 0
+        self.wasted_write = 0
+        self.busts_by_reason: Dict[str, int] = {}
+
+    def register_callback(self, event: str, callback: Callable):
+        """注册回调"""
+        if event in self.callbacks:
+            self.callbacks[event].append(callback)
+
+    def _emit(self, event: str, data: Dict):
+        """触发回调"""
+        for callback in self.callbacks.get(event, []):
+            try:
+                callback(event, data)
+            except Exception as e:
+                print(f"[CacheAnalytics] Callback error: {e}")
+
+    def apply(self, delta: UsageDelta) -> Optional[Dict]:
+        """
+        累加一个增量；本轮检测到缓存失效时返回失效事件
+
+        Returns:
+            失效事件（同时通过 'cache_bust' 回调发送），否则 None
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            turn, event = self._apply(delta)
+        if turn is not None:
+            self._emit('cache_turn', turn)
+        if event is not None:
+            self._emit('cache_bust', event)
+        return event
+
+    def _apply(self, delta: UsageDelta) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """累加增量（持有锁），返回待发送的 (cache_turn 数据, 失效事件)"""
+        key = (delta.project, delta.session_id, delta.agent_id)
+        session = self.sessions.get(key)
+        if session is None:
+            session = self.sessions[key] = SessionCache(delta.project, delta.session_id, delta.agent_id,
+                                                        self.window_turns)
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        else:
+            self.sessions.move_to_end(key)
+
+        session.input += delta.input
+        session.output += delta.output
+        session.cache_write += delta.cache_write
+        session.cache_read += delta.cache_read
+        self.input += delta.input
+        self.cache_write += delta.cache_write
+        self.cache_read += delta.cache_read
+
+        if not delta.new_message:
+            if session.recent and delta.message_id == session.last_message_id:
+                session.update_turn(delta)
+            return None, None
+
+        event = self._detect_bust(session, delta)
+        session.add_turn(delta, event['reason'] if event else None)
+        self.turns += 1
+        turn = None
+        if self.callbacks['cache_turn']:
+            prompt = delta.input + delta.cache_write + delta.cache_read
+            turn = {
+                'event': 'cache_turn',
+                'project': session.project,
+                'session_id': session.session_id,
+                'agent_id': session.agent_id,
+                'message_id': delta.message_id,
+                'model': delta.model or session.last_model,
+                'timestamp': delta.timestamp,
+                'input': delta.input,
+                'cache_write': delta.cache_write,
+                'cache_read': delta.cache_read,
+                'hit_ratio': _ratio(delta.cache_read, prompt),
+                'rolling_hit_ratio': _ratio(session.recent_read, session.recent_prompt),
+                'bust': event['reason'] if event else None,
+            }
+
+        if event is not None:
+            session.busts += 1
+            session.wasted_write += event['rewritten_tokens']
+            self.busts += 1
+            self.wasted_write += event['rewritten_tokens']
+            self.busts_by_reason[event['reason']] = self.busts_by_reason.get(event['reason'], 0) + 1
+            self.sequence += 1
+            event['seq'] = self.sequence
+            self.events.append(event)
+        return turn, event
+
+    def _detect_bust(self, session: SessionCache, delta: UsageDelta) -> Optional[Dict]:
+        """与上一轮比较：已缓存的前缀没有被读取、而是被重新写入"""
+        if not session.recent:
+            return None
+
+        _, prev_input, _, prev_write, prev_read, _ = session.recent[-1]
+        expected = prev_read + prev_write
+        lost = expected - delta.cache_read
+        if (lost < self.bust_min_tokens
+                or lost < expected * self.bust_drop_ratio
+                or delta.cache_write == 0):
+            return None
+
+        gap = delta.timestamp - session.last_time if session.last_time is not None else 0.0
+        prompt = delta.input + delta.cache_write + delta.cache_read
+        if delta.model and session.last_model and delta.model != session.last_model:
+            reason = 'model_changed'
+        elif gap >= self.cache_ttl:
+            reason = 'ttl_expired'
+        elif prompt < (prev_input + expected) * 0.5:
+            reason = 'context_shrunk'
+        else:
+            reason = 'prefix_changed'
+
+        return {
+            'event': 'cache_bust',
+            'reason': reason,
+            'project': session.project,
+            'session_id': session.session_id,
+            'agent_id': session.agent_id,
+            'message_id': delta.message_id,
+            'model': delta.model or session.last_model,
+            'timestamp': delta.timestamp,
+            'idle_seconds': round(gap, 1),
+            'expected_cached_tokens': expected,
+            'cache_read': delta.cache_read,
+            'cache_write': delta.cache_write,
+            'rewritten_tokens': min(lost, delta.cache_write),
+        }
+
+    def get_session(self, project: str, session_id: str, agent_id: Optional[str] = None) -> Optional[Dict]:
+        """单个 (session, agent) 的缓存统计和最近各轮明细"""
+        with self._lock:
+            session = self.sessions.get((project, session_id, agent_id))
+            return session.to_dict(turns=True) if session is not None else None
+
+    def get_events(self, since: int = 0) -> Dict:
+        """序号大于 since 的失效事件（环形缓冲中已淘汰的不再返回）"""
+        with self._lock:
+            return {
+                'events': [event for event in self.events if event['seq'] > since],
+                'last_seq': self.sequence,
+            }
+
+    def get_stats(self, limit: Optional[int] = 20) -> Dict:
+        """全局缓存统计，以及按失效重写 token 排序的会话（缓存最浪费的在前）"""
+        with self._lock:
+            cache_write, cache_read = self.cache_write, self.cache_read
+            sessions = sorted(
+                self.sessions.values(),
+                key=lambda session: (session.wasted_write, session.cache_write),
+                reverse=True
+            )
+            if limit is not None:
+                sessions = sessions[:limit]
+
+            return {
+                'turns': self.turns,
+                'hit_ratio': _ratio(cache_read, self.input + cache_write + cache_read),
+                'write_amplification': _ratio(cache_write, cache_read),
+                'cost_savings': round(cache_read * (1 - CACHE_READ_MULTIPLIER)
+                                      - cache_write * (CACHE_WRITE_MULTIPLIER - 1), 2),
+                'busts': self.busts,
+                'busts_by_reason': dict(self.busts_by_reason),
+                'wasted_write_tokens': self.wasted_write,
+                'tracked_sessions': len(self.sessions),
+                'sessions': [session.to_dict() for session in sessions],
+            }
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self.sessions.clear()
+            self.events.clear()
+            self.input = 0
+            self.cache_write = 0
+            self.cache_read = 0
+            self.turns = 0
+            self.busts = 0
+            self.wasted_write = 0
+            self.busts_by_reason.clear()
@@ -1,16 +1,28 @@
 # -*- coding: utf-8 -*-
 """
 Middleware - 中间件核心
-管理插件、事件总线、状态融合、隐私过滤、Token 统计
+管理插件、事件总线、状态融合、隐私过滤、Token 统计、会话管理
+
+插件事件经过有界的分阶段流水线处理：
+隐私过滤 → Token 统计 → 状态融合 → 输出分发
+
+Token 用量增量（UsageDelta）不经过流水线，在回调中直接累加到账本（不会被合并或丢弃），
+启用 token_store 时同时写入持久化日志
 """
 
 import asyncio
-from typing import List, Dict, Optional
-from src.plugins.base import BasePlugin, StateEvent
+from pathlib import Path
+from typing import List, Dict, Optional, Set
+from src.plugins.base import BasePlugin, StateEvent, UsageDelta
 from .event_bus import EventBus
 from .fusion import StateFusion
 from .privacy import PrivacyFilter
 from .token_stats import TokenStats
+from .token_store import TokenStore
+from .cache_analytics import CacheAnalytics
+from .session_manager import SessionManager
+from .pipeline import EventPipeline, OVERFLOW_COALESCE
+from src.utils.loop_monitor import LoopLagMonitor
 
 
 class Middleware:
@@ -37,8 +49,59 @@ class Middleware:
         token_config = config.get('middleware', {}).get('token_stats', {})
         self.token_stats = TokenStats(token_config)
         
+        # Prompt 缓存分析（按会话 / 轮次；失效事件推送给输出适配器）
+        cache_config = config.get('middleware', {}).get('cache_analytics', {})
+        self.cache_analytics = CacheAnalytics(cache_config)
+        self.cache_analytics.register_callback('cache_bust', self._on_cache_event)
+        if cache_config.get('stream_turns', False):
+            self.cache_analytics.register_callback('cache_turn', self._on_cache_event)
+        self._message_tasks: Set[asyncio.Task] = set()
+        
+        # Token 用量持久化（追加写日志 + 快照，启动时恢复合计）
+        store_config = config.get('middleware', {}).get('token_store', {})
+        self.token_store: Optional[TokenStore] = None
+        self._store_task: Optional[asyncio.Task] = None
+        if store_config.get('enabled', False):
+            store_path = store_config.get('path', 'auto')
+            if store_path == 'auto':
+                store_path = Path.home() / '.claudecat' / 'tokens'
+            self.token_store = TokenStore(
+                store_path,
+                fsync_interval=store_config.get('fsync_interval', 1.0),
+                snapshot_interval=store_config.get('snapshot_interval', 300.0),
+                snapshot_records=store_config.get('snapshot_records', 100_000),
+                max_messages=store_config.get('max_messages', 4096)
+            )
+        
+        # 会话管理（由事件中的会话身份驱动）
+        session_config = config.get('middleware', {}).get('session_manager', {})
+        self.session_manager: Optional[SessionManager] = None
+        if session_config.get('enabled', True):
+            self.session_manager = SessionManager(session_config)
+            for session_event in self.session_manager.callbacks:
+                self.session_manager.register_callback(session_event, self._on_session_event)
+        
         # 输出适配器
         self.adapters: List = []
+        
+        # 事件流水线（每个阶段一个有界队列）
+        pipeline_config = config.get('middleware', {}).get('pipeline', {})
+        self.pipeline = EventPipeline(pipeline_config)
+        self.pipeline.add_stage('privacy', self._privacy_stage)
+        self.pipeline.add_stage('tokens', self._token_stage)
+        self.pipeline.add_stage('fusion', self._fusion_stage)
+        self.pipeline.add_stage('fanout', self._fanout_stage,
+                                overflow=OVERFLOW_COALESCE,
+                                can_coalesce=self._can_coalesce)
+        
+        # 事件循环延迟监控
+        loop_config = config.get('middleware', {}).get('loop_monitor', {})
+        self.loop_monitor: Optional[LoopLagMonitor] = None
+        if loop_config.get('enabled', True):
+            self.loop_monitor = LoopLagMonitor(
+                interval=loop_config.get('interval_ms', 100) / 1000,
+                stall_threshold=loop_config.get('stall_ms', 50) / 1000
+            )
     
     def register_plugin(self, plugin: BasePlugin):
         """注册插件"""
@@ -46,6 +109,7 @@ class Middleware:
         
         # 注册插件回调
         plugin.register_callback(self._on_plugin_event)
+        plugin.register_usage_callback(self._on_usage)
         
         print(f"[Middleware] Registered plugin: {plugin.metadata.name}")
     
@@ -58,6 +122,29 @@ class Middleware:
         """启动中间件"""
         print("[Middleware] Starting...")
         
+        # 恢复持久化的 Token 合计（在插件产生增量之前）
+        if self.token_store:
+            self.token_store.open()
+            self.token_stats.restore(self.token_store)
+            # 崩溃后插件会重读检查点之后、已写入日志的行：交给插件按消息去重
+            message_usage = self.token_store.message_usage()
+            for plugin in self.plugins:
+                plugin.restore_message_usage(message_usage)
+            stats = self.token_store.get_stats()
+            print(f"[Middleware] Restored token totals ({stats['cells']} cells, "
+                  f"{stats['replayed']} journal records, {stats['load_ms']} ms)")
+            self._store_task = asyncio.create_task(self._store_loop())
+        
+        # 启动会话管理器
+        if self.session_manager:
+            await self.session_manager.start()
+        
+        if self.loop_monitor:
+            self.loop_monitor.start()
+        
+        # 启动事件流水线（插件启动时可能立即产生事件）
+        self.pipeline.start()
+        
         # 启动所有插件
         for plugin in self.plugins:
             if plugin.enabled:
@@ -81,41 +168,181 @@ class Middleware:
         for adapter in self.adapters:
             await adapter.stop()
         
+        # 停止事件流水线
+        await self.pipeline.stop()
+        
+        # 停止会话管理器
+        if self.session_manager:
+            await self.session_manager.stop()
+        
+        if self.loop_monitor:
+            await self.loop_monitor.close()
+        
+        # 写入最终快照（下次启动不需要重放日志）
+        if self._store_task:
+            self._store_task.cancel()
+            try:
+                await self._store_task
+            except asyncio.CancelledError:
+                pass
+            self._store_task = None
+        if self.token_store:
+            await asyncio.get_running_loop().run_in_executor(None, self.token_store.close)
+        
         print("[Middleware] [OK] Stopped")
     
     def _on_plugin_event(self, event: StateEvent):
         """处理插件事件（同步回调）"""
-        # 异步处理
-        asyncio.create_task(self._process_event(event))
+        self.pipeline.submit(event)
+    
+    def _on_usage(self, delta: UsageDelta):
+        """处理插件的 Token 用量增量（同步回调，O(1)）"""
+        self.token_stats.apply(delta)
+        self.cache_analytics.apply(delta)
+        if self.token_store:
+            self.token_store.append(delta)
     
-    async def _process_event(self, event: StateEvent):
-        """处理事件（异步）"""
+    def _on_cache_event(self, event: str, data: Dict):
+        """缓存分析事件：推送给所有输出适配器（不经过状态流水线）"""
+        if event == 'cache_bust':
+            print(f"[Middleware] Cache bust ({data['reason']}): {data['project']}/{data['session_id']} "
+                  f"rewrote {data['rewritten_tokens']:,} tokens")
         try:
-            # 1. 隐私过滤
-            filtered_event = self.privacy_filter.filter_event(event)
-            
-            # 2. Token 统计
-            self.token_stats.update(filtered_event)
-            
-            # 3. 状态融合
-            fused_event = self.fusion.fuse_events([filtered_event])
-            
-            if fused_event is None:
-                return
-            
-            # 4. 发布到事件总线
-            self.event_bus.publish(fused_event)
-            
-            # 5. 输出到所有适配器
-            for adapter in self.adapters:
-                await adapter.send(fused_event)
-        
-        except Exception as e:
-            print(f"[Middleware] Error processing event: {e}")
-    
-    def get_token_stats(self) -> Dict:
-        """获取 Token 统计"""
-        return self.token_stats.get_stats()
+            task = asyncio.get_running_loop().create_task(self._send_message(data))
+        except RuntimeError:
+            return  # 没有运行中的事件循环（如离线统计）
+        self._message_tasks.add(task)
+        task.add_done_callback(self._message_tasks.discard)
+    
+    async def _send_message(self, message: Dict):
+        for adapter in self.adapters:
+            try:
+                await adapter.send_message(message)
+            except Exception as e:
+                print(f"[Middleware] Adapter {adapter.__class__.__name__} error: {e}")
+    
+    async def _store_loop(self):
+        """按 fsync_interval 批量落盘 Token 日志，必要时压缩为快照（文件 I/O 在线程池中执行）"""
+        loop = asyncio.get_running_loop()
+        store = self.token_store
+        while True:
+            await asyncio.sleep(store.fsync_interval)
+            try:
+                if store.needs_snapshot:
+                    await loop.run_in_executor(None, store.compact, store.prepare_snapshot())
+                else:
+                    pending = store.take()
+                    if pending[2]:
+                        await loop.run_in_executor(None, store.flush, pending)
+            except OSError as e:
+                print(f"[Middleware] [WARN] Token store write failed: {e}")
+    
+    async def _privacy_stage(self, event: StateEvent) -> Optional[StateEvent]:
+        """阶段 1：会话追踪 + 隐私过滤"""
+        # 在隐私过滤前读取会话身份
+        self._track_session(event)
+        return self.privacy_filter.filter_event(event)
+    
+    async def _token_stage(self, event: StateEvent) -> Optional[StateEvent]:
+        """阶段 2：附加当前 Token 合计"""
+        self.token_stats.update(event)
+        return event
+    
+    async def _fusion_stage(self, event: StateEvent) -> Optional[StateEvent]:
+        """阶段 3：状态融合，并发布到事件总线"""
+        fused_event = self.fusion.fuse_events([event])
+        if fused_event is None:
+            return None
+        
+        self.event_bus.publish(fused_event)
+        return fused_event
+    
+    async def _fanout_stage(self, event: StateEvent) -> None:
+        """阶段 4：输出到所有适配器"""
+        for adapter in self.adapters:
+            try:
+                await adapter.send(event)
+            except Exception as e:
+                print(f"[Middleware] Adapter {adapter.__class__.__name__} error: {e}")
+    
+    @staticmethod
+    def _can_coalesce(queued: StateEvent, new: StateEvent) -> bool:
+        """输出队列满时，同一来源、同一会话的状态只保留最新的"""
+        return (queued.source == new.source
+                and queued.details.get('session_id') == new.details.get('session_id'))
+    
+    def _track_session(self, event: StateEvent):
+        """根据事件中的会话身份更新会话生命周期"""
+        if self.session_manager is None:
+            return
+        
+        session_id = event.details.get('session_id')
+        if not session_id:
+            return
+        
+        self.session_manager.on_session_start(session_id, event.details.get('project', 'unknown'))
+        
+        agent_id = event.details.get('agent_id')
+        if agent_id:
+            self.session_manager.add_agent(session_id, agent_id)
+    
+    def _on_session_event(self, event: str, data: Dict):
+        """会话生命周期回调"""
+        print(f"[Middleware] Session {event}: {data['id']} ({data['project']})")
+    
+    def get_sessions(self) -> List[Dict]:
+        """获取会话列表"""
+        if self.session_manager is None:
+            return []
+        return [session.to_dict() for session in list(self.session_manager.sessions.values())]
+    
+    def get_pipeline_stats(self) -> Dict:
+        """获取流水线各阶段统计"""
+        return self.pipeline.get_stats()
+    
+    def get_loop_stats(self) -> Dict:
+        """获取事件循环延迟统计"""
+        if self.loop_monitor is None:
+            return {}
+        return self.loop_monitor.get_stats()
+    
+    def get_backfill_stats(self) -> Dict:
+        """获取历史回填进度和结果（按插件名）"""
+        return {
+            plugin.metadata.name: plugin.get_backfill_stats()
+            for plugin in self.plugins
+            if hasattr(plugin, 'get_backfill_stats')
+        }
+    
+    def get_token_stats(self, window=None, step=None) -> Dict:
+        """获取 Token 统计（window：最近时间窗口，如 '5m'；step：窗口内时间序列的步长）"""
+        return self.token_stats.get_stats(window, step)
+    
+    def get_usage(self, group_by=(), filters: Optional[Dict[str, str]] = None,
+                  rollup: bool = False, limit: Optional[int] = None) -> Dict:
+        """获取按 model / project / session / agent_type 分组的 Token 用量"""
+        return self.token_stats.get_usage(group_by, filters, rollup, limit)
+    
+    def get_cache_stats(self, limit: Optional[int] = 20) -> Dict:
+        """获取 Prompt 缓存统计（全局 + 缓存最浪费的会话）"""
+        return self.cache_analytics.get_stats(limit)
+    
+    def get_cache_session(self, project: str, session_id: str, agent_id: Optional[str] = None) -> Optional[Dict]:
+        """获取单个 (session, agent) 的缓存统计和最近各轮明细"""
+        return self.cache_analytics.get_session(project, session_id, agent_id)
+    
+    def get_cache_events(self, since: int = 0) -> Dict:
+        """获取序号大于 since 的缓存失效事件"""
+        return self.cache_analytics.get_events(since)
+    
+    def get_token_history(self, days: int = 7, group_by: Optional[str] = None) -> Optional[Dict]:
+        """获取按天的 Token 用量历史（未启用持久化时返回 None）"""
+        if self.token_store is None:
+            return None
+        return {
+            'days': self.token_store.history(days, group_by),
+            'store': self.token_store.get_stats(),
+        }
     
     def get_current_status(self) -> Optional[StateEvent]:
         """获取当前状态"""
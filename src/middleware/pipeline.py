@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+EventPipeline - 有界异步事件流水线
+
+每个阶段（隐私过滤 → Token 统计 → 状态融合 → 输出分发）拥有一个有界
+asyncio.Queue 和一个工作任务：
+- 单工作任务保证事件按顺序处理
+- 队列满时按溢出策略处理：
+  - block：等待队列有空位（背压）；同步提交无法等待，先进入有界的待入队缓冲，
+    由一个任务按顺序移入队列，缓冲也满时丢弃最旧的待入队事件
+  - drop_oldest：丢弃最旧的事件
+  - coalesce_latest_status：用新事件替换队尾可合并的事件（只保留最新状态），
+    队尾不可合并时丢弃最旧的事件
+- 所有任务都有强引用，不会在执行中被回收
+- 每个阶段统计队列深度、处理数量、丢弃/合并数量和延迟
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_COALESCE = 'coalesce_latest_status'
+
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE)
+
+
+class StageQueue(asyncio.Queue):
+    """支持替换队尾元素的有界队列"""
+
+    def peek_last(self) -> Any:
+        return self._queue[-1]
+
+    def replace_last(self, item: Any):
+        self._queue[-1] = item
+
+
+class PipelineStage:
+    """流水线阶段"""
+
+    def __init__(self, name: str, handler: Callable[[Any], Awaitable[Optional[Any]]],
+                 maxsize: int = 256, overflow: str = OVERFLOW_BLOCK,
+                 can_coalesce: Optional[Callable[[Any, Any], bool]] = None,
+                 max_pending: Optional[int] = None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+
+        self.name = name
+        self.handler = handler
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.can_coalesce = can_coalesce or (lambda old, new: True)
+        self.next_stage: Optional['PipelineStage'] = None
+
+        self.queue: Optional[StageQueue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # 待入队的事件（block 策略下同步提交时队列已满），由一个任务按顺序移入队列
+        self.max_pending = maxsize if max_pending is None else max(1, max_pending)
+        self._pending: Deque[Tuple[float, Any]] = deque()
+        self._drain_task: Optional[asyncio.Task] = None
+
+        # 统计
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_depth = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self):
+        """启动工作任务"""
+        self.queue = StageQueue(self.maxsize)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止工作任务"""
+        tasks = [task for task in (self._drain_task, self._worker) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+        self._drain_task = None
+        self._pending.clear()
+
+    def submit(self, item: Any):
+        """同步提交（用于同步回调）"""
+        entry = (time.perf_counter(), item)
+
+        if self.overflow == OVERFLOW_BLOCK:
+            # 已有待入队的事件时也排队，保证顺序
+            if self._drain_task is not None or self.queue.full():
+                if len(self._pending) >= self.max_pending:
+                    # 待入队缓冲也满：按 drop_oldest 处理，内存有界
+                    self._pending.popleft()
+                    self.dropped += 1
+                self._pending.append(entry)
+                if self._drain_task is None:
+                    self._drain_task = asyncio.create_task(self._drain())
+            else:
+                self.queue.put_nowait(entry)
+        else:
+            self._put_with_overflow(entry)
+
+        self._track_depth()
+
+    async def put(self, item: Any):
+        """异步提交（上一阶段调用，block 策略下形成背压）"""
+        entry = (time.perf_counter(), item)
+
+        if self.overflow == OVERFLOW_BLOCK:
+            await self.queue.put(entry)
+        else:
+            self._put_with_overflow(entry)
+
+        self._track_depth()
+
+    async def _drain(self):
+        """按顺序把待入队的事件移入队列（等待队列有空位）"""
+        try:
+            while self._pending:
+                await self.queue.put(self._pending.popleft())
+        finally:
+            self._drain_task = None
+
+    def get_stats(self) -> Dict:
+        """获取阶段统计"""
+        return {
+            'depth': self.queue.qsize() if self.queue else 0,
+            'pending': len(self._pending),
+            'max_depth': self.max_depth,
+            'maxsize': self.maxsize,
+            'overflow': self.overflow,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'avg_latency_ms': round(self._latency_total / self.processed * 1000, 3) if self.processed else 0.0,
+            'max_latency_ms': round(self._latency_max * 1000, 3),
+        }
+
+    def _put_with_overflow(self, entry: Tuple[float, Any]):
+        """非阻塞入队，队列满时按策略处理"""
+        if not self.queue.full():
+            self.queue.put_nowait(entry)
+            return
+
+        if self.overflow == OVERFLOW_COALESCE and self.can_coalesce(self.queue.peek_last()[1], entry[1]):
+            # 保留原入队时间，延迟统计不被合并掩盖
+            self.queue.replace_last((self.queue.peek_last()[0], entry[1]))
+            self.coalesced += 1
+            return
+
+        self.queue.get_nowait()
+        self.dropped += 1
+        self.queue.put_nowait(entry)
+
+    def _track_depth(self):
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    async def _run(self):
+        """工作循环：按顺序处理，并交给下一阶段"""
+        while True:
+            enqueued_at, item = await self.queue.get()
+
+            try:
+                result = await self.handler(item)
+                if result is not None and self.next_stage is not None:
+                    await self.next_stage.put(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"[Pipeline] Stage '{self.name}' error: {e}")
+
+            latency = time.perf_counter() - enqueued_at
+            self.processed += 1
+            self._latency_total += latency
+            if latency > self._latency_max:
+                self._latency_max = latency
+
+
+class EventPipeline:
+    """有界异步事件流水线"""
+
+    def __init__(self, config: Optional[Dict] = None):
+        self.config = config or {}
+        self.queue_size = self.config.get('queue_size', 256)
+        self.overflow = self.config.get('overflow', OVERFLOW_BLOCK)
+        self.max_pending = self.config.get('max_pending')
+        self.stage_configs: Dict[str, Dict] = self.config.get('stages', {})
+
+        self.stages: List[PipelineStage] = []
+        self.running = False
+
+    def add_stage(self, name: str, handler: Callable[[Any], Awaitable[Optional[Any]]],
+                  overflow: Optional[str] = None,
+                  can_coalesce: Optional[Callable[[Any, Any], bool]] = None) -> PipelineStage:
+        """
+        添加阶段（按添加顺序连接）
+
+        handler 返回 None 表示事件在该阶段结束，不再传递
+        """
+        stage_config = self.stage_configs.get(name, {})
+        stage = PipelineStage(
+            name,
+            handler,
+            maxsize=stage_config.get('queue_size', self.queue_size),
+            overflow=stage_config.get('overflow', overflow or self.overflow),
+            can_coalesce=can_coalesce,
+            max_pending=stage_config.get('max_pending', self.max_pending)
+        )
+
+        if self.stages:
+            self.stages[-1].next_stage = stage
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        """启动所有阶段"""
+        if self.running:
+            return
+        for stage in self.stages:
+            stage.start()
+        self.running = True
+
+    async def stop(self):
+        """停止所有阶段"""
+        if not self.running:
+            return
+        for stage in self.stages:
+            await stage.stop()
+        self.running = False
+
+    def submit(self, item: Any):
+        """提交到第一个阶段"""
+        if not self.running or not self.stages:
+            return
+        self.stages[0].submit(item)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """获取所有阶段统计"""
+        return {stage.name: stage.get_stats() for stage in self.stages}
@@ -4,14 +4,23 @@ SessionManager - 会话管理器
 
 功能：
 - 追踪会话生命周期
-- 超时检测
+- 超时检测（最小堆定时器，O(log n)，所有会话共用一个事件循环定时器）
 - 会话统计
+
+状态转换：
+- active → idle：超过 timeout_minutes 无活动
+- idle → ended：超过 2 倍 timeout_minutes 无活动
+- ended → 删除：保留 retention_minutes 后移除
+- idle / ended 期间有新活动 → active
 """
 
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Dict, Set, Optional, Callable
+from typing import Dict, List, Set, Optional, Callable, Tuple
 import asyncio
+import heapq
+import itertools
+import time
 
 
 @dataclass
@@ -24,6 +33,10 @@ class Session:
     agents: Set[str] = field(default_factory=set)
     status: str = 'active'  # active, idle, ended
     end_time: Optional[datetime] = None
+    # 最后活动时间（事件循环时钟）
+    last_seen: float = field(default=0.0, repr=False)
+    # 定时器版本（状态变化后，旧定时器失效）
+    generation: int = field(default=0, repr=False)
     
     @property
     def duration(self) -> timedelta:
@@ -58,6 +71,8 @@ class SessionManager:
         
         # 会话超时（分钟）
         self.timeout_minutes = self.config.get('timeout_minutes', 10)
+        # 结束后保留时间（分钟）
+        self.retention_minutes = self.config.get('retention_minutes', 60)
         
         # 活动会话
         self.sessions: Dict[str, Session] = {}
@@ -70,22 +85,32 @@ class SessionManager:
             'session_active': []
         }
         
-        # 后台任务
-        self._cleanup_task: Optional[asyncio.Task] = None
+        # 定时器最小堆：(到期时间, 序号, 会话 ID, 定时器版本, 动作)
+        # 每个会话最多一个有效定时器；活动只更新 last_seen，到期时再顺延
+        self._timers: List[Tuple[float, int, str, int, str]] = []
+        self._sequence = itertools.count()
+        
+        # 事件循环定时器（只为堆顶设置一个）
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+    
+    @property
+    def timeout(self) -> float:
+        """超时时间（秒）"""
+        return self.timeout_minutes * 60
     
     async def start(self):
         """启动会话管理器"""
-        self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+        self._loop = asyncio.get_running_loop()
+        self._rearm()
         print("[SessionManager] Started")
     
     async def stop(self):
         """停止会话管理器"""
-        if self._cleanup_task:
-            self._cleanup_task.cancel()
-            try:
-                await self._cleanup_task
-            except asyncio.CancelledError:
-                pass
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        self._loop = None
         print("[SessionManager] Stopped")
     
     def on_session_start(self, session_id: str, project: str):
@@ -99,9 +124,11 @@ class SessionManager:
             id=session_id,
             project=project,
             start_time=datetime.now(),
-            last_activity=datetime.now()
+            last_activity=datetime.now(),
+            last_seen=self._now()
         )
         self.sessions[session_id] = session
+        self._schedule(session, session.last_seen + self.timeout, 'idle')
         
         self._emit('session_start', session.to_dict())
     
@@ -111,17 +138,22 @@ class SessionManager:
         if not session:
             return
         
-        was_idle = session.status == 'idle'
+        was_active = session.status == 'active'
         session.last_activity = datetime.now()
-        session.status = 'active'
+        session.last_seen = self._now()
         
-        if was_idle:
-            self._emit('session_active', session.to_dict())
+        if was_active:
+            return  # 定时器到期时按 last_seen 顺延
+        
+        session.status = 'active'
+        session.end_time = None
+        self._schedule(session, session.last_seen + self.timeout, 'idle')
+        self._emit('session_active', session.to_dict())
     
     def on_session_end(self, session_id: str):
         """会话结束"""
         session = self.sessions.get(session_id)
-        if not session:
+        if not session or session.status == 'ended':
             return
         
         session.status = 'ended'
@@ -129,8 +161,8 @@ class SessionManager:
         
         self._emit('session_end', session.to_dict())
         
-        # 延迟删除（保留 1 小时）
-        asyncio.create_task(self._delayed_remove(session_id, hours=1))
+        # 延迟删除（默认保留 1 小时）
+        self._schedule(session, self._now() + self.retention_minutes * 60, 'remove')
     
     def add_agent(self, session_id: str, agent_id: str):
         """添加 Agent"""
@@ -150,6 +182,18 @@ class SessionManager:
             if s.status == 'active'
         }
     
+    def get_stats(self) -> Dict:
+        """获取会话统计"""
+        counts = {'active': 0, 'idle': 0, 'ended': 0}
+        for session in self.sessions.values():
+            counts[session.status] = counts.get(session.status, 0) + 1
+        
+        return {
+            'total': len(self.sessions),
+            **counts,
+            'pending_timers': len(self._timers),
+        }
+    
     def register_callback(self, event: str, callback: Callable):
         """注册回调"""
         if event in self.callbacks:
@@ -163,38 +207,79 @@ class SessionManager:
             except Exception as e:
                 print(f"[SessionManager] Callback error: {e}")
     
-    async def _cleanup_loop(self):
-        """清理循环"""
-        while True:
-            try:
-                await asyncio.sleep(60)  # 每分钟检查一次
-                self._check_timeouts()
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                print(f"[SessionManager] Cleanup error: {e}")
+    def _now(self) -> float:
+        """当前时间（事件循环时钟）"""
+        if self._loop is not None:
+            return self._loop.time()
+        try:
+            return asyncio.get_running_loop().time()
+        except RuntimeError:
+            return time.monotonic()
     
-    def _check_timeouts(self):
-        """检查超时会话"""
-        timeout = timedelta(minutes=self.timeout_minutes)
-        now = datetime.now()
+    def _schedule(self, session: Session, deadline: float, action: str):
+        """为会话设置定时器（使该会话之前的定时器失效）"""
+        session.generation += 1
+        entry = (deadline, next(self._sequence), session.id, session.generation, action)
+        heapq.heappush(self._timers, entry)
         
-        for session_id, session in list(self.sessions.items()):
-            if session.status != 'active':
+        # 新定时器成为堆顶时才需要重新设置事件循环定时器
+        if self._timers[0] is entry:
+            self._rearm()
+    
+    def _rearm(self):
+        """为堆顶设置事件循环定时器（丢弃失效的堆顶）"""
+        if self._loop is None:
+            return
+        
+        while self._timers and not self._is_valid(self._timers[0]):
+            heapq.heappop(self._timers)
+        
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        
+        if self._timers:
+            self._handle = self._loop.call_at(self._timers[0][0], self._on_timer)
+    
+    def _is_valid(self, entry: Tuple[float, int, str, int, str]) -> bool:
+        """定时器是否仍有效"""
+        session = self.sessions.get(entry[2])
+        return session is not None and session.generation == entry[3]
+    
+    def _on_timer(self):
+        """处理所有到期的定时器"""
+        self._handle = None
+        now = self._now()
+        
+        while self._timers and self._timers[0][0] <= now:
+            entry = heapq.heappop(self._timers)
+            if not self._is_valid(entry):
                 continue
             
-            idle_time = now - session.last_activity
+            try:
+                self._fire(self.sessions[entry[2]], entry[4], now)
+            except Exception as e:
+                print(f"[SessionManager] Timer error: {e}")
+        
+        self._rearm()
+    
+    def _fire(self, session: Session, action: str, now: float):
+        """执行到期动作"""
+        if action == 'idle':
+            deadline = session.last_seen + self.timeout
+            if deadline > now:
+                # 期间有活动：顺延
+                self._schedule(session, deadline, 'idle')
+                return
             
-            if idle_time > timeout:
-                # 会话超时 → idle
-                session.status = 'idle'
-                self._emit('session_idle', session.to_dict())
-            elif idle_time > timeout * 2:
-                # 超过 2 倍超时 → ended
-                self.on_session_end(session_id)
-    
-    async def _delayed_remove(self, session_id: str, hours: int = 1):
-        """延迟删除会话"""
-        await asyncio.sleep(hours * 3600)
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+            # 会话超时 → idle
+            session.status = 'idle'
+            self._emit('session_idle', session.to_dict())
+            self._schedule(session, session.last_seen + self.timeout * 2, 'end')
+        
+        elif action == 'end':
+            # 超过 2 倍超时 → ended
+            self.on_session_end(session.id)
+        
+        elif action == 'remove':
+            del self.sessions[session.id]
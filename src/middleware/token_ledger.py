@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+TokenLedger - 基于增量的 Token 账本
+
+插件按消息发送 Usage 增量（UsageDelta，以 message.id 为键，插件保证每条消息只贡献一次
+最终用量），账本累加为精确的运行合计：
+- 全局、按项目、按会话（project/session_id，子 Agent 计入所属会话）三个粒度
+- 每个增量 O(1) 更新（每个粒度一次字典查找 + 四次整数加法）
+- 读取返回只读快照（TokenSnapshot）：快照按计数器缓存，计数器未变化时重复读取不分配新对象
+- 会话计数器按 LRU 有界（淘汰的会话仍计入项目和全局合计）
+- 写入在事件循环中进行，HTTP 线程的遍历查询（by_project / by_session）与写入共用一把锁，
+  避免遍历时字典被修改
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from src.plugins.base import UsageDelta
+
+# 计数字段（与 UsageDelta 字段同名）
+TOKEN_FIELDS = ('input', 'output', 'cache_write', 'cache_read')
+
+
+class TokenSnapshot(dict):
+    """不可变的 Token 快照（dict 子类：可直接 JSON 序列化，修改时抛出 TypeError）"""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('TokenSnapshot is read-only')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self) -> 'TokenSnapshot':
+        return self
+
+    def __deepcopy__(self, memo) -> 'TokenSnapshot':
+        return self
+
+    def __reduce__(self):
+        return (TokenSnapshot, (dict(self),))
+
+
+class TokenCounter:
+    """单个粒度的运行合计"""
+
+    __slots__ = ('input', 'output', 'cache_write', 'cache_read', 'messages', '_snapshot')
+
+    def __init__(self):
+        self.input = 0
+        self.output = 0
+        self.cache_write = 0
+        self.cache_read = 0
+        self.messages = 0
+        self._snapshot: Optional[TokenSnapshot] = None
+
+    def add(self, delta: UsageDelta):
+        self.input += delta.input
+        self.output += delta.output
+        self.cache_write += delta.cache_write
+        self.cache_read += delta.cache_read
+        if delta.new_message:
+            self.messages += 1
+        self._snapshot = None
+
+    def add_counts(self, counts: Sequence[int]):
+        """累加已汇总的计数（input, output, cache_write, cache_read, messages）"""
+        self.input += counts[0]
+        self.output += counts[1]
+        self.cache_write += counts[2]
+        self.cache_read += counts[3]
+        self.messages += counts[4]
+        self._snapshot = None
+
+    def snapshot(self) -> TokenSnapshot:
+        """只读快照（计数器未变化时返回同一个对象）"""
+        if self._snapshot is None:
+            self._snapshot = TokenSnapshot(
+                input=self.input,
+                output=self.output,
+                cache_write=self.cache_write,
+                cache_read=self.cache_read,
+                sum=self.input + self.output,
+                messages=self.messages,
+            )
+        return self._snapshot
+
+
+EMPTY_SNAPSHOT = TokenCounter().snapshot()
+
+
+class TokenLedger:
+    """全局 / 项目 / 会话三级 Token 账本"""
+
+    def __init__(self, max_sessions: int = 1024):
+        self.max_sessions = max_sessions
+
+        self.total = TokenCounter()
+        self.projects: Dict[str, TokenCounter] = {}
+        self.sessions: 'OrderedDict[Tuple[str, str], TokenCounter]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 统计
+        self.applied = 0
+        self.evicted_sessions = 0
+
+    def apply(self, delta: UsageDelta):
+        """累加一个增量（O(1)）"""
+        with self._lock:
+            self._apply(delta)
+
+    def _apply(self, delta: UsageDelta):
+        self.total.add(delta)
+
+        project = self.projects.get(delta.project)
+        if project is None:
+            project = self.projects[delta.project] = TokenCounter()
+        project.add(delta)
+
+        key = (delta.project, delta.session_id)
+        session = self.sessions.get(key)
+        if session is None:
+            session = self.sessions[key] = TokenCounter()
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted_sessions += 1
+        else:
+            self.sessions.move_to_end(key)
+        session.add(delta)
+
+        self.applied += 1
+
+    def restore(self, project: str, session_id: str, counts: Sequence[int]):
+        """恢复一个会话的已汇总计数（启动时从持久化存储加载）"""
+        with self._lock:
+            self._restore(project, session_id, counts)
+
+    def _restore(self, project: str, session_id: str, counts: Sequence[int]):
+        self.total.add_counts(counts)
+
+        counter = self.projects.get(project)
+        if counter is None:
+            counter = self.projects[project] = TokenCounter()
+        counter.add_counts(counts)
+
+        key = (project, session_id)
+        counter = self.sessions.get(key)
+        if counter is None:
+            counter = self.sessions[key] = TokenCounter()
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted_sessions += 1
+        counter.add_counts(counts)
+
+    def totals(self) -> TokenSnapshot:
+        """全局合计"""
+        return self.total.snapshot()
+
+    def project(self, project: str) -> TokenSnapshot:
+        """单个项目的合计"""
+        counter = self.projects.get(project)
+        return counter.snapshot() if counter is not None else EMPTY_SNAPSHOT
+
+    def session(self, project: str, session_id: str) -> TokenSnapshot:
+        """单个会话的合计（包括子 Agent）"""
+        counter = self.sessions.get((project, session_id))
+        return counter.snapshot() if counter is not None else EMPTY_SNAPSHOT
+
+    def by_project(self) -> Dict[str, TokenSnapshot]:
+        """所有项目的合计（按 input + output 从大到小）"""
+        with self._lock:
+            items = [(name, counter.snapshot()) for name, counter in self.projects.items()]
+        items.sort(key=lambda item: item[1]['sum'], reverse=True)
+        return dict(items)
+
+    def by_session(self) -> Dict[str, TokenSnapshot]:
+        """所有会话的合计（project/session_id，最近活动的在前）"""
+        with self._lock:
+            return {
+                f'{project}/{session_id}': counter.snapshot()
+                for (project, session_id), counter in reversed(self.sessions.items())
+            }
+
+    def reset(self):
+        """清空账本"""
+        with self._lock:
+            self.total = TokenCounter()
+            self.projects.clear()
+            self.sessions.clear()
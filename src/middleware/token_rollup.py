@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+TokenRollup - 按时间分桶的 Token 汇总
+
+三级固定大小的环形缓冲（默认：600 个 1 秒桶 / 1440 个 1 分钟桶 / 720 个 1 小时桶，
+覆盖 10 分钟 / 24 小时 / 30 天），每级一个 array('q')（每桶 input / output / cache_write / cache_read）
+加一个桶编号数组，没有按样本分配的对象，内存与运行时长无关（默认约 110 KB）。
+
+降采样级联：
+- 增量写入秒级环（已移出秒级环的迟到增量写入仍覆盖它的最细一级）
+- 一个分钟桶结束时，由秒级环中对应的 60 个秒桶求和写入分钟级；小时桶同理由分钟桶求和
+- 迟到的增量同时累加到已汇总的粗桶，粗桶始终等于对应细桶之和
+
+窗口查询（window('5m')）按时间从各级拼接：细粒度环仍完整覆盖的部分用细桶，
+更早的部分用分钟桶 / 小时桶；只计起点落在窗口内的桶（窗口起点按所用级别的桶边界对齐）。
+
+写入在事件循环中，查询来自 HTTP 线程（查询也会推进汇总），两者共用一把锁。
+"""
+
+import re
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .token_ledger import TOKEN_FIELDS
+
+NUM_FIELDS = len(TOKEN_FIELDS)
+
+# 窗口字符串的单位（秒）
+WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+WINDOW_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$')
+
+
+def parse_window(window) -> float:
+    """
+    解析时间窗口（'30s' / '5m' / '2h' / '7d'，或秒数）
+
+    Raises:
+        ValueError: 格式无效或不为正数
+    """
+    if isinstance(window, (int, float)):
+        seconds = float(window)
+    else:
+        match = WINDOW_PATTERN.match(str(window))
+        if match is None:
+            raise ValueError(f'Invalid window: {window!r}')
+        seconds = float(match.group(1)) * WINDOW_UNITS[match.group(2) or 's']
+    if seconds <= 0:
+        raise ValueError(f'Invalid window: {window!r}')
+    return seconds
+
+
+class RingBuffer:
+    """固定大小的时间桶环（桶编号 = 时间 // resolution）"""
+
+    __slots__ = ('resolution', 'slots', 'values', 'buckets')
+
+    def __init__(self, resolution: int, slots: int):
+        self.resolution = resolution
+        self.slots = slots
+        # 槽位 i 的四个计数：values[i * NUM_FIELDS:(i + 1) * NUM_FIELDS]
+        self.values = array('q', bytes(8 * slots * NUM_FIELDS))
+        # 槽位当前保存的桶编号（-1 表示空；编号不符说明槽位已被新桶覆盖）
+        self.buckets = array('q', [-1]) * slots
+
+    def add(self, bucket: int, values: Sequence[int]):
+        slot = bucket % self.slots
+        base = slot * NUM_FIELDS
+        data = self.values
+        if self.buckets[slot] != bucket:
+            self.buckets[slot] = bucket
+            for i in range(NUM_FIELDS):
+                data[base + i] = values[i]
+        else:
+            for i in range(NUM_FIELDS):
+                data[base + i] += values[i]
+
+    def sum_range(self, start: int, end: int, totals: List[int]):
+        """把 [start, end) 区间内仍在环中的桶累加到 totals"""
+        start = max(start, end - self.slots)
+        buckets, data, slots = self.buckets, self.values, self.slots
+        for bucket in range(start, end):
+            slot = bucket % slots
+            if buckets[slot] == bucket:
+                base = slot * NUM_FIELDS
+                for i in range(NUM_FIELDS):
+                    totals[i] += data[base + i]
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.values.itemsize * len(self.values) + self.buckets.itemsize * len(self.buckets)
+
+
+class TokenRollup:
+    """秒 / 分钟 / 小时三级 Token 时间汇总"""
+
+    def __init__(self, seconds: int = 600, minutes: int = 1440, hours: int = 720):
+        # 每级至少能容纳两个上一级的桶，保证汇总时细粒度数据仍在环中
+        self.levels = [
+            RingBuffer(1, max(seconds, 120)),
+            RingBuffer(60, max(minutes, 120)),
+            RingBuffer(3600, max(hours, 1)),
+        ]
+        # closed[i]：第 i 级已汇总到的桶编号（第 0 级不使用）
+        self.closed: List[Optional[int]] = [None] * len(self.levels)
+        # 已推进到的时间（最新的增量或查询时间）
+        self.now: Optional[float] = None
+        # 每级写入过的最大桶编号（之后的区间没有数据，汇总时直接跳过）
+        self.latest: List[int] = [-1] * len(self.levels)
+        self._lock = threading.Lock()
+
+        # 统计
+        self.added = 0
+        self.dropped = 0
+
+    def add(self, timestamp: float, values: Sequence[int]):
+        """累加一个增量（input, output, cache_write, cache_read）到 timestamp 所在的桶"""
+        with self._lock:
+            self._add(timestamp, values)
+
+    def _add(self, timestamp: float, values: Sequence[int]):
+        self._advance(timestamp)
+
+        levels = self.levels
+        for i, ring in enumerate(levels):
+            bucket = int(timestamp // ring.resolution)
+            if bucket <= int(self.now // ring.resolution) - ring.slots:
+                continue  # 已移出该级的环
+
+            ring.add(bucket, values)
+            if bucket > self.latest[i]:
+                self.latest[i] = bucket
+            # 迟到的增量：所在时间段已汇总到更粗的级别时同步累加，保持粗桶 = 细桶之和
+            for j in range(i + 1, len(levels)):
+                coarse = levels[j]
+                coarse_bucket = int(timestamp // coarse.resolution)
+                if coarse_bucket < self.closed[j] and coarse_bucket > int(self.now // coarse.resolution) - coarse.slots:
+                    coarse.add(coarse_bucket, values)
+            self.added += 1
+            return
+
+        self.dropped += 1  # 早于最粗一级的覆盖范围
+
+    def advance(self, now: float):
+        """汇总 now 之前已结束的桶（降采样级联：秒 → 分钟 → 小时）"""
+        with self._lock:
+            self._advance(now)
+
+    def _advance(self, now: float):
+        if self.now is not None and now <= self.now:
+            return
+        self.now = now
+
+        levels = self.levels
+        for i in range(1, len(levels)):
+            ring, finer = levels[i], levels[i - 1]
+            ratio = ring.resolution // finer.resolution
+            target = int(now // ring.resolution)
+
+            closed = self.closed[i]
+            if closed is None:
+                self.closed[i] = target
+                continue
+
+            while closed < target:
+                if closed * ratio > self.latest[i - 1]:
+                    closed = target  # 之后没有数据（长时间空闲），不再逐个汇总
+                    break
+                totals = [0] * NUM_FIELDS
+                finer.sum_range(closed * ratio, (closed + 1) * ratio, totals)
+                if any(totals):
+                    ring.add(closed, totals)
+                    if closed > self.latest[i]:
+                        self.latest[i] = closed
+                closed += 1
+            self.closed[i] = closed
+
+    def window(self, window, now: Optional[float] = None) -> Dict:
+        """
+        最近 window 内的合计
+
+        Returns:
+            {'window_seconds', 'resolution'（所用的最粗桶宽度）, 'input', 'output',
+             'cache_write', 'cache_read', 'sum', 'tokens_per_minute'}
+        """
+        seconds = parse_window(window)
+        now = time.time() if now is None else now
+        with self._lock:
+            self._advance(now)
+            totals, resolution = self._sum(now - seconds, now)
+        data = dict(zip(TOKEN_FIELDS, totals))
+        data['sum'] = data['input'] + data['output']
+        return {
+            'window_seconds': seconds,
+            'resolution': resolution,
+            **data,
+            'tokens_per_minute': round(data['sum'] / (seconds / 60), 2),
+        }
+
+    def series(self, window, step=None, now: Optional[float] = None) -> Dict:
+        """
+        最近 window 内按 step 分段的时间序列（默认步长：10 分钟内按秒、1 天内按分钟、更长按小时）
+
+        Returns:
+            {'step_seconds', 'start'（第一个点的起始时间戳）, 'input': [...], 'output': [...], ...}
+        """
+        seconds = parse_window(window)
+        if step is None:
+            step = 1 if seconds <= 600 else 60 if seconds <= 86400 else 3600
+        step = max(1, int(parse_window(step)))
+        now = time.time() if now is None else now
+
+        end = int(-(-now // step)) * step
+        start = end - int(-(-seconds // step)) * step
+        points = {field: [] for field in TOKEN_FIELDS}
+        with self._lock:
+            self._advance(now)
+            for point in range(start, end, step):
+                totals, _ = self._sum(point, point + step)
+                for field, value in zip(TOKEN_FIELDS, totals):
+                    points[field].append(value)
+        return {'step_seconds': step, 'start': start, **points}
+
+    def get_stats(self) -> Dict:
+        """各级覆盖范围和内存"""
+        return {
+            'levels': [
+                {'resolution': ring.resolution, 'slots': ring.slots, 'span_seconds': ring.resolution * ring.slots}
+                for ring in self.levels
+            ],
+            'memory_bytes': sum(ring.memory_bytes for ring in self.levels),
+            'added': self.added,
+            'dropped': self.dropped,
+        }
+
+    def _sum(self, start: float, end: float) -> Tuple[List[int], int]:
+        """
+        [start, end) 时间区间的合计（只计起点落在区间内的桶），以及所用的最粗桶宽度
+
+        每一级负责它的环仍完整覆盖的时间段（按上一级的桶边界对齐），更早的时间段交给更粗的级别
+        """
+        totals = [0] * NUM_FIELDS
+        resolution = 1
+        levels = self.levels
+        if self.now is None:
+            return totals, resolution
+
+        upper = end
+        for i, ring in enumerate(levels):
+            if i + 1 < len(levels):
+                coarse = levels[i + 1].resolution
+                oldest = (int(self.now // ring.resolution) - ring.slots + 1) * ring.resolution
+                boundary = -(-oldest // coarse) * coarse
+            else:
+                boundary = float('-inf')
+
+            lower = max(start, boundary)
+            if lower < upper:
+                ring.sum_range(int(-(-lower // ring.resolution)), int(-(-upper // ring.resolution)), totals)
+                resolution = ring.resolution
+            upper = min(upper, boundary)
+            if upper <= start:
+                break
+
+        return totals, resolution
@@ -2,16 +2,25 @@
 """
 TokenStats - Token 统计器
 
+数据来源：插件发送的按消息 Usage 增量（UsageDelta），由 TokenLedger 累加为精确合计
+（全局 / 项目 / 会话）。状态事件不再携带累计值，避免重复累加。
+
 统计指标：
 - 总使用量（input + output）
 - 缓存写入/读取
 - 缓存命中率
-- 平均每分钟使用量
+- 平均每分钟使用量（最近 5 分钟）
+- 任意时间窗口内的合计和时间序列（TokenRollup：秒 / 分钟 / 小时三级环形缓冲）
+- 按 model / project / session / agent_type 分组和 ROLLUP 的合计（UsageCube）
 """
 
 from typing import Dict, Optional
-from datetime import datetime
-from src.plugins.base import StateEvent
+
+from src.plugins.base import StateEvent, UsageDelta
+from .token_ledger import TokenLedger, TokenSnapshot
+from .token_rollup import TokenRollup
+from .token_store import TokenStore
+from .usage_cube import UsageCube
 
 
 class TokenStats:
@@ -21,39 +30,63 @@ class TokenStats:
         self.config = config or {}
         self.enabled = self.config.get('enabled', True)
         
-        # 累计统计（使用字典以便兼容测试）
-        self.total_tokens = {
-            'input': 0,
-            'output': 0,
-            'cache_write': 0,
-            'cache_read': 0
-        }
+        # 增量账本（会话计数器数量有界）
+        self.ledger = TokenLedger(max_sessions=self.config.get('max_sessions', 1024))
+        
+        # 时间分桶汇总（固定内存）
+        self.rollup = TokenRollup(
+            seconds=self.config.get('rollup_seconds', 600),
+            minutes=self.config.get('rollup_minutes', 1440),
+            hours=self.config.get('rollup_hours', 720)
+        )
         
-        # 会话统计
-        self.session_start: Optional[datetime] = None
-        self.session_duration: float = 0.0
+        # 多维用量立方体（单元格数量有界）
+        self.cube = UsageCube(max_cells=self.config.get('cube_max_cells', 65536))
+        
+        # 第一个 / 最后一个增量的时间（Unix 时间戳）
+        self.first_usage: Optional[float] = None
+        self.last_usage: Optional[float] = None
     
-    def update(self, event: StateEvent):
-        """更新统计"""
+    @property
+    def total_tokens(self) -> TokenSnapshot:
+        """全局合计（只读快照）"""
+        return self.ledger.totals()
+    
+    @property
+    def session_duration(self) -> float:
+        """第一个增量到最后一个增量的时长（秒）"""
+        if self.first_usage is None:
+            return 0.0
+        return self.last_usage - self.first_usage
+    
+    def apply(self, delta: UsageDelta):
+        """累加一个 Usage 增量（O(1)）"""
         if not self.enabled:
             return
         
-        # 提取 Token 信息
-        tokens = event.details.get('tokens', {})
-        if not tokens:
-            return
+        self.ledger.apply(delta)
+        self.rollup.add(delta.timestamp, (delta.input, delta.output, delta.cache_write, delta.cache_read))
+        self.cube.apply(delta)
         
-        # 累计统计
-        self.total_tokens['input'] += tokens.get('input', 0)
-        self.total_tokens['output'] += tokens.get('output', 0)
-        self.total_tokens['cache_write'] += tokens.get('cache_write', 0)
-        self.total_tokens['cache_read'] += tokens.get('cache_read', 0)
+        if self.first_usage is None:
+            self.first_usage = delta.timestamp
+        self.last_usage = delta.timestamp
+    
+    def restore(self, store: TokenStore):
+        """从持久化存储恢复合计（启动时、插件产生增量之前调用；时间分桶汇总只保留运行期间的数据）"""
+        for (model, project, session_id, agent_type), counts in store.iter_cells():
+            self.ledger.restore(project, session_id, counts)
+            self.cube.restore((model, project, session_id, agent_type), counts)
+        if store.first_usage is not None:
+            self.first_usage = store.first_usage
+            self.last_usage = store.last_usage
+    
+    def update(self, event: StateEvent):
+        """为状态事件附加当前全局合计（只读快照，未变化时不重新分配）"""
+        if not self.enabled:
+            return
         
-        # 会话时间
-        if self.session_start is None:
-            self.session_start = event.timestamp
-        else:
-            self.session_duration = (event.timestamp - self.session_start).total_seconds()
+        event.details['tokens'] = self.ledger.totals()
     
     def get_cache_hit_rate(self) -> float:
         """
@@ -62,10 +95,11 @@ class TokenStats:
         Returns:
             缓存命中率（0.0-1.0）
         """
-        total_input = self.total_tokens['input'] + self.total_tokens['cache_read']
+        totals = self.ledger.totals()
+        total_input = totals['input'] + totals['cache_read']
         if total_input == 0:
             return 0.0
-        return self.total_tokens['cache_read'] / total_input
+        return totals['cache_read'] / total_input
     
     def get_cost_savings(self) -> float:
         """
@@ -77,46 +111,87 @@ class TokenStats:
         Returns:
             节省的等效 token 数量
         """
-        return self.total_tokens['cache_read'] * 0.9
+        return self.ledger.totals()['cache_read'] * 0.9
     
-    def get_tokens_per_minute(self) -> float:
+    def get_tokens_per_minute(self, window='5m') -> float:
         """
-        获取平均每分钟 Token 使用量
+        获取最近 window 内平均每分钟 Token 使用量
         
         Returns:
             tokens/min
         """
-        if self.session_duration == 0:
-            return 0.0
+        return self.rollup.window(window)['tokens_per_minute']
+    
+    def get_window(self, window, step=None) -> Dict:
+        """
+        最近 window 内的合计（'30s' / '5m' / '2h' / '7d'），指定 step 时附带时间序列
         
-        total = self.total_tokens['input'] + self.total_tokens['output']
-        return total / (self.session_duration / 60)
+        Raises:
+            ValueError: 窗口或步长格式无效
+        """
+        data = self.rollup.window(window)
+        if step is not None:
+            data['series'] = self.rollup.series(window, step)
+        return data
     
-    def get_stats(self) -> Dict:
-        """获取统计信息"""
-        total = self.total_tokens['input'] + self.total_tokens['output']
+    def get_usage(self, group_by=(), filters: Optional[Dict[str, str]] = None,
+                  rollup: bool = False, limit: Optional[int] = None) -> Dict:
+        """
+        按维度分组的用量（group_by ⊆ model / project / session / agent_type，rollup 时附带各层小计和总计）
         
+        Raises:
+            ValueError: 未知维度
+        """
+        query = self.cube.rollup if rollup else self.cube.group_by
         return {
+            'group_by': list(group_by),
+            'filters': dict(filters or {}),
+            'rollup': rollup,
+            'rows': query(group_by, filters, limit),
+            'cube': self.cube.get_stats(),
+        }
+    
+    def get_session_tokens(self, project: str, session_id: str) -> TokenSnapshot:
+        """单个会话的合计（包括子 Agent）"""
+        return self.ledger.session(project, session_id)
+    
+    def get_stats(self, window=None, step=None) -> Dict:
+        """
+        获取统计信息（指定 window 时附带该窗口的合计，见 get_window）
+        
+        Raises:
+            ValueError: 窗口或步长格式无效
+        """
+        totals = self.ledger.totals()
+        
+        stats = {
             'total': {
-                'input': self.total_tokens['input'],
-                'output': self.total_tokens['output'],
-                'cache_write': self.total_tokens['cache_write'],
-                'cache_read': self.total_tokens['cache_read'],
-                'sum': total
+                'input': totals['input'],
+                'output': totals['output'],
+                'cache_write': totals['cache_write'],
+                'cache_read': totals['cache_read'],
+                'sum': totals['sum']
             },
+            'messages': totals['messages'],
             'cache_hit_rate': round(self.get_cache_hit_rate(), 2),
             'cost_savings': round(self.get_cost_savings(), 2),
             'tokens_per_minute': round(self.get_tokens_per_minute(), 2),
             'session_duration': round(self.session_duration, 2),
+            'projects': self.ledger.by_project(),
+            'sessions': self.ledger.by_session(),
         }
+        if window is not None:
+            stats['window'] = self.get_window(window, step)
+        return stats
     
     def reset(self):
         """重置统计"""
-        self.total_tokens = {
-            'input': 0,
-            'output': 0,
-            'cache_write': 0,
-            'cache_read': 0
-        }
-        self.session_start = None
-        self.session_duration = 0.0
+        self.ledger.reset()
+        self.rollup = TokenRollup(
+            seconds=self.config.get('rollup_seconds', 600),
+            minutes=self.config.get('rollup_minutes', 1440),
+            hours=self.config.get('rollup_hours', 720)
+        )
+        self.cube.reset()
+        self.first_usage = None
+        self.last_usage = None
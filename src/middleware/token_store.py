@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+TokenStore - Token 用量持久化（追加写日志 + 快照压缩）
+
+目录结构（path 下）：
+- tokens.journal：定长二进制记录（每个 UsageDelta 一条 68 字节，带 CRC32），只追加
+- tokens.dict：记录中维度 id → 字符串（JSON 行，只追加；第一行为代号）
+- tokens.snapshot：压缩后的合计（JSON，临时文件 + fsync + rename 原子替换）
+
+写入：
+- append() 只写内存缓冲（事件循环中调用，不做 I/O）
+- flush() 批量写入并 fsync（先字典后日志：日志记录引用的 id 一定已落盘），
+  由中间件按 fsync_interval 在线程池中调用
+- compact() 把当前合计写成快照，然后以新代号重建空的字典和日志（日志长度有界）
+
+启动（open()）：加载快照，只重放同代号的日志尾部；文件末尾写了一半的记录（CRC 不符或长度不足）被截断。
+快照代号比日志新说明压缩在重建日志前中断，日志内容已包含在快照中，直接重建。
+重启时间只取决于快照大小和 snapshot_interval 内的日志量，与历史长度无关。
+
+崩溃恢复不重复计数：每条记录带 message_id，日志和快照保存最近 max_messages 条消息已落盘的用量
+（message_usage()）。插件的读取位置检查点比日志落盘慢，崩溃后会重读已写入日志的行；
+启动时把这些用量交给插件（BasePlugin.restore_message_usage），重读的行只发送超出已落盘部分的增量。
+
+按天（本地时区）保存 model / project 维度的用量历史：history(days=7, group_by='project')
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from src.plugins.base import UsageDelta
+
+# 日志文件头：魔数 + 代号
+JOURNAL_MAGIC = b'CCTOKJ02'
+HEADER = struct.Struct('<8sQ48x')
+
+# 日志记录：时间戳、model / project / session / agent_type / message_id 的 id、四项用量、标志位、
+# CRC32（前 64 字节）
+RECORD = struct.Struct('<dIIIIIqqqqB3xI')
+RECORD_BODY = struct.Struct('<dIIIIIqqqqB3x')
+FLAG_NEW_MESSAGE = 0x01
+
+JOURNAL_FILE = 'tokens.journal'
+DICT_FILE = 'tokens.dict'
+SNAPSHOT_FILE = 'tokens.snapshot'
+SNAPSHOT_VERSION = 1
+
+# 每个合计的计数字段：input / output / cache_write / cache_read / messages
+NUM_COUNTS = 5
+# 每条消息已落盘的用量字段：input / output / cache_write / cache_read
+NUM_USAGE = 4
+
+# 按天历史的分组维度
+HISTORY_DIMENSIONS = ('model', 'project')
+MAX_HISTORY_DAYS = 3660
+
+CellKey = Tuple[str, str, str, str]
+DayKey = Tuple[str, str, str]
+
+
+def _add_counts(table: Dict, key, values: Sequence[int]):
+    counts = table.get(key)
+    if counts is None:
+        table[key] = list(values)
+    else:
+        for i in range(NUM_COUNTS):
+            counts[i] += values[i]
+
+
+def _fsync_write(path: Path, data: bytes):
+    """原子替换文件内容（临时文件 + fsync + rename）"""
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class TokenStore:
+    """Token 用量持久化存储"""
+
+    def __init__(self, path: str, fsync_interval: float = 1.0, snapshot_interval: float = 300.0,
+                 snapshot_records: int = 100_000, max_messages: int = 4096):
+        self.path = Path(path)
+        self.fsync_interval = fsync_interval
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_records = snapshot_records
+        self.max_messages = max_messages
+
+        # 合计：(model, project, session, agent_type) → 计数；(日期, model, project) → 计数
+        self.cells: Dict[CellKey, List[int]] = {}
+        self.days: Dict[DayKey, List[int]] = {}
+        self.first_usage: Optional[float] = None
+        self.last_usage: Optional[float] = None
+        # 最近消息已记录的用量（message_id → 四项用量，LRU 有界；崩溃后重读的行据此去重）
+        self.messages: 'OrderedDict[str, List[int]]' = OrderedDict()
+
+        # 当前代号的字符串 id
+        self.generation = 0
+        self._ids: Dict[str, int] = {}
+        self._strings: List[str] = []
+
+        # 未落盘的缓冲（事件循环线程写入，flush 时整体取走）
+        self._pending_strings: List[str] = []
+        self._pending_records = bytearray()
+        self._pending_count = 0
+
+        # 文件 I/O 串行化（flush / compact 在线程池中执行）
+        self._io_lock = threading.Lock()
+        self._journal = None
+        self._dict = None
+        self._journal_records = 0
+        self.last_snapshot = time.monotonic()
+
+        # 当天的日期字符串缓存（避免每条记录调用 localtime）
+        self._day_start = 0.0
+        self._day_end = 0.0
+        self._day = ''
+
+        # 统计
+        self.appended = 0
+        self.flushes = 0
+        self.snapshots = 0
+        self.replayed = 0
+        self.truncated_bytes = 0
+        self.load_seconds = 0.0
+
+    # === 启动 ===
+
+    def open(self):
+        """加载快照并重放日志尾部"""
+        started = time.perf_counter()
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        self._load_snapshot()
+
+        journal_path = self.path / JOURNAL_FILE
+        generation = self._read_generation(journal_path)
+        if generation == self.generation:
+            self._load_dict()
+            self._replay(journal_path)
+        else:
+            # 没有日志，或压缩在重建日志前中断（内容已在快照中）
+            self._create_files(self.generation)
+
+        self._journal = open(journal_path, 'ab')
+        self._dict = open(self.path / DICT_FILE, 'ab')
+        self.last_snapshot = time.monotonic()
+        self.load_seconds = time.perf_counter() - started
+
+    def _load_snapshot(self):
+        try:
+            with open(self.path / SNAPSHOT_FILE, 'rb') as f:
+                data = json.loads(f.read())
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            print(f"[TokenStore] [WARN] Ignoring unreadable snapshot: {e}")
+            return
+        if data.get('version') != SNAPSHOT_VERSION:
+            print(f"[TokenStore] [WARN] Ignoring snapshot version {data.get('version')}")
+            return
+
+        self.generation = data['generation']
+        self.first_usage = data.get('first_usage')
+        self.last_usage = data.get('last_usage')
+        for row in data.get('cells', []):
+            self.cells[tuple(row[:4])] = row[4:]
+        for row in data.get('days', []):
+            self.days[tuple(row[:3])] = row[3:]
+        for row in data.get('messages', []):
+            self.messages[row[0]] = row[1:]
+
+    @staticmethod
+    def _read_generation(journal_path: Path) -> Optional[int]:
+        try:
+            with open(journal_path, 'rb') as f:
+                header = f.read(HEADER.size)
+        except FileNotFoundError:
+            return None
+        if len(header) < HEADER.size:
+            return None
+        magic, generation = HEADER.unpack(header)
+        return generation if magic == JOURNAL_MAGIC else None
+
+    def _load_dict(self):
+        dict_path = self.path / DICT_FILE
+        try:
+            with open(dict_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+
+        lines = data.split(b'\n')
+        # 最后一段没有换行符：写了一半的条目
+        complete = len(data) - len(lines[-1])
+        lines = lines[:-1]
+        if not lines or json.loads(lines[0]).get('generation') != self.generation:
+            # 字典与日志代号不一致：日志中的记录无法解析，重建
+            self._create_files(self.generation)
+            return
+        if complete < len(data):
+            with open(dict_path, 'r+b') as f:
+                f.truncate(complete)
+
+        for line in lines[1:]:
+            self._strings.append(json.loads(line))
+        self._ids = {value: i for i, value in enumerate(self._strings)}
+
+    def _replay(self, journal_path: Path):
+        """重放日志中的记录（遇到不完整或 CRC 不符的记录时截断）"""
+        strings = self._strings
+        with open(journal_path, 'rb') as f:
+            f.seek(HEADER.size)
+            data = f.read()
+
+        valid = 0
+        for offset in range(0, len(data) - RECORD.size + 1, RECORD.size):
+            record = data[offset:offset + RECORD.size]
+            fields = RECORD.unpack(record)
+            if zlib.crc32(record[:RECORD_BODY.size]) != fields[-1]:
+                break
+            timestamp, model, project, session, agent_type, message = fields[:6]
+            try:
+                key = (strings[model], strings[project], strings[session], strings[agent_type])
+                message_id = strings[message]
+            except IndexError:
+                break
+            values = fields[6:10] + ((1 if fields[10] & FLAG_NEW_MESSAGE else 0),)
+            self._accumulate(timestamp, key, values)
+            self._track_message(message_id, values)
+            valid = offset + RECORD.size
+
+        self.replayed = valid // RECORD.size
+        self._journal_records = self.replayed
+        if valid < len(data):
+            self.truncated_bytes = len(data) - valid
+            print(f"[TokenStore] [WARN] Truncating {self.truncated_bytes} bytes of torn journal tail")
+            with open(journal_path, 'r+b') as f:
+                f.truncate(HEADER.size + valid)
+
+    def _create_files(self, generation: int):
+        """以 generation 代号重建空的字典和日志（先字典后日志）"""
+        _fsync_write(self.path / DICT_FILE, json.dumps({'generation': generation}).encode('utf-8') + b'\n')
+        _fsync_write(self.path / JOURNAL_FILE, HEADER.pack(JOURNAL_MAGIC, generation))
+        self._ids = {}
+        self._strings = []
+        self._journal_records = 0
+
+    # === 写入 ===
+
+    def append(self, delta: UsageDelta):
+        """记录一个增量（只写内存缓冲，O(1)）"""
+        agent_type = delta.agent_type or ('main' if delta.agent_id is None else 'subagent')
+        key = (delta.model or 'unknown', delta.project, delta.session_id, agent_type)
+        values = (delta.input, delta.output, delta.cache_write, delta.cache_read, 1 if delta.new_message else 0)
+        self._accumulate(delta.timestamp, key, values)
+        self._track_message(delta.message_id, values)
+
+        body = RECORD_BODY.pack(
+            delta.timestamp,
+            self._intern(key[0]), self._intern(key[1]), self._intern(key[2]), self._intern(key[3]),
+            self._intern(delta.message_id),
+            delta.input, delta.output, delta.cache_write, delta.cache_read,
+            FLAG_NEW_MESSAGE if delta.new_message else 0
+        )
+        self._pending_records += body
+        self._pending_records += struct.pack('<I', zlib.crc32(body))
+        self._pending_count += 1
+        self.appended += 1
+
+    def _intern(self, value: str) -> int:
+        key = self._ids.get(value)
+        if key is None:
+            key = self._ids[value] = len(self._strings)
+            self._strings.append(value)
+            self._pending_strings.append(value)
+        return key
+
+    def _accumulate(self, timestamp: float, key: CellKey, values: Sequence[int]):
+        _add_counts(self.cells, key, values)
+        _add_counts(self.days, (self._date(timestamp), key[0], key[1]), values)
+        if self.first_usage is None or timestamp < self.first_usage:
+            self.first_usage = timestamp
+        if self.last_usage is None or timestamp > self.last_usage:
+            self.last_usage = timestamp
+
+    def _track_message(self, message_id: str, values: Sequence[int]):
+        """累加消息已记录的用量（没有 message_id 的增量无法去重，不记录）"""
+        if not message_id:
+            return
+        usage = self.messages.get(message_id)
+        if usage is None:
+            self.messages[message_id] = list(values[:NUM_USAGE])
+            if len(self.messages) > self.max_messages:
+                self.messages.popitem(last=False)
+        else:
+            self.messages.move_to_end(message_id)
+            for i in range(NUM_USAGE):
+                usage[i] += values[i]
+
+    def message_usage(self) -> Dict[str, Tuple[int, ...]]:
+        """最近消息已记录的用量（message_id → (input, output, cache_write, cache_read)，最早的在前）"""
+        return {message_id: tuple(usage) for message_id, usage in self.messages.items()}
+
+    def _date(self, timestamp: float) -> str:
+        if not self._day_start <= timestamp < self._day_end:
+            day = datetime.fromtimestamp(timestamp).date()
+            start = datetime.combine(day, datetime.min.time())
+            self._day = day.isoformat()
+            self._day_start = start.timestamp()
+            self._day_end = (start + timedelta(days=1)).timestamp()
+        return self._day
+
+    def _take_pending(self) -> Tuple[bytes, bytes, int]:
+        """取走缓冲（事件循环线程中调用）"""
+        strings = b''.join(json.dumps(value).encode('utf-8') + b'\n' for value in self._pending_strings)
+        records = bytes(self._pending_records)
+        count = self._pending_count
+        self._pending_strings = []
+        self._pending_records = bytearray()
+        self._pending_count = 0
+        return strings, records, count
+
+    def _write(self, strings: bytes, records: bytes, count: int):
+        """写入并 fsync（先字典后日志）"""
+        if strings:
+            self._dict.write(strings)
+            self._dict.flush()
+            os.fsync(self._dict.fileno())
+        if records:
+            self._journal.write(records)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal_records += count
+            self.flushes += 1
+
+    def flush(self, pending: Optional[Tuple[bytes, bytes, int]] = None):
+        """把缓冲写入日志并 fsync（在线程池中调用时，先在事件循环线程中用 take() 取走缓冲再传入）"""
+        if pending is None:
+            pending = self._take_pending()
+        with self._io_lock:
+            if self._journal is not None:
+                self._write(*pending)
+
+    def take(self) -> Tuple[bytes, bytes, int]:
+        """取走待写入的缓冲（与 flush(pending) 配合使用）"""
+        return self._take_pending()
+
+    @property
+    def needs_snapshot(self) -> bool:
+        """日志是否需要压缩（距上次快照超过 snapshot_interval，或记录数超过 snapshot_records）"""
+        records = self._journal_records + self._pending_count
+        if records == 0:
+            return False
+        return (records >= self.snapshot_records
+                or time.monotonic() - self.last_snapshot >= self.snapshot_interval)
+
+    def prepare_snapshot(self) -> Tuple[Tuple[bytes, bytes, int], bytes, int]:
+        """
+        取走缓冲并导出当前合计（事件循环线程中调用），之后的增量使用新代号的字符串 id
+        """
+        pending = self._take_pending()
+        self.generation += 1
+        snapshot = json.dumps({
+            'version': SNAPSHOT_VERSION,
+            'generation': self.generation,
+            'created': time.time(),
+            'first_usage': self.first_usage,
+            'last_usage': self.last_usage,
+            'cells': [list(key) + counts for key, counts in self.cells.items()],
+            'days': [list(key) + counts for key, counts in self.days.items()],
+            'messages': [[message_id] + usage for message_id, usage in self.messages.items()],
+        }, separators=(',', ':')).encode('utf-8')
+        self._ids = {}
+        self._strings = []
+        return pending, snapshot, self.generation
+
+    def compact(self, prepared: Optional[Tuple[Tuple[bytes, bytes, int], bytes, int]] = None):
+        """
+        写入快照并以新代号重建日志
+
+        顺序：旧缓冲落盘 → 快照原子替换 → 重建字典 → 重建日志；任一步中断，重启时都能得到一致的合计
+        """
+        if self._journal is None:
+            return
+        if prepared is None:
+            prepared = self.prepare_snapshot()
+        pending, snapshot, generation = prepared
+
+        with self._io_lock:
+            self._write(*pending)
+            _fsync_write(self.path / SNAPSHOT_FILE, snapshot)
+
+            self._journal.close()
+            self._dict.close()
+            # 新代号的字符串在 prepare_snapshot 之后才开始积累，此时仍在缓冲中
+            _fsync_write(self.path / DICT_FILE, json.dumps({'generation': generation}).encode('utf-8') + b'\n')
+            _fsync_write(self.path / JOURNAL_FILE, HEADER.pack(JOURNAL_MAGIC, generation))
+            self._journal = open(self.path / JOURNAL_FILE, 'ab')
+            self._dict = open(self.path / DICT_FILE, 'ab')
+            self._journal_records = 0
+
+        self.last_snapshot = time.monotonic()
+        self.snapshots += 1
+
+    def close(self):
+        """压缩并关闭（正常退出时调用，下次启动不需要重放日志）"""
+        if self._journal is None:
+            return
+        self.compact()
+        with self._io_lock:
+            self._journal.close()
+            self._dict.close()
+            self._journal = None
+            self._dict = None
+
+    # === 查询 ===
+
+    def iter_cells(self) -> Iterator[Tuple[CellKey, List[int]]]:
+        """((model, project, session, agent_type), [input, output, cache_write, cache_read, messages])"""
+        return iter(self.cells.items())
+
+    def history(self, days: int = 7, group_by: Optional[str] = None, today: Optional[date] = None) -> List[Dict]:
+        """
+        最近 days 天的每日用量（本地日期，含今天；没有用量的日期为 0）
+
+        Args:
+            group_by: 'model' / 'project'，每天附带该维度的明细
+
+        Raises:
+            ValueError: 未知维度或天数无效
+        """
+        if group_by is not None and group_by not in HISTORY_DIMENSIONS:
+            raise ValueError(f'Unknown dimension: {group_by!r} (expected one of {", ".join(HISTORY_DIMENSIONS)})')
+        if not 0 < days <= MAX_HISTORY_DAYS:
+            raise ValueError(f'Invalid days: {days!r} (expected 1-{MAX_HISTORY_DAYS})')
+
+        today = today or date.today()
+        dates = [(today - timedelta(days=offset)).isoformat() for offset in range(days - 1, -1, -1)]
+        totals = {day: [0] * NUM_COUNTS for day in dates}
+        groups: Dict[str, Dict[str, List[int]]] = {day: {} for day in dates}
+        index = HISTORY_DIMENSIONS.index(group_by) + 1 if group_by else None
+
+        for key, counts in self.days.items():
+            day = key[0]
+            if day not in totals:
+                continue
+            _add_counts(totals, day, counts)
+            if index is not None:
+                _add_counts(groups[day], key[index], counts)
+
+        rows = []
+        for day in dates:
+            row = {'date': day, **self._counts(totals[day])}
+            if index is not None:
+                items = sorted(groups[day].items(), key=lambda item: item[1][0] + item[1][1], reverse=True)
+                row[group_by] = {name: self._counts(counts) for name, counts in items}
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _counts(counts: Sequence[int]) -> Dict:
+        return {
+            'input': counts[0],
+            'output': counts[1],
+            'cache_write': counts[2],
+            'cache_read': counts[3],
+            'sum': counts[0] + counts[1],
+            'messages': counts[4],
+        }
+
+    def get_stats(self) -> Dict:
+        """存储统计"""
+        return {
+            'path': str(self.path),
+            'generation': self.generation,
+            'cells': len(self.cells),
+            'messages': len(self.messages),
+            'days': len({key[0] for key in self.days}),
+            'journal_records': self._journal_records,
+            'pending_records': self._pending_count,
+            'appended': self.appended,
+            'flushes': self.flushes,
+            'snapshots': self.snapshots,
+            'replayed': self.replayed,
+            'truncated_bytes': self.truncated_bytes,
+            'load_ms': round(self.load_seconds * 1000, 2),
+        }
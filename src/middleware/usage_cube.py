@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+UsageCube - 多维 Token 用量立方体
+
+维度：model / project / session / agent_type（每个 UsageDelta 落入一个单元格）
+- 维度值按维度驻留（字符串 → 整数 id），单元格键为四个 id 组成的元组，不重复保存字符串
+- 计数器存放在一个连续的 array('q') 中（每个单元格 input / output / cache_write / cache_read / messages），
+  每个增量 O(1) 更新：一次字典查找 + 五次整数加法
+- 查询直接扫描单元格（单元格数量有界），不需要重新读取日志：
+  - group_by(['model', 'project'], filters={'agent_type': 'main'})
+  - rollup(['project', 'model'])：SQL ROLLUP 语义，附带每一层的小计和总计
+- 单元格数量有上限：超出时最久未更新的单元格并入同一 model / project / agent_type 下的
+  OTHER_SESSION 会话单元格，按其余维度分组的合计保持精确（维度值表只增不减，每个会话 id 约 100 字节）
+"""
+
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.plugins.base import UsageDelta
+from .token_ledger import TOKEN_FIELDS
+
+# 维度（顺序即单元格键中的位置）
+DIMENSIONS = ('model', 'project', 'session', 'agent_type')
+
+# 每个单元格的计数字段
+CELL_FIELDS = TOKEN_FIELDS + ('messages',)
+NUM_CELL_FIELDS = len(CELL_FIELDS)
+
+# 被淘汰的会话单元格并入的会话名
+OTHER_SESSION = '(other)'
+
+SESSION_INDEX = DIMENSIONS.index('session')
+
+
+class InternTable:
+    """维度值驻留表（字符串 ↔ 整数 id）"""
+
+    __slots__ = ('ids', 'values')
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def intern(self, value: str) -> int:
+        key = self.ids.get(value)
+        if key is None:
+            key = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return key
+
+    def lookup(self, value: str) -> Optional[int]:
+        return self.ids.get(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class UsageCube:
+    """(model, project, session, agent_type) 用量立方体"""
+
+    def __init__(self, max_cells: int = 65536):
+        self.max_cells = max(1, max_cells)
+
+        self.dimensions = {name: InternTable() for name in DIMENSIONS}
+        self._tables = [self.dimensions[name] for name in DIMENSIONS]
+        # 单元格键 → 槽位（按最近更新排序，最久未更新的在前）
+        self.cells: 'OrderedDict[Tuple[int, ...], int]' = OrderedDict()
+        # 槽位 i 的计数：counters[i * NUM_CELL_FIELDS:(i + 1) * NUM_CELL_FIELDS]
+        self.counters = array('q')
+        # 空闲槽位（被淘汰单元格的位置，优先复用）
+        self._free: List[int] = []
+
+        # 统计
+        self.applied = 0
+        self.evicted_cells = 0
+
+    def apply(self, delta: UsageDelta):
+        """累加一个增量（O(1)）"""
+        agent_type = delta.agent_type or ('main' if delta.agent_id is None else 'subagent')
+        values = (delta.input, delta.output, delta.cache_write, delta.cache_read, 1 if delta.new_message else 0)
+        self._add((delta.model or 'unknown', delta.project, delta.session_id, agent_type), values)
+        self.applied += 1
+
+    def restore(self, dims: Sequence[str], counts: Sequence[int]):
+        """恢复一个单元格的已汇总计数（model, project, session, agent_type；启动时从持久化存储加载）"""
+        self._add(dims, counts)
+
+    def _add(self, dims: Sequence[str], values: Sequence[int]):
+        key = tuple(table.intern(value) for table, value in zip(self._tables, dims))
+        slot = self.cells.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+        else:
+            self.cells.move_to_end(key)
+
+        counters = self.counters
+        base = slot * NUM_CELL_FIELDS
+        for i in range(NUM_CELL_FIELDS):
+            counters[base + i] += values[i]
+
+    def _allocate(self, key: Tuple[int, ...]) -> int:
+        """为新单元格分配槽位（超出上限时先淘汰最久未更新的单元格）"""
+        other = self._tables[SESSION_INDEX].intern(OTHER_SESSION)
+        skipped = 0
+        while len(self.cells) >= self.max_cells and skipped < len(self.cells):
+            old_key, old_slot = next(iter(self.cells.items()))
+            if old_key[SESSION_INDEX] == other:
+                # OTHER_SESSION 单元格本身不淘汰（数量以 model × project × agent_type 为界）
+                self.cells.move_to_end(old_key)
+                skipped += 1
+                continue
+            self._evict(old_key, old_slot, other)
+
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self.counters) // NUM_CELL_FIELDS
+            self.counters.extend((0,) * NUM_CELL_FIELDS)
+        self.cells[key] = slot
+        return slot
+
+    def _evict(self, key: Tuple[int, ...], slot: int, other: int):
+        """把单元格并入同维度的 OTHER_SESSION 单元格"""
+        del self.cells[key]
+        counters = self.counters
+        base = slot * NUM_CELL_FIELDS
+        values = counters[base:base + NUM_CELL_FIELDS]
+        for i in range(NUM_CELL_FIELDS):
+            counters[base + i] = 0
+        self._free.append(slot)
+        self.evicted_cells += 1
+
+        merged = list(key)
+        merged[SESSION_INDEX] = other
+        merged = tuple(merged)
+        target = self.cells.get(merged)
+        if target is None:
+            target = self._free.pop()
+            self.cells[merged] = target
+        base = target * NUM_CELL_FIELDS
+        for i in range(NUM_CELL_FIELDS):
+            counters[base + i] += values[i]
+
+    def group_by(self, dimensions: Sequence[str] = (), filters: Optional[Dict[str, str]] = None,
+                 limit: Optional[int] = None) -> List[Dict]:
+        """
+        按维度分组的合计（按 input + output 从大到小）
+
+        Args:
+            dimensions: 分组维度（DIMENSIONS 的子集，空表示总计）
+            filters: 维度 → 取值（只统计匹配的单元格）
+            limit: 最多返回的行数
+
+        Raises:
+            ValueError: 未知维度
+        """
+        indexes = self._indexes(dimensions)
+        groups = self._group(indexes, self._match(filters))
+        rows = [self._row(dimensions, indexes, key, totals) for key, totals in groups.items()]
+        rows.sort(key=lambda row: row['sum'], reverse=True)
+        return rows[:limit] if limit is not None else rows
+
+    def rollup(self, dimensions: Sequence[str], filters: Optional[Dict[str, str]] = None,
+               limit: Optional[int] = None) -> List[Dict]:
+        """
+        ROLLUP 查询：依次按 dimensions[:n]、dimensions[:n-1]、...、() 分组，
+        被汇总的维度取值为 None（例如 ['project', 'model'] 返回 项目×模型、项目小计、总计）
+        """
+        indexes = self._indexes(dimensions)
+        groups = self._group(indexes, self._match(filters))
+
+        rows = []
+        for level in range(len(dimensions), -1, -1):
+            subtotals: Dict[Tuple[int, ...], List[int]] = {}
+            for key, totals in groups.items():
+                target = subtotals.get(key[:level])
+                if target is None:
+                    subtotals[key[:level]] = list(totals)
+                else:
+                    for i in range(NUM_CELL_FIELDS):
+                        target[i] += totals[i]
+            level_rows = [
+                self._row(dimensions, indexes, key + (None,) * (len(dimensions) - level), totals)
+                for key, totals in subtotals.items()
+            ]
+            level_rows.sort(key=lambda row: row['sum'], reverse=True)
+            rows.extend(level_rows[:limit] if limit is not None else level_rows)
+        return rows
+
+    def values(self, dimension: str) -> List[str]:
+        """某个维度出现过的所有取值"""
+        self._indexes([dimension])
+        return list(self.dimensions[dimension].values)
+
+    def get_stats(self) -> Dict:
+        """单元格数量、各维度基数和内存"""
+        return {
+            'cells': len(self.cells),
+            'max_cells': self.max_cells,
+            'evicted_cells': self.evicted_cells,
+            'cardinality': {name: len(table) for name, table in self.dimensions.items()},
+            'counter_bytes': self.counters.itemsize * len(self.counters),
+            'applied': self.applied,
+        }
+
+    def reset(self):
+        """清空立方体"""
+        for table in self._tables:
+            table.ids.clear()
+            table.values.clear()
+        self.cells.clear()
+        self.counters = array('q')
+        self._free.clear()
+
+    @staticmethod
+    def _indexes(dimensions: Sequence[str]) -> List[int]:
+        indexes = []
+        for name in dimensions:
+            if name not in DIMENSIONS:
+                raise ValueError(f'Unknown dimension: {name!r} (expected one of {", ".join(DIMENSIONS)})')
+            indexes.append(DIMENSIONS.index(name))
+        return indexes
+
+    def _match(self, filters: Optional[Dict[str, str]]):
+        """把维度过滤条件转换为 (位置, id) 列表；取值从未出现过时返回 None（没有匹配的单元格）"""
+        conditions = []
+        for name, value in (filters or {}).items():
+            index = self._indexes([name])[0]
+            key = self._tables[index].lookup(value)
+            if key is None:
+                return None
+            conditions.append((index, key))
+        return conditions
+
+    def _group(self, indexes: List[int], conditions) -> Dict[Tuple[int, ...], List[int]]:
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        if conditions is None:
+            return groups
+
+        counters = self.counters
+        for key, slot in self.cells.items():
+            if any(key[index] != value for index, value in conditions):
+                continue
+            group = tuple(key[index] for index in indexes)
+            base = slot * NUM_CELL_FIELDS
+            totals = groups.get(group)
+            if totals is None:
+                groups[group] = counters[base:base + NUM_CELL_FIELDS].tolist()
+            else:
+                for i in range(NUM_CELL_FIELDS):
+                    totals[i] += counters[base + i]
+        return groups
+
+    def _row(self, dimensions: Sequence[str], indexes: List[int],
+             key: Tuple[Optional[int], ...], totals: Sequence[int]) -> Dict:
+        row = {
+            name: (self._tables[index].values[value] if value is not None else None)
+            for name, index, value in zip(dimensions, indexes, key)
+        }
+        row.update(zip(CELL_FIELDS, totals))
+        row['sum'] = row['input'] + row['output']
+        return row
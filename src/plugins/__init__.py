@@ -3,7 +3,7 @@
 Plugins - 插件系统
 """
 
-from .base import BasePlugin, StateEvent, Status, PluginType, PluginMetadata
+from .base import BasePlugin, StateEvent, Status, PluginType, PluginMetadata, UsageDelta
 from .claude_log import ClaudeLogPlugin
 
 __all__ = [
@@ -12,5 +12,6 @@ __all__ = [
     'Status',
     'PluginType',
     'PluginMetadata',
+    'UsageDelta',
     'ClaudeLogPlugin',
 ]
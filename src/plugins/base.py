@@ -10,6 +10,7 @@ from enum import Enum
 from typing import Dict, List, Optional, Callable, Any
 from datetime import datetime
 import json
+import time
 
 
 class Status(Enum):
@@ -82,6 +83,31 @@ class StateEvent:
         return cls(**data)
 
 
+@dataclass
+class UsageDelta:
+    """
+    Token 用量增量（按消息）
+
+    插件对每条消息只发送它新增的用量：同一 message_id 的后续增量只包含比上次多出的部分，
+    下游直接累加即可得到精确合计（不需要去重，也不会重复累加累计值）
+    """
+    source: str
+    project: str
+    session_id: str
+    agent_id: Optional[str] = None
+    message_id: str = ''
+    # 生成该消息的模型（message.model）和 Agent 类型（主会话为 'main'，子 Agent 为 Task 的 subagent_type）
+    model: str = ''
+    agent_type: str = ''
+    input: int = 0
+    output: int = 0
+    cache_write: int = 0
+    cache_read: int = 0
+    # 该消息的第一个增量（用于统计消息数）
+    new_message: bool = True
+    timestamp: float = field(default_factory=time.time)
+
+
 class BasePlugin(ABC):
     """
     插件基类
@@ -96,6 +122,7 @@ class BasePlugin(ABC):
     def __init__(self, config: Optional[Dict] = None):
         self.config = config or {}
         self.callbacks: List[Callable[[StateEvent], None]] = []
+        self.usage_callbacks: List[Callable[[UsageDelta], None]] = []
         self.enabled = self.config.get('enabled', True)
         self.priority = self.config.get('priority', 5)
         self.running = False
@@ -130,6 +157,26 @@ class BasePlugin(ABC):
         """注册事件回调"""
         self.callbacks.append(callback)
     
+    def register_usage_callback(self, callback: Callable[[UsageDelta], None]):
+        """注册 Token 用量增量回调"""
+        self.usage_callbacks.append(callback)
+    
+    def restore_message_usage(self, usage: Dict[str, tuple]):
+        """
+        恢复已持久化的按消息用量（启动时、插件启动之前调用）
+        
+        重读已计入的行时只应发送超出这些用量的部分；默认不处理
+        """
+        pass
+    
+    def _emit_usage(self, delta: UsageDelta):
+        """发送 Token 用量增量（不经过状态事件流水线，不会被合并或丢弃）"""
+        for callback in self.usage_callbacks:
+            try:
+                callback(delta)
+            except Exception as e:
+                print(f"[{self.metadata.name}] Usage callback error: {e}")
+    
     def _emit(self, event: StateEvent):
         """发送事件到所有回调"""
         for callback in self.callbacks:
@@ -0,0 +1,563 @@
+# -*- coding: utf-8 -*-
+"""
+历史回填：并行扫描 projects_dir 下的全部 transcript
+
+实时路径启动时只把已有文件标记为已读，历史会话不参与任何统计。回填引擎：
+
+- 列出所有 *.jsonl 及压缩归档（*.jsonl.gz / *.jsonl.zst），按剩余字节从大到小分组为任务
+  （大文件最先开始，避免长尾）
+- 任务分发到 ProcessPoolExecutor，每个进程内存映射文件（MmapLineReader）；归档在工作进程中
+  流式解压（open_transcript），使用与实时路径相同的预分类 + 类型化解码
+  （RecordDecoder + RECORD_SCHEMAS），只解码需要的记录类型
+- 每个文件产出一个部分聚合（Token、工具调用次数、回合数、会话），在主进程中合并（map-reduce）
+- 可续跑：每个文件的读取位置和部分聚合在同一事务中写入回填检查点数据库；
+  中断后从位置续读，文件被替换或截断时丢弃旧的部分聚合并从头扫描，
+  已删除文件的部分聚合作为历史保留
+- 检查点和部分聚合按原始 .jsonl 路径记录，读取位置为解压后的偏移：
+  文件被压缩归档后从原来的位置续读，不会重复计数；同时存在原始文件和归档时以原始文件为准
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from .claude_records import RECORD_SCHEMAS
+from .session_state import parse_transcript_path
+from src.utils.archive_reader import (
+    ESTIMATED_RATIO, TRANSCRIPT_SUFFIXES, archive_supported, is_archive, open_transcript,
+    transcript_key, uncompressed_size
+)
+from src.utils.checkpoint import Checkpoint, CheckpointStore
+from src.utils.jsonl_decoder import RecordDecoder
+from src.utils.jsonl_reader import JsonlTailReader
+from src.utils.mmap_reader import MmapLineReader
+
+# 回填只需要这些记录类型（其余类型在预分类阶段跳过）
+BACKFILL_RECORD_TYPES = ('assistant', 'system', 'summary')
+
+# 检查点数据库中部分聚合的键前缀
+STATE_PREFIX = 'backfill:'
+
+# 单个任务的目标字节数（小文件合并为一个任务，大文件单独成任务）
+DEFAULT_TASK_BYTES = 64 * 1024 * 1024
+
+# 归档每次解压读取的字节数
+ARCHIVE_READ_BYTES = 16 * 1024 * 1024
+
+
+class UsageAggregate:
+    """可合并的部分聚合"""
+
+    __slots__ = ('tokens', 'tools', 'turns', 'messages', 'records', 'sessions', 'subagents', 'bytes')
+
+    def __init__(self):
+        self.tokens: Dict[str, int] = {
+            'input': 0,
+            'output': 0,
+            'cache_write': 0,
+            'cache_read': 0,
+        }
+        self.tools: Dict[str, int] = {}
+        self.turns = 0
+        self.messages = 0
+        self.records = 0
+        # 会话（project/session_id，子 Agent 归入所属会话）
+        self.sessions: Set[str] = set()
+        self.subagents = 0
+        self.bytes = 0
+
+    def add_usage(self, usage):
+        """累加一条 Usage 记录"""
+        if usage is None:
+            return
+        self.tokens['input'] += usage.input_tokens or 0
+        self.tokens['output'] += usage.output_tokens or 0
+        self.tokens['cache_write'] += usage.cache_creation_input_tokens or 0
+        self.tokens['cache_read'] += usage.cache_read_input_tokens or 0
+
+    def add_message_usage(self, message_id: str, usage, seen: Dict[str, Tuple[int, int, int, int]]):
+        """
+        累加一条消息的 Usage（与实时路径相同的增量语义）
+
+        同一 message_id 的多行只计入比已计入部分多出的差值（各字段取最大值）
+        """
+        current = (0, 0, 0, 0) if usage is None else (
+            usage.input_tokens or 0,
+            usage.output_tokens or 0,
+            usage.cache_creation_input_tokens or 0,
+            usage.cache_read_input_tokens or 0,
+        )
+        previous = seen.get(message_id) if message_id else None
+        if previous is None:
+            self.messages += 1
+            delta = current
+        else:
+            merged = tuple(max(old, new) for old, new in zip(previous, current))
+            delta = tuple(value - old for value, old in zip(merged, previous))
+            current = merged
+        if message_id:
+            seen[message_id] = current
+
+        tokens = self.tokens
+        tokens['input'] += delta[0]
+        tokens['output'] += delta[1]
+        tokens['cache_write'] += delta[2]
+        tokens['cache_read'] += delta[3]
+
+    def merge(self, other: 'UsageAggregate') -> 'UsageAggregate':
+        """合并另一个部分聚合（原地）"""
+        for key, value in other.tokens.items():
+            self.tokens[key] = self.tokens.get(key, 0) + value
+        for name, count in other.tools.items():
+            self.tools[name] = self.tools.get(name, 0) + count
+        self.turns += other.turns
+        self.messages += other.messages
+        self.records += other.records
+        self.sessions |= other.sessions
+        self.subagents += other.subagents
+        self.bytes += other.bytes
+        return self
+
+    def to_dict(self) -> Dict:
+        """可序列化的完整形式（用于跨进程传递和持久化）"""
+        return {
+            'tokens': dict(self.tokens),
+            'tools': dict(self.tools),
+            'turns': self.turns,
+            'messages': self.messages,
+            'records': self.records,
+            'sessions': sorted(self.sessions),
+            'subagents': self.subagents,
+            'bytes': self.bytes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'UsageAggregate':
+        aggregate = cls()
+        aggregate.tokens.update(data.get('tokens', {}))
+        aggregate.tools.update(data.get('tools', {}))
+        aggregate.turns = data.get('turns', 0)
+        aggregate.messages = data.get('messages', 0)
+        aggregate.records = data.get('records', 0)
+        aggregate.sessions = set(data.get('sessions', ()))
+        aggregate.subagents = data.get('subagents', 0)
+        aggregate.bytes = data.get('bytes', 0)
+        return aggregate
+
+    def summary(self) -> Dict:
+        """汇总（会话只报告数量）"""
+        tools = sorted(self.tools.items(), key=lambda item: item[1], reverse=True)
+        return {
+            'tokens': {**self.tokens, 'sum': self.tokens['input'] + self.tokens['output']},
+            'tools': dict(tools),
+            'tool_calls': sum(self.tools.values()),
+            'turns': self.turns,
+            'messages': self.messages,
+            'records': self.records,
+            'sessions': len(self.sessions),
+            'subagents': self.subagents,
+            'bytes': self.bytes,
+        }
+
+
+# === 工作进程 ===
+
+# 每个工作进程复用一个解码器（解码统计只在进程内有意义）
+_worker_decoder: Optional[RecordDecoder] = None
+
+
+def _get_decoder(max_record_bytes: int) -> RecordDecoder:
+    global _worker_decoder
+    if _worker_decoder is None or _worker_decoder.max_record_bytes != max_record_bytes:
+        _worker_decoder = RecordDecoder(
+            BACKFILL_RECORD_TYPES,
+            max_record_bytes=max_record_bytes,
+            schemas=RECORD_SCHEMAS
+        )
+    return _worker_decoder
+
+
+def scan_file(file_path: str, offset: int, max_record_bytes: int,
+              max_line_bytes: Optional[int] = None) -> Tuple[Checkpoint, UsageAggregate]:
+    """
+    从 offset 开始扫描单个文件（工作进程中调用）
+
+    普通文件内存映射，行以 memoryview 交给解码器；归档流式解压，offset 为解压后的位置
+
+    Returns:
+        (扫描结束时的检查点（路径为原始 .jsonl 路径）, 本次扫描的部分聚合)
+    """
+    decoder = _get_decoder(max_record_bytes)
+    aggregate = UsageAggregate()
+
+    key = transcript_key(file_path)
+    info = parse_transcript_path(key)
+    session = f"{info['project']}/{info['session_id']}"
+
+    # 扫描前记录文件签名：扫描期间的追加会在下次回填时按位置续读
+    st = os.stat(file_path)
+
+    # 同一条消息按内容块拆成多行，每行携带该消息的 usage：按 message.id 只计入新增部分
+    seen_messages: Dict[str, Tuple[int, int, int, int]] = {}
+
+    if is_archive(file_path):
+        reader = JsonlTailReader(max_line_bytes=max_line_bytes, opener=open_transcript)
+        reader.set_offset(file_path, offset)
+        try:
+            more = True
+            while more:
+                lines, more = reader.read_lines(file_path, max_bytes=ARCHIVE_READ_BYTES)
+                _aggregate_lines(lines, decoder, aggregate, seen_messages)
+            end = max(reader.offsets.get(file_path, offset), offset)
+        finally:
+            reader.close_all()
+    else:
+        with MmapLineReader(file_path, max_line_bytes=max_line_bytes) as reader:
+            # 只扫描到最后一个完整行，不完整的尾行留给下次
+            end = max(reader.tail_end(), offset)
+            _aggregate_lines(reader.iter_lines(offset, end), decoder, aggregate, seen_messages)
+
+    aggregate.bytes = end - offset
+    if aggregate.records:
+        aggregate.sessions.add(session)
+        if info['is_subagent'] and offset == 0:
+            aggregate.subagents = 1
+
+    checkpoint = Checkpoint(
+        path=key,
+        device=st.st_dev,
+        inode=st.st_ino,
+        mtime_ns=st.st_mtime_ns,
+        size=st.st_size,
+        offset=end
+    )
+    return checkpoint, aggregate
+
+
+def _aggregate_lines(lines: Iterable, decoder: RecordDecoder, aggregate: UsageAggregate,
+                     seen_messages: Dict[str, Tuple[int, int, int, int]]):
+    """解码一批行并累加到部分聚合（行的切片在函数返回后即释放）"""
+    for line in lines:
+        record = decoder.decode(line)
+        if record is None:
+            continue
+
+        aggregate.records += 1
+        record_type, event = record
+
+        if record_type == 'assistant':
+            message = event.message
+            if message is None:
+                continue
+            for block in message.content:
+                if block.type == 'tool_use' and block.name:
+                    aggregate.tools[block.name] = aggregate.tools.get(block.name, 0) + 1
+            aggregate.add_message_usage(message.id, message.usage, seen_messages)
+
+        elif record_type == 'system':
+            if event.subtype == 'turn_duration':
+                aggregate.turns += 1
+
+        elif record_type == 'summary':
+            aggregate.add_usage(event.usage)
+
+
+def _scan_task(files: List[Tuple[str, int]], max_record_bytes: int,
+               max_line_bytes: Optional[int]) -> List[Tuple[Checkpoint, Dict]]:
+    """扫描一组文件（工作进程入口；聚合以字典形式返回，减少序列化开销）"""
+    results = []
+    for file_path, offset in files:
+        try:
+            checkpoint, aggregate = scan_file(file_path, offset, max_record_bytes, max_line_bytes)
+        except OSError:
+            continue  # 文件在扫描前被删除
+        results.append((checkpoint, aggregate.to_dict()))
+    return results
+
+
+def plan_tasks(files: Iterable[Tuple[str, int, int]],
+               task_bytes: int = DEFAULT_TASK_BYTES) -> List[List[Tuple[str, int]]]:
+    """
+    把待扫描文件分组为任务
+
+    Args:
+        files: (路径, 起始位置, 文件大小（归档为解压后大小的估算）)
+
+    Returns:
+        任务列表（按剩余字节从大到小；超过 task_bytes 的文件单独成任务）
+    """
+    ranked = sorted(files, key=lambda item: item[2] - item[1], reverse=True)
+
+    tasks: List[List[Tuple[str, int]]] = []
+    current: List[Tuple[str, int]] = []
+    current_bytes = 0
+
+    for file_path, offset, size in ranked:
+        remaining = size - offset
+        if remaining >= task_bytes:
+            tasks.append([(file_path, offset)])
+            continue
+        current.append((file_path, offset))
+        current_bytes += remaining
+        if current_bytes >= task_bytes:
+            tasks.append(current)
+            current, current_bytes = [], 0
+
+    if current:
+        tasks.append(current)
+    return tasks
+
+
+def list_transcripts(root: str, suffix: Union[str, Tuple[str, ...]] = '.jsonl'
+                     ) -> List[Tuple[str, os.stat_result]]:
+    """递归列出所有 transcript（scandir，每个文件只 stat 一次；suffix 可为多个后缀）"""
+    files = []
+    pending = [root]
+
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.name.endswith(suffix):
+                            files.append((entry.path, entry.stat()))
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+    return files
+
+
+class BackfillEngine:
+    """并行历史回填引擎"""
+
+    def __init__(self, projects_dir: str,
+                 store: Optional[CheckpointStore] = None,
+                 workers: Optional[int] = None,
+                 task_bytes: int = DEFAULT_TASK_BYTES,
+                 max_record_bytes: int = 8 * 1024 * 1024,
+                 max_line_bytes: Optional[int] = None):
+        self.projects_dir = str(projects_dir)
+        self.store = store
+        # None / 0：使用全部 CPU；1：在当前进程中执行（不创建进程池）
+        self.workers = workers or os.cpu_count() or 1
+        self.task_bytes = task_bytes
+        self.max_record_bytes = max_record_bytes
+        self.max_line_bytes = max_line_bytes
+
+        # 每个文件的部分聚合（包括已删除文件的历史）
+        self.files: Dict[str, UsageAggregate] = {}
+        self.result = UsageAggregate()
+
+        self._cancelled = threading.Event()
+
+        # 统计
+        self.stats: Dict[str, float] = {
+            'files': 0,
+            'files_scanned': 0,
+            'files_unchanged': 0,
+            'files_reset': 0,
+            'archives': 0,
+            'archives_unsupported': 0,
+            'tasks': 0,
+            'bytes_scanned': 0,
+            'seconds': 0.0,
+            'mb_per_second': 0.0,
+            'workers': self.workers,
+            'completed': False,
+        }
+
+    def cancel(self):
+        """请求停止（已完成的任务已写入检查点，下次从断点续跑）"""
+        self._cancelled.set()
+
+    def run(self, progress: Optional[Callable[[Dict], None]] = None) -> UsageAggregate:
+        """
+        执行回填（阻塞，直到完成或被取消）
+
+        Args:
+            progress: 每个任务完成后调用，参数为当前统计
+
+        Returns:
+            全部文件的合并聚合
+        """
+        start = time.perf_counter()
+        self._cancelled.clear()
+
+        try:
+            self._run(start, progress)
+        finally:
+            if self.store is not None:
+                self.store.close()
+
+        self.result = UsageAggregate()
+        for aggregate in self.files.values():
+            self.result.merge(aggregate)
+
+        self.stats['completed'] = not self._cancelled.is_set()
+        self._report(start, None)
+        return self.result
+
+    def get_stats(self) -> Dict:
+        """统计信息 + 当前合并结果"""
+        return {**self.stats, 'result': self.result.summary()}
+
+    def _run(self, start: float, progress: Optional[Callable[[Dict], None]]):
+        """比较检查点、规划任务并执行"""
+        checkpoints = self._load()
+
+        # 原始 .jsonl 路径 → (实际文件, stat)；压缩过程中两者并存时以原始文件为准
+        transcripts: Dict[str, Tuple[str, os.stat_result]] = {}
+        for file_path, st in list_transcripts(self.projects_dir, TRANSCRIPT_SUFFIXES):
+            key = transcript_key(file_path)
+            if key not in transcripts or not is_archive(file_path):
+                transcripts[key] = (file_path, st)
+        self.stats['files'] = len(transcripts)
+
+        pending: List[Tuple[str, int, int]] = []
+        for key, (file_path, st) in transcripts.items():
+            checkpoint = checkpoints.get(key)
+
+            if is_archive(file_path):
+                self.stats['archives'] += 1
+                if not archive_supported(file_path):
+                    # 缺少解压依赖：保留已有的部分聚合
+                    self.stats['archives_unsupported'] += 1
+                    continue
+                if checkpoint is not None and self._is_same_archive(checkpoint, st):
+                    self.stats['files_unchanged'] += 1
+                    continue
+                size = uncompressed_size(file_path, st)
+                if checkpoint is not None and self._is_archived_from(checkpoint, st, size):
+                    # 由已扫描的原始文件压缩而来：从解压后的相同位置续读
+                    offset = checkpoint.offset
+                else:
+                    offset = self._reset(key, checkpoint)
+                if size is None:
+                    size = max(st.st_size * ESTIMATED_RATIO, offset + st.st_size)
+                pending.append((file_path, offset, size))
+                continue
+
+            if checkpoint is not None and checkpoint.matches(st):
+                offset = checkpoint.offset
+            else:
+                offset = self._reset(key, checkpoint)
+
+            if st.st_size > offset:
+                pending.append((file_path, offset, st.st_size))
+            else:
+                self.stats['files_unchanged'] += 1
+
+        tasks = plan_tasks(pending, self.task_bytes)
+        self.stats['tasks'] = len(tasks)
+
+        if self.workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                if self._cancelled.is_set():
+                    break
+                self._commit(_scan_task(task, self.max_record_bytes, self.max_line_bytes))
+                self._report(start, progress)
+        else:
+            self._run_pool(tasks, start, progress)
+
+    def _reset(self, key: str, checkpoint: Optional[Checkpoint]) -> int:
+        """文件被替换或截断：旧的部分聚合作废，从头扫描"""
+        if checkpoint is not None or key in self.files:
+            self.files.pop(key, None)
+            self.stats['files_reset'] += 1
+        return 0
+
+    @staticmethod
+    def _is_same_archive(checkpoint: Checkpoint, st: os.stat_result) -> bool:
+        """
+        检查点是否来自这个归档且归档未变化
+
+        归档的读取位置是解压后的偏移，不能与压缩后的文件大小比较，直接比较文件签名
+        """
+        return (
+            (checkpoint.device, checkpoint.inode) == (st.st_dev, st.st_ino)
+            and checkpoint.mtime_ns == st.st_mtime_ns
+            and checkpoint.size == st.st_size
+        )
+
+    @staticmethod
+    def _is_archived_from(checkpoint: Checkpoint, st: os.stat_result, size: Optional[int]) -> bool:
+        """
+        检查点是否属于压缩前的原始文件
+
+        归档是新文件（inode 不同）；归档自身的检查点发生变化说明归档被重写，需要从头扫描。
+        解压后大小已知时（seekable zstd），读取位置超出大小的检查点不属于该归档
+        """
+        if (checkpoint.device, checkpoint.inode) == (st.st_dev, st.st_ino):
+            return False
+        return size is None or checkpoint.offset <= size
+
+    def _run_pool(self, tasks: List[List[Tuple[str, int]]], start: float,
+                  progress: Optional[Callable[[Dict], None]]):
+        """进程池执行：同时在途的任务数限制为 workers 的两倍，以便及时响应取消"""
+        queue = list(reversed(tasks))
+        in_flight = set()
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while queue or in_flight:
+                    while queue and len(in_flight) < self.workers * 2 and not self._cancelled.is_set():
+                        in_flight.add(executor.submit(
+                            _scan_task, queue.pop(), self.max_record_bytes, self.max_line_bytes
+                        ))
+                    if not in_flight:
+                        break
+
+                    done, in_flight = wait(in_flight, timeout=1.0, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._commit(future.result())
+                        self._report(start, progress)
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def _commit(self, results: List[Tuple[Checkpoint, Dict]]):
+        """合并一个任务的结果，位置和部分聚合在同一事务中写入"""
+        state = {}
+        for checkpoint, data in results:
+            aggregate = UsageAggregate.from_dict(data)
+            existing = self.files.get(checkpoint.path)
+            if existing is not None:
+                aggregate = existing.merge(aggregate)
+            self.files[checkpoint.path] = aggregate
+            state[STATE_PREFIX + checkpoint.path] = json.dumps(aggregate.to_dict(), separators=(',', ':'))
+
+            self.stats['files_scanned'] += 1
+            self.stats['bytes_scanned'] += data['bytes']
+
+        if self.store is not None and results:
+            self.store.save([checkpoint for checkpoint, _ in results], state=state)
+
+    def _load(self) -> Dict[str, Checkpoint]:
+        """加载检查点和部分聚合"""
+        self.files.clear()
+        if self.store is None:
+            return {}
+
+        for key, value in self.store.load_state(STATE_PREFIX).items():
+            try:
+                self.files[key[len(STATE_PREFIX):]] = UsageAggregate.from_dict(json.loads(value))
+            except ValueError:
+                pass
+        return self.store.load()
+
+    def _report(self, start: float, progress: Optional[Callable[[Dict], None]]):
+        """更新吞吐统计"""
+        elapsed = time.perf_counter() - start
+        self.stats['seconds'] = round(elapsed, 3)
+        if elapsed > 0:
+            self.stats['mb_per_second'] = round(self.stats['bytes_scanned'] / elapsed / 1024 / 1024, 1)
+        if progress is not None:
+            progress(dict(self.stats))
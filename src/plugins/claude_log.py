@@ -11,16 +11,42 @@ ClaudeLogPlugin - Claude Code 日志监控插件
 """
 
 import os
-import json
-import glob
 import asyncio
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 from datetime import datetime
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-from .base import BasePlugin, StateEvent, Status, PluginType, PluginMetadata
+from .base import BasePlugin, StateEvent, Status, PluginType, PluginMetadata, UsageDelta
+from .claude_backfill import BackfillEngine, list_transcripts
+from .claude_records import RECORD_SCHEMAS
+from .session_state import SessionState, SessionStateTable, parse_transcript_path
+from src.utils.jsonl_reader import (
+    JsonlTailReader, OversizedLine, FILE_CREATED, FILE_DELETED, FILE_UNCHANGED
+)
+from src.utils.mmap_reader import MmapLineReader
+from src.utils.checkpoint import Checkpoint, CheckpointStore
+from src.utils.dedup import DedupFilter
+from src.utils.change_coalescer import ChangeCoalescer
+from src.utils.jsonl_decoder import RecordDecoder, classify
+from src.utils import inotify_watcher
+from src.utils.inotify_watcher import InotifyWatcher
+from src.utils.watch_manager import HotSetWatchManager
+from src.utils.stat_poller import StatPoller
+
+
+def parse_record_time(value: str) -> Optional[float]:
+    """记录的 ISO 8601 时间戳（'2025-01-01T12:00:00.000Z'）→ Unix 时间戳，无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
 
 
 class ClaudeLogPlugin(BasePlugin):
@@ -93,6 +119,17 @@ class ClaudeLogPlugin(BasePlugin):
         'api_error',                 # API 内部错误
     }
     
+    # 初始化时读取的尾部行数
+    INITIAL_TAIL_LINES = 10
+    
+    # 能决定状态的记录类型（初始化时向前查找）
+    STATUS_RECORD_TYPES = {'assistant', 'user', 'system'}
+    
+    # 需要处理的记录类型（其余类型在解码前直接跳过）
+    HANDLED_RECORD_TYPES = {
+        'assistant', 'user', 'summary', 'progress', 'system', 'file-history-snapshot',
+    }
+    
     def __init__(self, config: Optional[Dict] = None):
         super().__init__(config)
         
@@ -112,18 +149,81 @@ class ClaudeLogPlugin(BasePlugin):
         # Debug 模式（控制日志详细程度）
         self.debug = config.get('debug', False) if config else False
         
-        # 增量读取位置记录
-        self.file_positions: Dict[str, int] = {}
+        # 增量读取器（二进制尾读，保留不完整的尾行；超长行只读取前缀，其余部分在磁盘上跳过）
+        max_record_bytes = config.get('max_record_bytes', 8 * 1024 * 1024) if config else 8 * 1024 * 1024
+        max_line_bytes = config.get('max_line_bytes', max_record_bytes) if config else max_record_bytes
+        self.tail_reader = JsonlTailReader(max_line_bytes=max_line_bytes)
+        
+        # 增量读取位置记录（与 tail_reader 共享，只按已消费的完整行前进）
+        self.file_positions: Dict[str, int] = self.tail_reader.offsets
+        
+        # 读取位置检查点（重启后从检查点续读）
+        checkpoint_file = config.get('checkpoint_file', 'auto') if config else 'auto'
+        if checkpoint_file == 'auto':
+            checkpoint_file = Path.home() / '.claudecat' / 'checkpoints.db'
+        self.checkpoint_store: Optional[CheckpointStore] = (
+            CheckpointStore(checkpoint_file) if checkpoint_file else None
+        )
+        self.checkpoint_interval = config.get('checkpoint_interval', 5.0) if config else 5.0
+        
+        # 历史回填（启动时在后台并行扫描全部 transcript；进度写入独立的检查点数据库，可续跑）
+        self.backfill_on_start = config.get('backfill_on_start', False) if config else False
+        self.backfill_workers = config.get('backfill_workers', 0) if config else 0
+        backfill_file = config.get('backfill_file', 'auto') if config else 'auto'
+        if backfill_file == 'auto':
+            backfill_file = Path.home() / '.claudecat' / 'backfill.db'
+        self.backfill_file = backfill_file
+        self.backfill: Optional[BackfillEngine] = None
+        self._backfill_task: Optional[asyncio.Task] = None
+        
+        # 初始化时向前查找状态记录的最大字节数
+        self.initial_scan_bytes = config.get('initial_scan_bytes', 16 * 1024 * 1024) if config else 16 * 1024 * 1024
+        
+        # JSONL 解码器（预分类 + 快速 JSON 后端，超大记录不解析）
+        self.decoder = RecordDecoder(
+            self.HANDLED_RECORD_TYPES,
+            max_record_bytes=max_record_bytes,
+            schemas=RECORD_SCHEMAS
+        )
+        # 上次写入检查点时的位置（只写入有变化的文件）
+        self._checkpointed: Dict[str, int] = {}
+        self._checkpoint_task: Optional[asyncio.Task] = None
         
-        # 当前会话和 Agent
+        # 当前会话和 Agent（最近一次发送事件的来源）
         self.current_session: Optional[str] = None
         self.current_agent: Optional[str] = None
         self.last_status = Status.UNKNOWN
         
+        # 每个 (session, agent) 独立的状态机（LRU 有界，超时未活动的视为已结束）
+        max_sessions = config.get('max_tracked_sessions', 256) if config else 256
+        session_ttl_minutes = config.get('session_ttl_minutes', 10) if config else 10
+        self.sessions = SessionStateTable(max_sessions, ttl_seconds=session_ttl_minutes * 60)
+        
+        # 最近一次发送事件的文件（写入检查点，用于恢复状态）
+        self._last_file: Optional[str] = None
+        
         # 会话 → Agent 映射
         self.active_agents: Dict[str, Set[str]] = {}
-        # Agent → 类型映射
-        self.agent_types: Dict[str, str] = {}
+        # Agent → 类型映射（子 Agent 第一次产生用量时，取所属会话中最早的尚未认领的 Task subagent_type；LRU 有界）
+        self.agent_types: 'OrderedDict[str, str]' = OrderedDict()
+        self._agent_types_size = max_sessions
+        # 会话 → 已发起、尚未对应到子 Agent 文件的 Task subagent_type（按发起顺序）
+        self._pending_agent_types: 'OrderedDict[str, Deque[str]]' = OrderedDict()
+        
+        # 记录去重（uuid：重放 / 重写的记录；message.id：同一消息按内容块拆成的多行只计一次 usage）
+        # 最近的 id 精确判断，更早的 id 进入有界的可扩展 Bloom filter
+        dedup_recent = config.get('dedup_recent', 4096) if config else 4096
+        self.dedup = DedupFilter(
+            recent=dedup_recent,
+            capacity=config.get('dedup_capacity', 100_000) if config else 100_000,
+            error_rate=config.get('dedup_error_rate', 1e-6) if config else 1e-6,
+            max_generations=config.get('dedup_generations', 4) if config else 4
+        )
+        
+        # 最近消息已计入的用量（message.id → 四项用量，LRU 有界）：
+        # 同一消息的后续内容块行只发送比已计入部分多出的增量
+        self._message_usage: 'OrderedDict[str, Tuple[int, int, int, int]]' = OrderedDict()
+        self._message_usage_size = dedup_recent
         
         # Token 统计
         self.token_stats: Dict[str, int] = {
@@ -133,9 +233,36 @@ class ClaudeLogPlugin(BasePlugin):
             'cache_read': 0,
         }
         
-        # 文件监控
+        # 文件监控（auto: Linux 上使用 inotify，否则 watchdog；poll: stat 轮询）
+        self.watch_backend = config.get('watch_backend', 'auto') if config else 'auto'
         self.observer: Optional[Observer] = None
-        self.monitored_files: Set[str] = set()
+        self.inotify_watcher: Optional[InotifyWatcher] = None
+        
+        # inotify 热目录预算（只监控最近活跃的目录，0 表示递归监控全部目录）
+        self.watch_budget = config.get('watch_budget', 128) if config else 128
+        self.watch_idle_minutes = config.get('watch_idle_minutes', 30) if config else 30
+        self.cold_sweep_interval = config.get('cold_sweep_interval', 5.0) if config else 5.0
+        self.watch_manager: Optional[HotSetWatchManager] = None
+        
+        # stat 轮询（poll 模式下自适应轮询；监控模式下低频核对通知是否缺失）
+        self.poll_min_interval = config.get('poll_min_interval', 0.25) if config else 0.25
+        self.poll_max_interval = config.get('poll_max_interval', 5.0) if config else 5.0
+        self.poll_auto_fallback = config.get('poll_auto_fallback', True) if config else True
+        self.starvation_check_interval = config.get('starvation_check_interval', 30.0) if config else 30.0
+        self.starvation_threshold = config.get('starvation_threshold', 3) if config else 3
+        self.poller: Optional[StatPoller] = None
+        self._starvation_task: Optional[asyncio.Task] = None
+        # 连续发现通知缺失的核对次数
+        self._starved_checks = 0
+        
+        # 阻塞 I/O 线程池（读取、扫描、解码、检查点写入；0 表示在事件循环中执行）
+        self.io_workers = config.get('io_workers', 2) if config else 2
+        self._io_executor: Optional[ThreadPoolExecutor] = None
+        self.io_batch_bytes = config.get('io_batch_bytes', 4 * 1024 * 1024) if config else 4 * 1024 * 1024
+        
+        # 文件变化合并（防抖窗口内合并通知，每个文件最多一个读取任务）
+        self.watch_debounce_ms = config.get('watch_debounce_ms', 50) if config else 50
+        self.coalescer: Optional[ChangeCoalescer] = None
     
     @property
     def metadata(self) -> PluginMetadata:
@@ -161,11 +288,22 @@ class ClaudeLogPlugin(BasePlugin):
             print(f"[{self.metadata.name}] WARNING: Projects directory not found: {self.projects_dir}")
             return
         
+        if self.io_workers > 0:
+            self._io_executor = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix='claude-log-io')
+        
         # 扫描现有日志文件
         await self._scan_existing_logs()
         
         # 启动文件监控
-        self._start_file_watcher()
+        await self._start_file_watcher()
+        
+        # 定期写入检查点
+        if self.checkpoint_store:
+            self._checkpoint_task = asyncio.create_task(self._checkpoint_loop())
+        
+        # 后台历史回填
+        if self.backfill_on_start:
+            self._backfill_task = asyncio.create_task(self._run_backfill())
         
         self.running = True
         print(f"[{self.metadata.name}] [OK] Started, monitoring: {self.projects_dir}")
@@ -180,10 +318,46 @@ class ClaudeLogPlugin(BasePlugin):
         
         print(f"[{self.metadata.name}] Stopping...")
         
+        # 停止历史回填（已完成的任务已写入检查点，下次启动时续跑）
+        if self._backfill_task:
+            self.backfill.cancel()
+            await self._backfill_task
+            self._backfill_task = None
+        
         # 停止文件监控
-        if self.observer:
-            self.observer.stop()
-            self.observer.join()
+        if self._starvation_task:
+            self._starvation_task.cancel()
+            try:
+                await self._starvation_task
+            except asyncio.CancelledError:
+                pass
+        await self._stop_watchers()
+        if self.poller:
+            await self.poller.close()
+        
+        # 等待正在处理的文件变化
+        if self.coalescer:
+            await self.coalescer.close()
+            if self.debug:
+                print(f"[{self.metadata.name}] [WATCH] Stats: {self.coalescer.get_stats()}")
+        
+        # 写入最后一次检查点
+        if self._checkpoint_task:
+            self._checkpoint_task.cancel()
+            try:
+                await self._checkpoint_task
+            except asyncio.CancelledError:
+                pass
+        await self._run_io(self._save_checkpoints)
+        if self.checkpoint_store:
+            self.checkpoint_store.close()
+        
+        # 关闭所有文件句柄
+        self.tail_reader.close_all()
+        
+        if self._io_executor:
+            self._io_executor.shutdown(wait=True)
+            self._io_executor = None
         
         self.running = False
         print(f"[{self.metadata.name}] [OK] Stopped")
@@ -197,27 +371,29 @@ class ClaudeLogPlugin(BasePlugin):
     
     async def _scan_existing_logs(self):
         """扫描现有日志文件"""
-        pattern = str(self.projects_dir / '**' / '*.jsonl')
-        log_files = glob.glob(pattern, recursive=True)
+        log_files = await self._run_io(self._list_log_files)
         
         if not log_files:
             if self.debug:
                 print(f"[{self.metadata.name}] No JSONL logs found")
             return
         
+        # 有检查点：热启动，从检查点续读
+        checkpoints = await self._run_io(self._load_checkpoints)
+        if checkpoints:
+            await self._resume_from_checkpoints(log_files, checkpoints)
+            return
+        
         # 获取最新的日志文件
-        latest_file = max(log_files, key=os.path.getmtime)
+        latest_file = max(log_files, key=lambda item: item[1].st_mtime)[0]
         
         if self.debug:
             print(f"[{self.metadata.name}] Found {len(log_files)} logs, latest: {latest_file}")
         
         # 初始化所有文件的读取位置（而不是只读取最新的）
-        for file_path in log_files:
-            try:
-                # 记录当前文件大小，后续只处理新增内容
-                self.file_positions[file_path] = os.path.getsize(file_path)
-            except OSError:
-                pass
+        for file_path, st in log_files:
+            # 记录当前文件大小，后续只处理新增内容
+            self.tail_reader.set_offset(file_path, st.st_size)
         
         if self.debug:
             print(f"[{self.metadata.name}] Initialized {len(self.file_positions)} file positions")
@@ -225,126 +401,500 @@ class ClaudeLogPlugin(BasePlugin):
         # 读取最新文件的最后几行（初始化状态）
         await self._read_full_file(latest_file)
     
+    def create_backfill_engine(self, workers: Optional[int] = None) -> BackfillEngine:
+        """创建历史回填引擎（与实时路径使用相同的解码配置）"""
+        store = CheckpointStore(self.backfill_file) if self.backfill_file else None
+        return BackfillEngine(
+            self.projects_dir,
+            store=store,
+            workers=self.backfill_workers if workers is None else workers,
+            max_record_bytes=self.decoder.max_record_bytes,
+            max_line_bytes=self.tail_reader.max_line_bytes
+        )
+    
+    async def _run_backfill(self):
+        """后台执行历史回填（在独立线程中等待进程池，不占用 I/O 线程）"""
+        self.backfill = self.create_backfill_engine()
+        print(f"[{self.metadata.name}] [BACKFILL] Scanning history with {self.backfill.workers} workers...")
+        
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.backfill.run)
+        except Exception as e:
+            print(f"[{self.metadata.name}] [BACKFILL] Error: {e}")
+            return
+        
+        stats = self.backfill.stats
+        if stats['completed']:
+            print(f"[{self.metadata.name}] [BACKFILL] Done: {stats['files_scanned']} files, "
+                  f"{stats['bytes_scanned'] / 1024 / 1024:.1f} MB in {stats['seconds']:.1f}s "
+                  f"({stats['mb_per_second']} MB/s)")
+    
+    def get_backfill_stats(self) -> Dict:
+        """获取历史回填进度和结果（未运行时为空）"""
+        if self.backfill is None:
+            return {}
+        return self.backfill.get_stats()
+    
+    def _list_log_files(self) -> List[Tuple[str, os.stat_result]]:
+        """递归列出所有 JSONL 文件（scandir，每个文件只 stat 一次）"""
+        return list_transcripts(str(self.projects_dir))
+    
+    def _load_checkpoints(self) -> Dict[str, Checkpoint]:
+        """加载检查点"""
+        if not self.checkpoint_store:
+            return {}
+        
+        try:
+            return self.checkpoint_store.load()
+        except Exception as e:
+            print(f"[{self.metadata.name}] Error loading checkpoints: {e}")
+            return {}
+    
+    async def _resume_from_checkpoints(self, log_files: List[Tuple[str, os.stat_result]],
+                                       checkpoints: Dict[str, Checkpoint]):
+        """
+        热启动：从检查点续读
+        
+        - 未变化的文件：直接恢复位置，不读取
+        - 追加过的文件：从检查点位置读取停机期间写入的字节
+        - 新文件 / 被替换或截断的文件：从头读取
+        """
+        pending = []
+        
+        for file_path, st in log_files:
+            checkpoint = checkpoints.get(file_path)
+            if checkpoint is not None and checkpoint.matches(st):
+                offset = checkpoint.offset
+                self._checkpointed[file_path] = offset
+                changed = not checkpoint.is_unchanged(st)
+            else:
+                offset = 0
+                changed = True
+            
+            self.tail_reader.set_offset(file_path, offset)
+            
+            if changed and st.st_size > offset:
+                pending.append((st.st_mtime, file_path))
+        
+        # 已删除的文件：清理检查点
+        existing = {file_path for file_path, _ in log_files}
+        removed = [path for path in checkpoints if path not in existing]
+        if removed:
+            await self._run_io(self._remove_checkpoints, removed)
+        
+        if self.debug:
+            print(f"[{self.metadata.name}] Resumed {len(log_files)} logs from checkpoints, {len(pending)} changed")
+        
+        # 无变化：恢复最后状态
+        if not pending:
+            last_status, last_file = await self._run_io(self._load_last_state)
+            if last_status and last_status != Status.UNKNOWN.value and last_file:
+                await self._update_status(
+                    self._get_session_state(last_file),
+                    Status(last_status),
+                    confidence=0.80,
+                    details={'event': 'restored'}
+                )
+            return
+        
+        # 按修改时间顺序补读，最新文件最后处理（决定当前状态）
+        for _, file_path in sorted(pending):
+            await self._handle_file_change(file_path)
+    
+    def _remove_checkpoints(self, paths: List[str]):
+        """删除已不存在的文件的检查点"""
+        try:
+            self.checkpoint_store.remove(paths)
+        except Exception as e:
+            print(f"[{self.metadata.name}] Error removing checkpoints: {e}")
+    
+    def _load_last_state(self) -> Tuple[Optional[str], Optional[str]]:
+        """读取上次停止时的状态和对应文件"""
+        return self.checkpoint_store.get_state('last_status'), self.checkpoint_store.get_state('last_file')
+    
+    async def _checkpoint_loop(self):
+        """定期写入检查点"""
+        while True:
+            try:
+                await asyncio.sleep(self.checkpoint_interval)
+                await self._run_io(self._save_checkpoints)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"[{self.metadata.name}] Checkpoint error: {e}")
+    
+    def _save_checkpoints(self):
+        """写入位置有变化的文件检查点"""
+        if not self.checkpoint_store:
+            return
+        
+        checkpoints = []
+        for file_path, offset in list(self.file_positions.items()):
+            if self._checkpointed.get(file_path) == offset:
+                continue
+            
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            
+            checkpoints.append(Checkpoint(
+                path=file_path,
+                device=st.st_dev,
+                inode=st.st_ino,
+                mtime_ns=st.st_mtime_ns,
+                size=st.st_size,
+                offset=offset
+            ))
+        
+        if not checkpoints and self._checkpointed:
+            return
+        
+        try:
+            state = {'last_status': self.last_status.value}
+            if self._last_file:
+                state['last_file'] = self._last_file
+            self.checkpoint_store.save(checkpoints, state=state)
+        except Exception as e:
+            print(f"[{self.metadata.name}] Error saving checkpoints: {e}")
+            return
+        
+        for checkpoint in checkpoints:
+            self._checkpointed[checkpoint.path] = checkpoint.offset
+        
+        if self.debug and checkpoints:
+            print(f"[{self.metadata.name}] [CHECKPOINT] Saved {len(checkpoints)} file positions")
+    
     async def _read_full_file(self, file_path: str):
-        """完整读取文件（初始化时）"""
+        """读取文件尾部（初始化时，从 EOF 反向读取，开销与文件大小无关）"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
+            lines, end = await self._run_io(self._read_tail, file_path)
             
-            # 记录读取位置
-            self.file_positions[file_path] = os.path.getsize(file_path)
+            # 记录读取位置（只到最后一个完整行，不完整的尾行留给增量读取）
+            self.tail_reader.set_offset(file_path, end)
             
             # 解析最后几行，确定当前状态
-            for line in lines[-10:]:  # 只看最后 10 行
+            for line in lines:
                 await self._handle_new_line(line, file_path)
         
         except Exception as e:
             print(f"[{self.metadata.name}] Error reading file {file_path}: {e}")
     
-    def _start_file_watcher(self):
+    def _read_tail(self, file_path: str) -> Tuple[List[bytes], int]:
+        """读取尾部几行；没有能决定状态的记录时继续向前查找最后一条（内存映射，在 I/O 线程中调用）"""
+        with MmapLineReader(file_path) as reader:
+            lines, end = reader.tail_lines(self.INITIAL_TAIL_LINES)
+            
+            if not any(self._is_status_record(line) for line in lines):
+                record = reader.find_last(self._is_status_record, self.initial_scan_bytes)
+                if record is not None:
+                    lines.insert(0, record)
+        
+        return lines, end
+    
+    def _is_status_record(self, line: bytes) -> bool:
+        """是否是能决定状态的记录（assistant / user / system）"""
+        return classify(line) in self.STATUS_RECORD_TYPES
+    
+    async def _start_file_watcher(self):
         """启动文件监控"""
-        event_handler = LogFileHandler(self)
-        # 保存当前事件循环引用 - 在 async 上下文中获取
+        # 合并调度器绑定当前事件循环 - 在 async 上下文中获取
         try:
-            event_handler.loop = asyncio.get_running_loop()
+            self.coalescer = ChangeCoalescer(self._handle_file_change, self.watch_debounce_ms)
             if self.debug:
                 print(f"[{self.metadata.name}] [OK] Event loop acquired")
         except RuntimeError:
             print(f"[{self.metadata.name}] ERROR: No running event loop!")
             return
         
-        self.observer = Observer()
-        self.observer.schedule(event_handler, str(self.projects_dir), recursive=True)
-        self.observer.start()
+        # 轮询器与监控器共用读取位置表
+        self.poller = StatPoller(
+            str(self.projects_dir),
+            self.file_positions,
+            on_change=self.coalescer.notify,
+            min_interval=self.poll_min_interval,
+            max_interval=self.poll_max_interval,
+            io_executor=self._io_executor
+        )
+        
+        if self.watch_backend == 'poll':
+            self.poller.start()
+        elif not await self._start_inotify_watcher():
+            event_handler = LogFileHandler(self, self.coalescer)
+            
+            self.observer = Observer()
+            self.observer.schedule(event_handler, str(self.projects_dir), recursive=True)
+            self.observer.start()
+        
+        # 监控模式：定期核对通知是否缺失，持续缺失时切换到轮询
+        if not self.poller.polling and self.poll_auto_fallback:
+            self._starvation_task = asyncio.create_task(self._starvation_loop())
         
         if self.debug:
+            backend = 'poll' if self.poller.polling else 'inotify' if self.inotify_watcher else 'watchdog'
             print(f"[{self.metadata.name}] [WATCH] Directory: {self.projects_dir}")
-            print(f"[{self.metadata.name}] [WATCH] Monitoring *.jsonl files recursively...")
+            print(f"[{self.metadata.name}] [WATCH] Monitoring *.jsonl files recursively via {backend} (debounce: {self.watch_debounce_ms}ms)...")
+    
+    async def _start_inotify_watcher(self) -> bool:
+        """
+        启动 inotify 监控（fd 注册到事件循环，通知直接在循环线程提交给合并调度器）
+        
+        Returns:
+            是否启用（未启用时回退到 watchdog）
+        """
+        if self.watch_backend == 'watchdog':
+            return False
+        
+        if not inotify_watcher.is_available():
+            if self.watch_backend == 'inotify':
+                print(f"[{self.metadata.name}] WARNING: inotify not available, falling back to watchdog")
+            return False
+        
+        if self.watch_budget > 0:
+            # 只监控根目录和最近活跃的目录，冷目录定期扫描
+            manager = HotSetWatchManager(
+                str(self.projects_dir),
+                on_change=self.coalescer.notify,
+                budget=self.watch_budget,
+                idle_seconds=self.watch_idle_minutes * 60,
+                sweep_interval=self.cold_sweep_interval,
+                on_overflow=self._resync_all_files,
+                io_executor=self._io_executor
+            )
+            watcher = manager.watcher
+        else:
+            manager = None
+            watcher = InotifyWatcher(
+                str(self.projects_dir),
+                on_change=self.coalescer.notify,
+                on_overflow=self._resync_all_files
+            )
+        
+        try:
+            if manager is not None:
+                await manager.start()
+            else:
+                watcher.start()
+        except OSError as e:
+            print(f"[{self.metadata.name}] WARNING: inotify failed ({e}), falling back to watchdog")
+            return False
+        
+        self.watch_manager = manager
+        self.inotify_watcher = watcher
+        return True
+    
+    async def _stop_watchers(self):
+        """停止 inotify / watchdog 监控"""
+        if self.watch_manager:
+            await self.watch_manager.close()
+            self.watch_manager = None
+        elif self.inotify_watcher:
+            self.inotify_watcher.close()
+        self.inotify_watcher = None
+        
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+    
+    async def _starvation_loop(self):
+        """定期 stat 核对：文件有变化但没有收到通知，视为通知缺失"""
+        # 第一轮只建立签名基线
+        await self.poller.poll()
+        
+        while True:
+            try:
+                await asyncio.sleep(self.starvation_check_interval)
+                
+                missed = [
+                    path for path in await self.poller.poll()
+                    if self.coalescer.last_received.get(path, 0.0) < (self.poller.mtime(path) or 0.0)
+                ]
+                
+                # 补读缺失的变化
+                for path in missed:
+                    self.coalescer.notify(path)
+                
+                if not missed:
+                    self._starved_checks = 0
+                    continue
+                
+                self._starved_checks += 1
+                if self.debug:
+                    print(f"[{self.metadata.name}] [WATCH] {len(missed)} changes without notification ({self._starved_checks}/{self.starvation_threshold})")
+                
+                if self._starved_checks >= self.starvation_threshold:
+                    print(f"[{self.metadata.name}] WARNING: File notifications are missing, switching to stat polling")
+                    await self._stop_watchers()
+                    self.poller.start()
+                    break
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"[{self.metadata.name}] Starvation check error: {e}")
+    
+    def _resync_all_files(self):
+        """inotify 事件队列溢出：重新检查所有已知文件"""
+        print(f"[{self.metadata.name}] WARNING: inotify queue overflow, rescanning known files")
+        for file_path in list(self.file_positions):
+            self.coalescer.notify(file_path)
+    
+    def get_watch_stats(self) -> Dict:
+        """获取文件变化通知统计（收到 / 合并 / 调度，inotify 后端另含 watch / 读取次数，轮询另含每轮 CPU）"""
+        if self.coalescer is None:
+            return {}
+        stats = self.coalescer.get_stats()
+        if self.poller is not None:
+            stats['mode'] = 'poll' if self.poller.polling else 'watch'
+            stats.update({f'poll_{key}': value for key, value in self.poller.get_stats().items()})
+        if self.watch_manager is not None:
+            stats.update({f'inotify_{key}': value for key, value in self.watch_manager.get_stats().items()})
+        elif self.inotify_watcher is not None:
+            stats.update({f'inotify_{key}': value for key, value in self.inotify_watcher.get_stats().items()})
+        return stats
     
     async def _handle_file_change(self, file_path: str):
         """处理文件变化"""
         if not file_path.endswith('.jsonl'):
             return
         
-        # 获取文件大小
-        try:
-            current_size = os.path.getsize(file_path)
-        except OSError:
+        # 文件生命周期：新建 / 截断 / 替换时重置读取位置，删除时清除所有状态
+        change, records, more = await self._run_io(self._read_batch, file_path, True)
+        if change == FILE_DELETED:
+            await self._forget_file(file_path)
             return
+        if change != FILE_UNCHANGED:
+            # 新文件 / 被重写的文件从头读取；截断或替换后的旧检查点作废
+            self._checkpointed.pop(file_path, None)
+            if self.debug or change != FILE_CREATED:
+                print(f"[{self.metadata.name}] [FILE] {Path(file_path).name}: {change}")
+        
+        # 按批处理：I/O 线程读取并解码一批，事件循环只处理解码后的记录
+        while True:
+            for record in records:
+                await self._handle_record(record, file_path)
+            
+            if not more:
+                break
+            _, records, more = await self._run_io(self._read_batch, file_path, False)
+    
+    def _read_batch(self, file_path: str, check: bool) -> Tuple[str, List[Tuple[str, Any]], bool]:
+        """
+        在 I/O 线程中检查文件生命周期、读取并解码一批新行
         
-        # 获取上次读取位置
+        Returns:
+            (生命周期变化, 解码后的记录, 是否还有未读取的数据)
+        """
+        change = self.tail_reader.check(file_path) if check else FILE_UNCHANGED
+        if change == FILE_DELETED:
+            return change, [], False
+        
+        # 增量读取新行（位置由 tail_reader 按已消费字节推进）
         last_position = self.file_positions.get(file_path, 0)
+        lines, more = self._read_new_lines(file_path)
         
         if self.debug:
-            print(f"[{self.metadata.name}] [INFO] File: {Path(file_path).name} - Size: {current_size} bytes (was: {last_position})")
-        
-        if current_size <= last_position:
-            if self.debug:
-                print(f"[{self.metadata.name}] [SKIP] No new content")
-            return  # 文件未增长
+            position = self.file_positions.get(file_path, 0)
+            print(f"[{self.metadata.name}] [READ] {Path(file_path).name}: {len(lines)} new lines ({last_position} -> {position} bytes)")
         
-        # 增量读取新行
-        new_lines = self._read_new_lines(file_path, last_position)
+        records = []
+        for line in lines:
+            record = self._decode_line(line)
+            if record is not None:
+                records.append(record)
         
-        if self.debug:
-            print(f"[{self.metadata.name}] [READ] {len(new_lines)} new lines")
+        return change, records, more
+    
+    async def _run_io(self, func, *args):
+        """在 I/O 线程池中执行阻塞调用（io_workers 为 0 时直接在事件循环中执行）"""
+        if self._io_executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._io_executor, func, *args)
+    
+    async def _forget_file(self, file_path: str):
+        """文件已删除：从读取位置、会话状态和检查点中移除"""
+        self.sessions.remove_file(file_path)
+        if self.coalescer:
+            self.coalescer.last_received.pop(file_path, None)
+        if self._last_file == file_path:
+            self._last_file = None
         
-        # 更新位置
-        self.file_positions[file_path] = current_size
+        if self._checkpointed.pop(file_path, None) is not None and self.checkpoint_store:
+            await self._run_io(self._remove_checkpoints, [file_path])
         
-        # 处理新行
-        for line in new_lines:
-            await self._handle_new_line(line, file_path)
+        if self.debug:
+            print(f"[{self.metadata.name}] [FILE] {Path(file_path).name}: deleted")
     
-    def _read_new_lines(self, file_path: str, start: int) -> List[str]:
-        """增量读取新行"""
+    def _read_new_lines(self, file_path: str) -> Tuple[List[bytes], bool]:
+        """增量读取新行（只返回完整行，单次最多约 io_batch_bytes 字节）"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                f.seek(start)
-                lines = f.readlines()
-            return lines
+            return self.tail_reader.read_lines(file_path, self.io_batch_bytes)
         except Exception as e:
             print(f"[{self.metadata.name}] Error reading new lines: {e}")
-            return []
+            self.tail_reader.close(file_path)
+            return [], False
     
-    async def _handle_new_line(self, line: str, file_path: str):
+    async def _handle_new_line(self, line: bytes, file_path: str):
         """处理新行"""
-        line = line.strip()
-        if not line:
-            return
+        record = self._decode_line(line)
+        if record is not None:
+            await self._handle_record(record, file_path)
+    
+    def _decode_line(self, line: bytes) -> Optional[Tuple[str, Any]]:
+        """预分类 + 解码为类型化记录（无关记录和超大记录不会被解析；在 I/O 线程中调用）"""
+        # 超长行只有前缀，不能 strip（会丢失行的实际大小）
+        if not isinstance(line, OversizedLine):
+            line = line.strip()
+            if not line:
+                return None
         
         try:
-            # 解析 JSON
-            event = json.loads(line)
+            return self.decoder.decode(line)
+        except Exception as e:
+            print(f"[{self.metadata.name}] Error decoding line: {e}")
+            return None
+    
+    async def _handle_record(self, record: Tuple[str, Any], file_path: str):
+        """处理已解码的记录（事件循环线程）"""
+        try:
+            event_type, event = record
             
-            # 提取事件类型
-            event_type = event.get('type')
+            # 该文件所属的 (session, agent) 状态
+            state = self._get_session_state(file_path)
+            if state.is_subagent and not self.track_subagents:
+                return
+            
+            # 已处理过的记录（文件被重写 / 重放）：不再触发状态和统计
+            uuid = getattr(event, 'uuid', None)
+            if uuid and self.dedup.seen('u:' + uuid):
+                return
             
             if event_type == 'assistant':
                 # AI 回复事件
-                await self._handle_assistant_event(event, file_path)
+                await self._handle_assistant_event(event, file_path, state)
             
             elif event_type == 'user':
                 # 用户输入事件
-                await self._handle_user_event(event, file_path)
+                await self._handle_user_event(event, file_path, state)
             
             elif event_type == 'summary':
                 # 会话总结事件
-                await self._handle_summary_event(event)
+                await self._handle_summary_event(event, state)
             
             elif event_type == 'progress':
                 # MCP 工具进度事件
-                await self._handle_progress_event(event)
+                await self._handle_progress_event(event, state)
             
             elif event_type == 'system':
                 # 系统事件
-                subtype = event.get('subtype', 'unknown')
+                subtype = event.subtype
                 
                 # 回合结束事件（任务完成）
                 if subtype == 'turn_duration':
-                    duration_ms = event.get('durationMs', 0)
+                    duration_ms = event.duration_ms
                     print(f"[{self.metadata.name}] ✅ Turn completed ({duration_ms}ms)")
                     await self._update_status(
+                        state,
                         Status.IDLE,
                         confidence=0.95,
                         details={
@@ -356,9 +906,9 @@ class ClaudeLogPlugin(BasePlugin):
                 
                 # API 错误事件
                 elif subtype == 'api_error':
-                    error_info = event.get('error', {}).get('error', {})
-                    error_type = error_info.get('type', 'unknown')
-                    error_message = error_info.get('message', 'Unknown error')
+                    error_info = event.error.error if event.error else None
+                    error_type = error_info.type if error_info else 'unknown'
+                    error_message = error_info.message if error_info else 'Unknown error'
                     
                     # 过滤临时性错误
                     if not self.show_all_errors and error_type in self.IGNORABLE_ERRORS:
@@ -370,6 +920,7 @@ class ClaudeLogPlugin(BasePlugin):
                     # 重大错误才触发 ERROR 状态
                     if error_type in self.CRITICAL_ERRORS or self.show_all_errors:
                         await self._update_status(
+                            state,
                             Status.ERROR,
                             confidence=0.95,
                             details={
@@ -381,9 +932,10 @@ class ClaudeLogPlugin(BasePlugin):
                 
                 # 本地命令执行事件
                 elif subtype == 'local_command':
-                    command = event.get('command', 'unknown')
-                    print(f"[{self.metadata.name}] 🔧 Bash: {os.path.basename(command)}")
+                    command = event.command
+                    print(f"[{self.metadata.name}] 🔧 Bash: {os.path.basename(command or '')}")
                     await self._update_status(
+                        state,
                         Status.EXECUTING,
                         confidence=0.90,
                         details={
@@ -397,29 +949,37 @@ class ClaudeLogPlugin(BasePlugin):
                 if self.debug:
                     print(f"[{self.metadata.name}] [DEBUG] File history snapshot")
                 await self._update_status(
+                    state,
                     Status.IDLE,
                     confidence=0.90,
                     details={
                         'event': 'session_start',
-                        'message_id': event.get('messageId', 'unknown')
+                        'message_id': event.message_id
                     }
                 )
         
-        except json.JSONDecodeError:
-            pass  # 忽略非 JSON 行
         except Exception as e:
             print(f"[{self.metadata.name}] Error handling line: {e}")
     
-    async def _handle_assistant_event(self, event: Dict, file_path: str):
-        """处理 AI 回复事件"""
-        message = event.get('message', {})
-        content = message.get('content', [])
-        stop_reason = message.get('stop_reason')
+    async def _handle_assistant_event(self, event, file_path: str, state: SessionState):
+        """处理 AI 回复事件（AssistantRecord）"""
+        message = event.message
+        if message is None:
+            return
+        
+        content = message.content
+        stop_reason = message.stop_reason
+        usage = message.usage
+        
+        # 更新 Token 统计（同一消息的多个内容块行按 message.id 只计入新增的用量）：
+        # 必须在按 stop_reason 分支返回之前，消息最后一行（end_turn / tool_use）携带最终的 output
+        self._update_tokens(usage, state, message.id, message.model, parse_record_time(event.timestamp))
         
         # 检查是否是回合结束（等待用户输入）
         if stop_reason == 'end_turn':
             print(f"[{self.metadata.name}] ⏸️  Waiting for user input")
             await self._update_status(
+                state,
                 Status.IDLE,
                 confidence=0.95,
                 details={
@@ -432,6 +992,7 @@ class ClaudeLogPlugin(BasePlugin):
         elif stop_reason == 'stop_sequence':
             print(f"[{self.metadata.name}] ⏸️  Waiting for user input")
             await self._update_status(
+                state,
                 Status.IDLE,
                 confidence=0.90,
                 details={
@@ -449,12 +1010,13 @@ class ClaudeLogPlugin(BasePlugin):
             return
         
         for block in content:
-            block_type = block.get('type')
+            block_type = block.type
             
             if block_type == 'thinking':
                 # AI 思考中
                 print(f"[{self.metadata.name}] 🤔 Thinking...")
                 await self._update_status(
+                    state,
                     Status.THINKING,
                     confidence=0.95,
                     details={
@@ -465,8 +1027,8 @@ class ClaudeLogPlugin(BasePlugin):
             
             elif block_type == 'tool_use':
                 # 工具调用
-                tool_name = block.get('name', '')
-                tool_input = block.get('input', {})
+                tool_name = block.name or ''
+                tool_input = block.input or {}
                 
                 # 检查是否是 MCP 工具（通用前缀匹配，支持任何 MCP 服务器）
                 is_mcp_tool = tool_name.startswith(self.MCP_TOOL_PREFIX)
@@ -508,6 +1070,7 @@ class ClaudeLogPlugin(BasePlugin):
                         print(f"[{self.metadata.name}] 🎯 Loading Skill: {skill_name}")
                     
                     elif tool_name == 'Task':
+                        self._expect_agent(state, tool_input.get('subagent_type') or 'subagent')
                         print(f"[{self.metadata.name}] 🚀 Launching sub-Agent")
                     
                     elif tool_name == 'AskUserQuestion':
@@ -552,6 +1115,7 @@ class ClaudeLogPlugin(BasePlugin):
                     }
                 
                 await self._update_status(
+                    state,
                     status,
                     confidence=0.9,
                     details=details
@@ -560,6 +1124,7 @@ class ClaudeLogPlugin(BasePlugin):
             elif block_type == 'text':
                 # 文本回复
                 await self._update_status(
+                    state,
                     Status.WORKING,
                     confidence=0.8,
                     details={
@@ -568,18 +1133,14 @@ class ClaudeLogPlugin(BasePlugin):
                     }
                 )
         
-        # 更新 Token 统计
-        usage = message.get('usage', {})
-        self._update_tokens(usage)
-        
         # 如果有 usage 数据，说明这是最终回复（包含 token 统计）
         # 且没有工具调用，可能是在等待用户输入
-        if usage and not any(block.get('type') == 'tool_use' for block in content):
+        if usage and not any(block.type == 'tool_use' for block in content):
             # 检查是否包含问题（通常以 "？" 或 "?" 结尾）
             has_question = False
             for block in content:
-                if block.get('type') == 'text':
-                    text = block.get('text', '')
+                if block.type == 'text':
+                    text = block.text or ''
                     if '？' in text or '?' in text:
                         has_question = True
                         break
@@ -587,6 +1148,7 @@ class ClaudeLogPlugin(BasePlugin):
             if has_question:
                 print(f"[{self.metadata.name}] ⏸️  Waiting for user (question detected)")
                 await self._update_status(
+                    state,
                     Status.IDLE,
                     confidence=0.85,
                     details={
@@ -595,9 +1157,9 @@ class ClaudeLogPlugin(BasePlugin):
                     }
                 )
     
-    async def _handle_progress_event(self, event: Dict):
+    async def _handle_progress_event(self, event, state: SessionState):
         """
-        处理进度事件（MCP/Bash/Hook）
+        处理进度事件（MCP/Bash/Hook，ProgressRecord）
         
         进度事件格式：
         {
@@ -609,23 +1171,23 @@ class ClaudeLogPlugin(BasePlugin):
             }
         }
         """
-        data = event.get('data', {})
-        progress_type = data.get('type')
-        
-        if not progress_type:
+        data = event.data
+        if data is None or not data.type:
             return
         
-        status = data.get('status')
+        progress_type = data.type
+        status = data.status
         
         # MCP 工具进度
         if progress_type == 'mcp_progress':
-            server_name = data.get('serverName', 'unknown')
-            tool_name = data.get('toolName', 'unknown')
-            elapsed_ms = data.get('elapsedTimeMs', 0)
+            server_name = data.server_name
+            tool_name = data.tool_name
+            elapsed_ms = data.elapsed_ms
             
             if status == 'started':
                 print(f"[{self.metadata.name}] 🔌 MCP Started: {tool_name} ({server_name})")
                 await self._update_status(
+                    state,
                     Status.WORKING,
                     confidence=0.85,
                     details={
@@ -641,6 +1203,7 @@ class ClaudeLogPlugin(BasePlugin):
             elif status == 'completed':
                 print(f"[{self.metadata.name}] 🔌 MCP Completed: {tool_name} ({elapsed_ms}ms)")
                 await self._update_status(
+                    state,
                     Status.WORKING,
                     confidence=0.80,
                     details={
@@ -656,11 +1219,12 @@ class ClaudeLogPlugin(BasePlugin):
         
         # Bash 命令进度
         elif progress_type == 'bash_progress':
-            command = data.get('command', 'unknown')
+            command = data.command or 'unknown'
             
             if status == 'started':
                 print(f"[{self.metadata.name}] 🔧 Bash Started: {os.path.basename(command)}")
                 await self._update_status(
+                    state,
                     Status.EXECUTING,
                     confidence=0.90,
                     details={
@@ -671,8 +1235,8 @@ class ClaudeLogPlugin(BasePlugin):
                 )
             
             elif status == 'completed':
-                exit_code = data.get('exitCode', 0)
-                elapsed_ms = data.get('elapsedTimeMs', 0)
+                exit_code = data.exit_code
+                elapsed_ms = data.elapsed_ms
                 
                 if exit_code == 0:
                     print(f"[{self.metadata.name}] ✅ Bash Completed: {os.path.basename(command)} ({elapsed_ms}ms)")
@@ -680,6 +1244,7 @@ class ClaudeLogPlugin(BasePlugin):
                 else:
                     print(f"[{self.metadata.name}] ❌ Bash Failed: {os.path.basename(command)} (exit code: {exit_code})")
                     await self._update_status(
+                        state,
                         Status.ERROR,
                         confidence=0.90,
                         details={
@@ -693,11 +1258,12 @@ class ClaudeLogPlugin(BasePlugin):
         
         # Git Hook 进度
         elif progress_type == 'hook_progress':
-            hook_name = data.get('hookName', 'unknown')
+            hook_name = data.hook_name
             
             if status == 'started':
                 print(f"[{self.metadata.name}] 🪝 Git Hook: {hook_name}")
                 await self._update_status(
+                    state,
                     Status.EXECUTING,
                     confidence=0.85,
                     details={
@@ -708,19 +1274,17 @@ class ClaudeLogPlugin(BasePlugin):
                 )
             
             elif status == 'completed':
-                elapsed_ms = data.get('elapsedTimeMs', 0)
+                elapsed_ms = data.elapsed_ms
                 if self.debug:
                     print(f"[{self.metadata.name}] [DEBUG] Hook Completed: {hook_name} ({elapsed_ms}ms)")
                 # Hook 完成后，保持当前状态（不触发新事件）
     
-    async def _handle_user_event(self, event: Dict, file_path: str):
-        """处理用户输入事件"""
-        message = event.get('message', {})
-        content = message.get('content', [])
-        
+    async def _handle_user_event(self, event, file_path: str, state: SessionState):
+        """处理用户输入事件（UserRecord）"""
         print(f"[{self.metadata.name}] 🚀 User input received")
         
         await self._update_status(
+            state,
             Status.RUNNING,
             confidence=0.95,
             details={
@@ -729,9 +1293,9 @@ class ClaudeLogPlugin(BasePlugin):
             }
         )
     
-    async def _handle_summary_event(self, event: Dict):
+    async def _handle_summary_event(self, event, state: SessionState):
         """
-        处理会话总结事件
+        处理会话总结事件（SummaryRecord）
         
         格式 1 (System Summary):
         {
@@ -747,13 +1311,14 @@ class ClaudeLogPlugin(BasePlugin):
         }
         """
         # 格式 1: 包含 Token 统计
-        usage = event.get('usage', {})
+        usage = event.usage
         if usage:
-            self._update_tokens(usage)
-            total_tokens = usage.get('input_tokens', 0) + usage.get('output_tokens', 0)
+            self._update_tokens(usage, state)
+            total_tokens = (usage.input_tokens or 0) + (usage.output_tokens or 0)
             
             print(f"[{self.metadata.name}] 📊 Session completed (Total tokens: {total_tokens:,})")
             await self._update_status(
+                state,
                 Status.IDLE,
                 confidence=0.85,
                 details={
@@ -764,14 +1329,15 @@ class ClaudeLogPlugin(BasePlugin):
         
         # 格式 2: 项目总结（标题）
         else:
-            summary_text = event.get('summary', '')
-            leaf_uuid = event.get('leafUuid', '')
+            summary_text = event.summary
+            leaf_uuid = event.leaf_uuid
             
             if self.debug:
                 print(f"[{self.metadata.name}] [DEBUG] Project summary: {summary_text}")
             
             # 项目总结通常表示一个完整的会话结束
             await self._update_status(
+                state,
                 Status.IDLE,
                 confidence=0.80,
                 details={
@@ -781,6 +1347,20 @@ class ClaudeLogPlugin(BasePlugin):
                 }
             )
     
+    def _get_session_state(self, file_path: str) -> SessionState:
+        """获取文件对应的 (session, agent) 状态"""
+        state = self.sessions.for_file(file_path, self._parse_file_path)
+        
+        # 记录会话 → Agent 映射
+        if state.agent_id is not None:
+            self.active_agents.setdefault(state.session_id, set()).add(state.agent_id)
+        
+        return state
+    
+    def get_sessions(self) -> List[Dict]:
+        """获取所有被追踪的 (session, agent) 状态"""
+        return self.sessions.snapshot()
+    
     def _parse_file_path(self, file_path: str) -> Dict[str, any]:
         """
         解析文件路径，提取项目、会话、Agent 信息
@@ -800,29 +1380,7 @@ class ClaudeLogPlugin(BasePlugin):
                 'is_subagent': True/False
             }
         """
-        path = Path(file_path)
-        
-        # 检查是否是子 Agent（路径中包含 subagents）
-        is_subagent = 'subagents' in path.parts
-        
-        if is_subagent:
-            # 路径: projects/my-app/session-abc123/subagents/agent-def456.jsonl
-            agent_id = path.stem  # agent-def456
-            session_dir = path.parent.parent  # session-abc123 目录
-            session_id = session_dir.name
-            project = session_dir.parent.name
-        else:
-            # 路径: projects/my-app/session-abc123.jsonl
-            agent_id = None
-            session_id = path.stem  # session-abc123
-            project = path.parent.name
-        
-        return {
-            'project': project,
-            'session_id': session_id,
-            'agent_id': agent_id,
-            'is_subagent': is_subagent
-        }
+        return parse_transcript_path(file_path)
     
     def _tool_to_status(self, tool_name: str) -> Status:
         """
@@ -852,25 +1410,116 @@ class ClaudeLogPlugin(BasePlugin):
         
         return safe_context
     
-    def _update_tokens(self, usage: Dict):
-        """更新 Token 统计"""
+    def get_dedup_stats(self) -> Dict:
+        """获取记录去重统计"""
+        return self.dedup.get_stats()
+    
+    def _expect_agent(self, state: SessionState, agent_type: str):
+        """记录会话发起的 Task（之后出现的子 Agent 按顺序认领类型）"""
+        pending = self._pending_agent_types.get(state.session_id)
+        if pending is None:
+            pending = self._pending_agent_types[state.session_id] = deque(maxlen=64)
+            if len(self._pending_agent_types) > self._agent_types_size:
+                self._pending_agent_types.popitem(last=False)
+        pending.append(agent_type)
+    
+    def _agent_type(self, state: SessionState) -> str:
+        """(session, agent) 的 Agent 类型：主会话为 'main'，子 Agent 为 Task 的 subagent_type"""
+        if state.agent_id is None:
+            return 'main'
+        
+        agent_type = self.agent_types.get(state.agent_id)
+        if agent_type is None:
+            pending = self._pending_agent_types.get(state.session_id)
+            agent_type = pending.popleft() if pending else 'subagent'
+            self.agent_types[state.agent_id] = agent_type
+            if len(self.agent_types) > self._agent_types_size:
+                self.agent_types.popitem(last=False)
+        return agent_type
+    
+    def restore_message_usage(self, usage: Dict[str, tuple]):
+        """恢复已持久化的按消息用量：崩溃后重读的行只发送超出已落盘部分的增量"""
+        for message_id, counts in usage.items():
+            self._message_usage[message_id] = tuple(counts)
+            self._message_usage.move_to_end(message_id)
+        while len(self._message_usage) > self._message_usage_size:
+            self._message_usage.popitem(last=False)
+    
+    def _update_tokens(self, usage, state: SessionState, message_id: str = '', model: str = '',
+                       timestamp: Optional[float] = None):
+        """
+        更新 Token 统计（Usage 记录，全局 + 会话），并发送用量增量
+        
+        同一 message_id 的多行携带同一条消息的用量：第一次计入全部，之后只计入
+        比已计入部分多出的差值（各字段取最大值），已淘汰出最近缓存的旧消息不再计入。
+        增量的时间取记录自身的 timestamp（补读 / 重读的行按实际发生时间分桶），缺失时取当前时间
+        """
         if not usage:
             return
         
-        self.token_stats['input'] += usage.get('input_tokens', 0)
-        self.token_stats['output'] += usage.get('output_tokens', 0)
-        self.token_stats['cache_write'] += usage.get('cache_creation_input_tokens', 0)
-        self.token_stats['cache_read'] += usage.get('cache_read_input_tokens', 0)
+        current = (
+            usage.input_tokens or 0,
+            usage.output_tokens or 0,
+            usage.cache_creation_input_tokens or 0,
+            usage.cache_read_input_tokens or 0,
+        )
+        new_message = True
+        
+        if message_id:
+            previous = self._message_usage.get(message_id)
+            if previous is not None:
+                new_message = False
+                self._message_usage.move_to_end(message_id)
+                merged = tuple(max(old, new) for old, new in zip(previous, current))
+                delta = tuple(value - old for value, old in zip(merged, previous))
+                self._message_usage[message_id] = merged
+                current = delta
+            elif self.dedup.seen('m:' + message_id):
+                return  # 很久以前的消息被重放
+            else:
+                self._message_usage[message_id] = current
+                if len(self._message_usage) > self._message_usage_size:
+                    self._message_usage.popitem(last=False)
+        
+        if not new_message and not any(current):
+            return
+        
+        input_tokens, output_tokens, cache_write, cache_read = current
+        for stats in (self.token_stats, state.token_stats):
+            stats['input'] += input_tokens
+            stats['output'] += output_tokens
+            stats['cache_write'] += cache_write
+            stats['cache_read'] += cache_read
+        
+        self._emit_usage(UsageDelta(
+            source=self.metadata.name,
+            project=state.project,
+            session_id=state.session_id,
+            agent_id=state.agent_id,
+            message_id=message_id or '',
+            model=model or '',
+            agent_type=self._agent_type(state),
+            input=input_tokens,
+            output=output_tokens,
+            cache_write=cache_write,
+            cache_read=cache_read,
+            new_message=new_message,
+            timestamp=timestamp if timestamp is not None else time.time()
+        ))
     
-    async def _update_status(self, status: Status, confidence: float, details: Dict):
-        """更新状态并发送事件"""
-        if status == self.last_status:
-            return  # 状态未变化
+    async def _update_status(self, state: SessionState, status: Status, confidence: float, details: Dict):
+        """更新 (session, agent) 状态并发送事件"""
+        if status == state.last_status:
+            return  # 该会话状态未变化
         
+        state.last_status = status
         self.last_status = status
+        self.current_session = state.session_id
+        self.current_agent = state.agent_id
+        self._last_file = state.file_path
         
-        # 添加 Token 统计
-        details['tokens'] = self.token_stats.copy()
+        # 会话身份（下游可按会话分发；Token 用量通过 UsageDelta 单独发送）
+        details.update(state.identity())
         
         # 创建事件
         event = StateEvent(
@@ -887,27 +1536,35 @@ class ClaudeLogPlugin(BasePlugin):
 class LogFileHandler(FileSystemEventHandler):
     """文件系统事件处理器"""
     
-    def __init__(self, plugin: ClaudeLogPlugin):
+    def __init__(self, plugin: ClaudeLogPlugin, coalescer: ChangeCoalescer):
         self.plugin = plugin
-        self.loop = None
+        self.coalescer = coalescer
     
     def on_modified(self, event):
         """文件修改事件"""
-        if event.is_directory:
+        self._notify(event, event.src_path)
+    
+    def on_created(self, event):
+        """文件新建事件（新会话 / 子 Agent 文件从 0 开始读取）"""
+        self._notify(event, event.src_path)
+    
+    def on_deleted(self, event):
+        """文件删除事件"""
+        self._notify(event, event.src_path)
+    
+    def on_moved(self, event):
+        """文件移动事件（原路径按删除处理，新路径按替换处理）"""
+        self._notify(event, event.src_path)
+        self._notify(event, event.dest_path)
+    
+    def _notify(self, event, path: str):
+        """提交 *.jsonl 文件的变化（生命周期由插件按文件身份判断）"""
+        if event.is_directory or not path.endswith('.jsonl'):
             return
         
         # 只在 Debug 模式显示 Watchdog 事件
-        if event.src_path.endswith('.jsonl') and self.plugin.debug:
-            print(f"[Watchdog] File changed: {event.src_path}")
+        if self.plugin.debug:
+            print(f"[Watchdog] File {event.event_type}: {path}")
         
-        # 从其他线程提交到事件循环
-        if self.loop is None:
-            if self.plugin.debug:
-                print(f"[Watchdog] WARNING: No event loop!")
-            return
-        
-        # 线程安全地调度协程
-        asyncio.run_coroutine_threadsafe(
-            self.plugin._handle_file_change(event.src_path),
-            self.loop
-        )
+        # 从其他线程提交到合并调度器（同一文件的连续通知会被合并）
+        self.coalescer.notify_threadsafe(path)
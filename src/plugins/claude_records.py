@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Claude Code transcript 记录类型
+
+每种记录只声明处理器用到的字段，未知字段一律忽略：
+- 已安装 msgspec：生成 msgspec.Struct，JSON 直接解码为结构体，
+  未声明的字段（thinking 文本、工具结果等）不会被物化
+- 未安装 msgspec：生成 __slots__ 类，由 JSON 后端解析后按字段转换
+
+transcript 格式变化时只需修改这里的字段声明。
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.jsonl_decoder import loads
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+# 字段声明：(属性名, 类型, 默认值, JSON 键名)
+FieldSpec = Tuple[str, Any, Any, str]
+
+
+def _field(name: str, type_: Any, default: Any = None, key: Optional[str] = None) -> FieldSpec:
+    return (name, type_, default, key or name)
+
+
+class RecordSchema:
+    """记录类型：解码函数 + 字典转换函数"""
+
+    def __init__(self, name: str, fields: List[FieldSpec]):
+        self.name = name
+        self.fields = fields
+
+        if msgspec is not None:
+            self.cls = msgspec.defstruct(
+                name,
+                [(attr, _struct_type(type_), default) for attr, type_, default, _ in fields],
+                rename={attr: key for attr, _, _, key in fields if key != attr},
+                gc=False,
+            )
+            self._decoder = msgspec.json.Decoder(self.cls)
+        else:
+            self.cls = _slots_class(name, fields)
+            self._decoder = None
+
+    def decode(self, data: bytes) -> Any:
+        """JSON 字节 → 记录对象"""
+        if self._decoder is not None:
+            try:
+                return self._decoder.decode(data)
+            except msgspec.ValidationError:
+                pass  # 字段类型与声明不符（格式漂移）：回退到宽松转换
+
+        value = loads(data)
+        if not isinstance(value, dict):
+            raise ValueError(f"{self.name}: expected JSON object")
+        return self.convert(value)
+
+    def convert(self, data: Dict) -> Any:
+        """字典 → 记录对象（宽松：类型不符的字段使用默认值）"""
+        values = {}
+        for attr, type_, default, key in self.fields:
+            values[attr] = _convert_value(data.get(key, default), type_, default)
+        return self.cls(**values)
+
+
+def _struct_type(type_: Any) -> Any:
+    """字段类型 → msgspec 类型注解"""
+    if isinstance(type_, RecordSchema):
+        return Optional[type_.cls]
+    if isinstance(type_, list):
+        return List[type_[0].cls]
+    return Optional[type_]
+
+
+def _convert_value(value: Any, type_: Any, default: Any) -> Any:
+    """宽松转换单个字段"""
+    if isinstance(type_, RecordSchema):
+        return type_.convert(value) if isinstance(value, dict) else default
+    if isinstance(type_, list):
+        if not isinstance(value, list):
+            return []
+        return [type_[0].convert(item) for item in value if isinstance(item, dict)]
+    if value is None or isinstance(value, type_):
+        return value
+    if type_ is int and isinstance(value, float):
+        return int(value)
+    return default
+
+
+def _slots_class(name: str, fields: List[FieldSpec]) -> type:
+    """生成 __slots__ 记录类"""
+    attrs = tuple(attr for attr, _, _, _ in fields)
+    defaults = {attr: default for attr, _, default, _ in fields}
+
+    def __init__(self, **kwargs):
+        for attr in attrs:
+            value = kwargs.get(attr, defaults[attr])
+            # 可变默认值每个实例单独创建
+            if isinstance(value, (list, dict)) and value is defaults[attr]:
+                value = type(value)()
+            setattr(self, attr, value)
+
+    def __repr__(self):
+        return f"{name}({', '.join(f'{a}={getattr(self, a)!r}' for a in attrs)})"
+
+    return type(name, (), {'__slots__': attrs, '__init__': __init__, '__repr__': __repr__})
+
+
+# === 通用结构 ===
+
+Usage = RecordSchema('Usage', [
+    _field('input_tokens', int, 0),
+    _field('output_tokens', int, 0),
+    _field('cache_creation_input_tokens', int, 0),
+    _field('cache_read_input_tokens', int, 0),
+])
+
+ContentBlock = RecordSchema('ContentBlock', [
+    _field('type', str, ''),
+    _field('id', str, ''),
+    _field('name', str, ''),
+    _field('input', dict, {}),
+    _field('text', str, ''),
+])
+
+# === assistant ===
+
+AssistantMessage = RecordSchema('AssistantMessage', [
+    _field('id', str, ''),
+    _field('model', str, ''),
+    _field('content', [ContentBlock], []),
+    _field('stop_reason', str, None),
+    _field('usage', Usage, None),
+])
+
+AssistantRecord = RecordSchema('AssistantRecord', [
+    _field('uuid', str, ''),
+    _field('timestamp', str, ''),
+    _field('message', AssistantMessage, None),
+])
+
+# === user / file-history-snapshot（只用到头部字段） ===
+
+UserRecord = RecordSchema('UserRecord', [
+    _field('uuid', str, ''),
+])
+
+SnapshotRecord = RecordSchema('SnapshotRecord', [
+    _field('message_id', str, 'unknown', 'messageId'),
+])
+
+# === progress ===
+
+ProgressData = RecordSchema('ProgressData', [
+    _field('type', str, None),
+    _field('status', str, None),
+    _field('server_name', str, 'unknown', 'serverName'),
+    _field('tool_name', str, 'unknown', 'toolName'),
+    _field('elapsed_ms', int, 0, 'elapsedTimeMs'),
+    _field('command', str, 'unknown'),
+    _field('exit_code', int, 0, 'exitCode'),
+    _field('hook_name', str, 'unknown', 'hookName'),
+])
+
+ProgressRecord = RecordSchema('ProgressRecord', [
+    _field('data', ProgressData, None),
+])
+
+# === system ===
+
+ApiError = RecordSchema('ApiError', [
+    _field('type', str, 'unknown'),
+    _field('message', str, 'Unknown error'),
+])
+
+ApiErrorEnvelope = RecordSchema('ApiErrorEnvelope', [
+    _field('error', ApiError, None),
+])
+
+SystemRecord = RecordSchema('SystemRecord', [
+    _field('subtype', str, 'unknown'),
+    _field('duration_ms', int, 0, 'durationMs'),
+    _field('command', str, 'unknown'),
+    _field('error', ApiErrorEnvelope, None),
+])
+
+# === summary ===
+
+SummaryRecord = RecordSchema('SummaryRecord', [
+    _field('usage', Usage, None),
+    _field('summary', str, ''),
+    _field('leaf_uuid', str, '', 'leafUuid'),
+])
+
+
+# 记录类型 → 结构
+RECORD_SCHEMAS: Dict[str, RecordSchema] = {
+    'assistant': AssistantRecord,
+    'user': UserRecord,
+    'file-history-snapshot': SnapshotRecord,
+    'progress': ProgressRecord,
+    'system': SystemRecord,
+    'summary': SummaryRecord,
+}
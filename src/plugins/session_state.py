@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+SessionStateTable - 按 (session, agent) 划分的状态表
+
+多个 Claude Code 会话和子 Agent 同时运行时，各自的事件会交错写入不同的
+JSONL 文件。每个 (session_id, agent_id) 拥有独立的状态机（最后状态、Token 统计），
+避免互相抑制或来回闪烁。
+
+内存有界：
+- 超过 max_sessions 时按 LRU 淘汰最久未活动的状态
+- 超过 ttl_seconds 未活动的状态视为已结束，插入新状态时顺带淘汰
+"""
+
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .base import Status
+
+SessionKey = Tuple[str, Optional[str]]
+
+
+def parse_transcript_path(file_path: str) -> Dict:
+    """
+    从 transcript 路径提取项目、会话、Agent 信息
+
+    - 主 Agent: projects/my-app/session-abc123.jsonl
+    - 子 Agent: projects/my-app/session-abc123/subagents/agent-def456.jsonl
+    """
+    path = Path(file_path)
+
+    if 'subagents' in path.parts:
+        session_dir = path.parent.parent
+        return {
+            'project': session_dir.parent.name,
+            'session_id': session_dir.name,
+            'agent_id': path.stem,
+            'is_subagent': True,
+        }
+
+    return {
+        'project': path.parent.name,
+        'session_id': path.stem,
+        'agent_id': None,
+        'is_subagent': False,
+    }
+
+
+class SessionState:
+    """单个 (session, agent) 的状态"""
+
+    __slots__ = (
+        'project', 'session_id', 'agent_id', 'is_subagent',
+        'file_path', 'last_status', 'last_activity', 'token_stats',
+    )
+
+    def __init__(self, project: str, session_id: str, agent_id: Optional[str],
+                 is_subagent: bool, file_path: str):
+        self.project = project
+        self.session_id = session_id
+        self.agent_id = agent_id
+        self.is_subagent = is_subagent
+        self.file_path = file_path
+        self.last_status = Status.UNKNOWN
+        self.last_activity = time.monotonic()
+        self.token_stats: Dict[str, int] = {
+            'input': 0,
+            'output': 0,
+            'cache_write': 0,
+            'cache_read': 0,
+        }
+
+    @property
+    def key(self) -> SessionKey:
+        return (self.session_id, self.agent_id)
+
+    def identity(self) -> Dict:
+        """事件中携带的会话身份"""
+        return {
+            'project': self.project,
+            'session_id': self.session_id,
+            'agent_id': self.agent_id,
+            'is_subagent': self.is_subagent,
+        }
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        data = self.identity()
+        data['status'] = self.last_status.value
+        data['idle_seconds'] = round(time.monotonic() - self.last_activity, 1)
+        data['tokens'] = dict(self.token_stats)
+        return data
+
+
+class SessionStateTable:
+    """(session, agent) → SessionState，LRU 有界"""
+
+    def __init__(self, max_sessions: int = 256, ttl_seconds: Optional[float] = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+
+        self._states: 'OrderedDict[SessionKey, SessionState]' = OrderedDict()
+        # 文件路径 → 会话 Key（避免每行都解析路径）
+        self._paths: Dict[str, SessionKey] = {}
+
+        # 统计
+        self.evicted = 0
+
+    def for_file(self, file_path: str, parse: Callable[[str], Dict]) -> SessionState:
+        """获取文件对应的状态（不存在时创建），并标记为最近活动"""
+        key = self._paths.get(file_path)
+        state = self._states.get(key) if key is not None else None
+
+        if state is None:
+            info = parse(file_path)
+            key = (info['session_id'], info['agent_id'])
+            state = self._states.get(key)
+            if state is None:
+                state = SessionState(
+                    project=info['project'],
+                    session_id=info['session_id'],
+                    agent_id=info['agent_id'],
+                    is_subagent=info['is_subagent'],
+                    file_path=file_path
+                )
+                self._states[key] = state
+                self._evict()
+            self._paths[file_path] = key
+
+        state.file_path = file_path
+        state.last_activity = time.monotonic()
+        self._states.move_to_end(key)
+        return state
+
+    def get(self, session_id: str, agent_id: Optional[str] = None) -> Optional[SessionState]:
+        """按会话身份获取状态"""
+        return self._states.get((session_id, agent_id))
+
+    def remove_file(self, file_path: str) -> Optional[SessionState]:
+        """移除文件对应的状态（文件已删除）"""
+        key = self._paths.pop(file_path, None)
+        if key is None:
+            return None
+        self._drop_paths(key)
+        return self._states.pop(key, None)
+
+    def snapshot(self) -> List[Dict]:
+        """所有状态（最近活动的在前）"""
+        return [state.to_dict() for state in reversed(self._states.values())]
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __iter__(self) -> Iterator[SessionState]:
+        return iter(self._states.values())
+
+    def _evict(self):
+        """淘汰超出容量或已过期的状态（从最久未活动的开始）"""
+        now = time.monotonic()
+
+        while self._states:
+            key, oldest = next(iter(self._states.items()))
+            expired = self.ttl_seconds is not None and now - oldest.last_activity > self.ttl_seconds
+            if len(self._states) <= self.max_sessions and not expired:
+                break
+
+            del self._states[key]
+            self._drop_paths(key)
+            self.evicted += 1
+
+    def _drop_paths(self, key: SessionKey):
+        """删除指向该 Key 的路径缓存"""
+        for path in [path for path, value in self._paths.items() if value == key]:
+            del self._paths[path]
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+压缩 transcript 归档（.jsonl.gz / .jsonl.zst）
+
+保留策略会把旧 transcript 压缩归档，批量路径（历史回填、尾部读取）透明地读取归档：
+- open_transcript：返回二进制文件对象，read / seek / tell 都使用解压后的偏移，
+  与原始 .jsonl 的字节位置一致（压缩前记录的读取位置在压缩后仍然有效）
+- gzip / 普通 zstd：流式解压，按大块读取压缩数据；只能通过解压跳过来定位
+- seekable zstd（按固定大小分帧 + 末尾 seek table）：定位时只解压目标所在的帧，
+  尾部读取和断点续读无需解压整个文件
+- write_seekable_zstd：按固定大小分帧压缩并写入 seek table（供保留任务使用）
+- zstandard 为可选依赖，未安装时 .jsonl.zst 不可读（archive_supported 返回 False）
+
+seek table 格式（zstd seekable format）：
+- 位于文件末尾的 skippable frame（magic 0x184D2A5E）
+- 每帧一项：压缩大小 u32、解压大小 u32、可选校验 u32
+- 末尾 9 字节：帧数 u32、描述字节（bit 7 表示带校验）、magic 0x8F92EAB1
+"""
+
+import bisect
+import gzip
+import io
+import os
+import struct
+import zlib
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 可选依赖
+    zstandard = None
+
+# 支持的 transcript 后缀（归档在原始后缀之后追加压缩后缀）
+TRANSCRIPT_SUFFIX = '.jsonl'
+ARCHIVE_SUFFIXES = ('.jsonl.gz', '.jsonl.zst')
+TRANSCRIPT_SUFFIXES = (TRANSCRIPT_SUFFIX,) + ARCHIVE_SUFFIXES
+
+# 压缩数据的单次读取大小
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# write_seekable_zstd 的帧大小（解压后）：越小定位越快，压缩率越低
+DEFAULT_FRAME_SIZE = 4 * 1024 * 1024
+
+# 未知解压大小时的估算压缩比（只用于任务规划）
+ESTIMATED_RATIO = 8
+
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEK_TABLE_MAGIC = 0x8F92EAB1
+SEEK_TABLE_FOOTER = struct.Struct('<IBI')
+SKIPPABLE_HEADER = struct.Struct('<II')
+
+
+def is_archive(file_path: str) -> bool:
+    """是否为压缩归档"""
+    return file_path.endswith(ARCHIVE_SUFFIXES)
+
+
+def transcript_key(file_path: str) -> str:
+    """归档对应的原始 .jsonl 路径（非归档原样返回）"""
+    for suffix in ARCHIVE_SUFFIXES:
+        if file_path.endswith(suffix):
+            return file_path[:-len(suffix)] + TRANSCRIPT_SUFFIX
+    return file_path
+
+
+def archive_supported(file_path: str) -> bool:
+    """当前环境能否读取该文件（.jsonl.zst 需要 zstandard）"""
+    return not file_path.endswith('.zst') or zstandard is not None
+
+
+def read_seek_table(file_path: str) -> Optional[List[Tuple[int, int]]]:
+    """
+    读取 zstd seek table
+
+    Returns:
+        每帧的 (压缩大小, 解压大小)；没有 seek table 时返回 None
+    """
+    with open(file_path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size < SEEK_TABLE_FOOTER.size + SKIPPABLE_HEADER.size:
+            return None
+
+        f.seek(size - SEEK_TABLE_FOOTER.size)
+        num_frames, descriptor, magic = SEEK_TABLE_FOOTER.unpack(f.read(SEEK_TABLE_FOOTER.size))
+        if magic != SEEK_TABLE_MAGIC:
+            return None
+
+        entry_size = 12 if descriptor & 0x80 else 8
+        table_size = num_frames * entry_size + SEEK_TABLE_FOOTER.size
+        header_pos = size - table_size - SKIPPABLE_HEADER.size
+        if header_pos < 0:
+            return None
+
+        f.seek(header_pos)
+        skippable, frame_size = SKIPPABLE_HEADER.unpack(f.read(SKIPPABLE_HEADER.size))
+        if skippable != SKIPPABLE_MAGIC or frame_size != table_size:
+            return None
+
+        entries = f.read(num_frames * entry_size)
+
+    return [
+        struct.unpack_from('<II', entries, index * entry_size)
+        for index in range(num_frames)
+    ]
+
+
+def has_random_access(file_path: str) -> bool:
+    """定位是否不需要从头解压（普通文件和带 seek table 的 zstd）"""
+    if not is_archive(file_path):
+        return True
+    if not file_path.endswith('.zst') or zstandard is None:
+        return False
+    return read_seek_table(file_path) is not None
+
+
+def uncompressed_size(file_path: str, st: Optional[os.stat_result] = None) -> Optional[int]:
+    """解压后的精确大小（普通文件和 seekable zstd；其他归档未知，返回 None）"""
+    if not is_archive(file_path):
+        return (st or os.stat(file_path)).st_size
+    if file_path.endswith('.zst') and zstandard is not None:
+        try:
+            frames = read_seek_table(file_path)
+        except OSError:
+            frames = None
+        if frames is not None:
+            return sum(frame[1] for frame in frames)
+    return None
+
+
+def open_transcript(file_path: str, buffer_size: int = DEFAULT_BUFFER_SIZE) -> BinaryIO:
+    """
+    打开 transcript（普通文件或归档），偏移均为解压后的字节位置
+
+    Raises:
+        OSError: 文件无法打开，或读取 .jsonl.zst 但未安装 zstandard
+    """
+    if file_path.endswith('.gz'):
+        return StreamDecompressReader(
+            file_path, lambda: zlib.decompressobj(wbits=16 + zlib.MAX_WBITS), buffer_size
+        )
+
+    if file_path.endswith('.zst'):
+        if zstandard is None:
+            raise OSError(f'zstandard 未安装，无法读取 {file_path}')
+        frames = read_seek_table(file_path)
+        if frames is not None:
+            return SeekableZstdReader(file_path, frames)
+        return StreamDecompressReader(
+            file_path, lambda: zstandard.ZstdDecompressor().decompressobj(), buffer_size
+        )
+
+    return open(file_path, 'rb', buffering=buffer_size)
+
+
+class StreamDecompressReader(io.RawIOBase):
+    """
+    流式解压读取器（gzip 多成员 / zstd 多帧）
+
+    - 压缩数据按 buffer_size 大块读取
+    - 向前 seek 通过解压并丢弃实现；向后 seek 重新从头解压
+    - SEEK_END 需要解压到文件末尾
+    """
+
+    def __init__(self, file_path: str, new_decompressor: Callable,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE):
+        super().__init__()
+        self.file_path = file_path
+        self.buffer_size = buffer_size
+        self._new_decompressor = new_decompressor
+
+        self._file = open(file_path, 'rb', buffering=0)
+        self._reset()
+
+    def _reset(self):
+        self._file.seek(0)
+        self._decompressor = self._new_decompressor()
+        # 已解压但尚未读取的数据
+        self._buffer = b''
+        self._buffer_pos = 0
+        self._pos = 0
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            parts = [self._take(len(self._buffer) - self._buffer_pos)]
+            while self._fill():
+                parts.append(self._take(len(self._buffer)))
+            return b''.join(parts)
+
+        while len(self._buffer) - self._buffer_pos < size and self._fill():
+            pass
+        return self._take(size)
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readall(self) -> bytes:
+        return self.read(-1)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            while self._fill():
+                pass
+            offset += self._pos + len(self._buffer) - self._buffer_pos
+
+        if offset < self._pos:
+            self._reset()
+
+        # 向前跳过：解压并丢弃
+        while self._pos < offset:
+            if not self._take(min(offset - self._pos, self.buffer_size)) and not self._fill():
+                break
+        return self._pos
+
+    def _take(self, size: int) -> bytes:
+        """从解压缓冲中取出最多 size 字节"""
+        start = self._buffer_pos
+        data = self._buffer[start:start + size]
+        self._buffer_pos = start + len(data)
+        self._pos += len(data)
+        return data
+
+    def _fill(self) -> bool:
+        """读取一块压缩数据并解压，追加到缓冲（到达末尾返回 False）"""
+        if self._eof:
+            return False
+
+        raw = self._file.read(self.buffer_size)
+        if not raw:
+            self._eof = True
+            return False
+
+        out = []
+        while raw:
+            out.append(self._decompressor.decompress(raw))
+            if not self._decompressor.eof:
+                break
+            # 成员 / 帧结束：剩余数据属于下一个成员（gzip 末尾可能有零填充）
+            raw = self._decompressor.unused_data
+            self._decompressor = self._new_decompressor()
+            if not raw.strip(b'\x00'):
+                break
+
+        self._buffer = self._buffer[self._buffer_pos:] + b''.join(out)
+        self._buffer_pos = 0
+        return True
+
+
+class SeekableZstdReader(io.RawIOBase):
+    """带 seek table 的 zstd 读取器：按帧随机访问，只缓存当前帧"""
+
+    def __init__(self, file_path: str, frames: List[Tuple[int, int]]):
+        super().__init__()
+        self.file_path = file_path
+
+        # 每帧的 (压缩起点, 解压起点, 压缩大小, 解压大小)
+        self._frames: List[Tuple[int, int, int, int]] = []
+        self._starts: List[int] = []
+        compressed = decompressed = 0
+        for compressed_size, decompressed_size in frames:
+            self._frames.append((compressed, decompressed, compressed_size, decompressed_size))
+            self._starts.append(decompressed)
+            compressed += compressed_size
+            decompressed += decompressed_size
+        self.size = decompressed
+
+        self._file = open(file_path, 'rb', buffering=0)
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._pos = 0
+        self._frame_index = -1
+        self._frame_data = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self._pos
+
+        parts = []
+        while size > 0 and self._pos < self.size:
+            index = bisect.bisect_right(self._starts, self._pos) - 1
+            data = self._load_frame(index)
+            start = self._pos - self._frames[index][1]
+            part = data[start:start + size]
+            parts.append(part)
+            self._pos += len(part)
+            size -= len(part)
+        return b''.join(parts)
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readall(self) -> bytes:
+        return self.read(-1)
+
+    def _load_frame(self, index: int) -> bytes:
+        """解压单帧（命中当前帧时直接返回）"""
+        if index != self._frame_index:
+            compressed_start, _, compressed_size, decompressed_size = self._frames[index]
+            self._file.seek(compressed_start)
+            self._frame_data = self._decompressor.decompress(
+                self._file.read(compressed_size), max_output_size=decompressed_size
+            )
+            self._frame_index = index
+        return self._frame_data
+
+
+def write_seekable_zstd(src_path: str, dst_path: str,
+                        frame_size: int = DEFAULT_FRAME_SIZE, level: int = 3):
+    """
+    把 transcript 压缩为 seekable zstd（先写临时文件，完成后原子替换）
+
+    每帧解压大小为 frame_size（最后一帧可能更小），末尾追加 seek table
+    """
+    if zstandard is None:
+        raise OSError('zstandard 未安装，无法写入 .zst 归档')
+
+    compressor = zstandard.ZstdCompressor(level=level, write_content_size=True)
+    entries = []
+    tmp_path = dst_path + '.tmp'
+
+    with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        while True:
+            data = src.read(frame_size)
+            if not data:
+                break
+            frame = compressor.compress(data)
+            dst.write(frame)
+            entries.append(struct.pack('<II', len(frame), len(data)))
+
+        table = b''.join(entries) + SEEK_TABLE_FOOTER.pack(len(entries), 0, SEEK_TABLE_MAGIC)
+        dst.write(SKIPPABLE_HEADER.pack(SKIPPABLE_MAGIC, len(table)))
+        dst.write(table)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+    os.replace(tmp_path, dst_path)
+
+
+def write_gzip(src_path: str, dst_path: str, level: int = 6):
+    """把 transcript 压缩为 gzip（先写临时文件，完成后原子替换）"""
+    tmp_path = dst_path + '.tmp'
+    with open(src_path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=level) as dst:
+        while True:
+            data = src.read(DEFAULT_BUFFER_SIZE)
+            if not data:
+                break
+            dst.write(data)
+    os.replace(tmp_path, dst_path)
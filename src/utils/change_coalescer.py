@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+ChangeCoalescer - 文件变化通知合并调度器
+
+- 同一路径在防抖窗口内的多次通知合并为一次处理
+- 每个文件同时最多只有一个处理任务（读取期间的新通知只标记为"脏"，
+  当前任务结束后再调度一次）
+- 计数器记录收到、合并、实际调度的通知数量
+- 记录每个路径最后一次收到通知的时间（用于检测通知缺失）
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+
+class ChangeCoalescer:
+    """文件变化合并调度器"""
+
+    def __init__(self, handler: Callable[[str], Awaitable[None]], debounce_ms: float = 50,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.handler = handler
+        self.debounce = max(debounce_ms, 0) / 1000
+        self.loop = loop or asyncio.get_running_loop()
+
+        # 等待窗口结束的路径
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        # 正在处理的路径（强引用，防止任务被回收）
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # 处理期间又收到通知的路径
+        self._dirty: Set[str] = set()
+        self._closed = False
+        # 每个路径最后一次收到通知的时间（time.time()，与 mtime 可比）
+        self.last_received: Dict[str, float] = {}
+
+        # 统计
+        self.received = 0
+        self.merged = 0
+        self.dispatched = 0
+
+    def notify(self, path: str):
+        """收到文件变化通知（必须在事件循环线程调用）"""
+        if self._closed:
+            return
+
+        self.received += 1
+        self.last_received[path] = time.time()
+
+        if path in self._timers:
+            self.merged += 1
+            return
+
+        if path in self._inflight:
+            if path in self._dirty:
+                self.merged += 1
+            else:
+                self._dirty.add(path)
+            return
+
+        self._schedule(path)
+
+    def notify_threadsafe(self, path: str):
+        """从其他线程（如 watchdog Observer）提交通知"""
+        self.loop.call_soon_threadsafe(self.notify, path)
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取统计信息"""
+        return {
+            'received': self.received,
+            'merged': self.merged,
+            'dispatched': self.dispatched,
+            'pending': len(self._timers),
+            'inflight': len(self._inflight),
+        }
+
+    async def close(self):
+        """取消等待中的通知，并等待正在处理的任务结束"""
+        self._closed = True
+
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._dirty.clear()
+
+        if self._inflight:
+            await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+
+    def _schedule(self, path: str):
+        """在防抖窗口结束后调度处理"""
+        self._timers[path] = self.loop.call_later(self.debounce, self._dispatch, path)
+
+    def _dispatch(self, path: str):
+        """窗口结束：启动处理任务"""
+        self._timers.pop(path, None)
+        self.dispatched += 1
+        self._inflight[path] = self.loop.create_task(self._run(path))
+
+    async def _run(self, path: str):
+        """处理单个路径，结束后检查是否需要再次调度"""
+        try:
+            await self.handler(path)
+        except Exception as e:
+            print(f"[ChangeCoalescer] Handler error for {path}: {e}")
+        finally:
+            self._inflight.pop(path, None)
+            if path in self._dirty and not self._closed:
+                self._dirty.discard(path)
+                self._schedule(path)
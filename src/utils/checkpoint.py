@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+CheckpointStore - 读取位置检查点（SQLite）
+
+记录每个 JSONL 文件已消费的字节位置，以及最后推断的状态，
+重启后可直接从检查点续读，无需重新扫描 ~/.claude/projects。
+
+表结构：
+- file_offsets: path → (device, inode, mtime_ns, size, offset)
+- plugin_state: key → value（如 last_status）
+
+所有方法都可以在 I/O 线程池中调用：连接跨线程共享，读写由一个锁串行化。
+"""
+
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+
+@dataclass
+class Checkpoint:
+    """单个文件的检查点"""
+    path: str
+    device: int
+    inode: int
+    mtime_ns: int
+    size: int
+    offset: int
+
+    def matches(self, st: os.stat_result) -> bool:
+        """是否仍是同一个文件（设备 + inode 相同，且未被截断）"""
+        return (
+            self.device == st.st_dev
+            and self.inode == st.st_ino
+            and st.st_size >= self.offset
+        )
+
+    def is_unchanged(self, st: os.stat_result) -> bool:
+        """文件自检查点以来是否完全未变化"""
+        return self.matches(st) and self.mtime_ns == st.st_mtime_ns and self.size == st.st_size
+
+
+class CheckpointStore:
+    """检查点存储"""
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self._conn: Optional[sqlite3.Connection] = None
+        # 串行化连接的使用（多个 I/O 线程可能同时写入 / 删除检查点）
+        self._lock = threading.Lock()
+
+    def open(self):
+        """打开（或创建）数据库"""
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        if self._conn is not None:
+            return
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS file_offsets ('
+            ' path TEXT PRIMARY KEY,'
+            ' device INTEGER NOT NULL,'
+            ' inode INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' offset INTEGER NOT NULL'
+            ') WITHOUT ROWID'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS plugin_state ('
+            ' key TEXT PRIMARY KEY,'
+            ' value TEXT'
+            ') WITHOUT ROWID'
+        )
+        self._conn.commit()
+
+    def close(self):
+        """关闭数据库"""
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def load(self) -> Dict[str, Checkpoint]:
+        """加载全部检查点"""
+        with self._lock:
+            self._open()
+            rows = self._conn.execute(
+                'SELECT path, device, inode, mtime_ns, size, offset FROM file_offsets'
+            )
+            return {row[0]: Checkpoint(*row) for row in rows}
+
+    def save(self, checkpoints: Iterable[Checkpoint], state: Optional[Dict[str, str]] = None):
+        """批量写入检查点（单个事务）"""
+        with self._lock:
+            self._open()
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO file_offsets'
+                    ' (path, device, inode, mtime_ns, size, offset) VALUES (?, ?, ?, ?, ?, ?)',
+                    (
+                        (c.path, c.device, c.inode, c.mtime_ns, c.size, c.offset)
+                        for c in checkpoints
+                    )
+                )
+                if state:
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO plugin_state (key, value) VALUES (?, ?)',
+                        state.items()
+                    )
+
+    def remove(self, paths: Iterable[str]):
+        """删除检查点（文件已不存在）"""
+        with self._lock:
+            self._open()
+            with self._conn:
+                self._conn.executemany(
+                    'DELETE FROM file_offsets WHERE path = ?',
+                    ((path,) for path in paths)
+                )
+
+    def load_state(self, prefix: str = '') -> Dict[str, str]:
+        """读取键以 prefix 开头的全部插件状态"""
+        with self._lock:
+            self._open()
+            rows = self._conn.execute(
+                'SELECT key, value FROM plugin_state WHERE substr(key, 1, ?) = ?',
+                (len(prefix), prefix)
+            )
+            return dict(rows)
+
+    def get_state(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """读取插件状态"""
+        with self._lock:
+            self._open()
+            row = self._conn.execute(
+                'SELECT value FROM plugin_state WHERE key = ?', (key,)
+            ).fetchone()
+            return row[0] if row else default
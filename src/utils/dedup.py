@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+记录去重：精确 LRU + 可扩展 Bloom filter
+
+同一条 assistant 消息按内容块拆成多行（message.id 相同，每行携带相同的 usage），
+文件被重写或重放时，已处理的记录（uuid）会再次出现。DedupFilter 判断一个 id 是否已见过：
+
+- 最近的 id 保存在精确 LRU 中（同一消息的多行总是相邻出现，命中 LRU，结果精确）
+- 所有 id 同时写入可扩展 Bloom filter（长尾：重放的旧记录）
+  - 当前代写满后新增一代，容量按 growth 增长、误判率按 tightening 收紧，
+    第一代误判率为 error_rate·(1 - tightening)，各代合计不超过 error_rate
+  - 代数达到 max_generations 时丢弃最旧的一代（很久以前的 id 不再记得），
+    内存上限固定，与运行时长无关
+- Bloom filter 只会误判"已见过"（不会漏判）：误判率按默认 1e-6 计，对 Token 合计的影响可忽略
+"""
+
+import hashlib
+import math
+from collections import OrderedDict
+from typing import Dict, List
+
+
+class BloomFilter:
+    """固定容量的 Bloom filter（bytearray 位图，双重哈希）"""
+
+    __slots__ = ('capacity', 'error_rate', 'num_bits', 'num_hashes', 'count', '_bits')
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # m = -n·ln(p) / ln(2)²，k = m/n·ln(2)
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, digest: bytes):
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def contains(self, digest: bytes) -> bool:
+        # 逐个检查，遇到未置位的位即返回（新 id 通常在前一两个位置就能判定）
+        bits = self._bits
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        m = self.num_bits
+        for i in range(self.num_hashes):
+            pos = (h1 + i * h2) % m
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, digest: bytes):
+        bits = self._bits
+        for pos in self._positions(digest):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._bits)
+
+
+class ScalableBloomFilter:
+    """可扩展 Bloom filter（按代增长，超过代数上限时淘汰最旧的一代）"""
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 1e-6,
+                 growth: int = 2, tightening: float = 0.5, max_generations: int = 4):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.max_generations = max(1, max_generations)
+
+        self.generations: List[BloomFilter] = [BloomFilter(capacity, error_rate * (1 - tightening))]
+
+        # 统计
+        self.retired = 0
+
+    @staticmethod
+    def digest(key: str) -> bytes:
+        """128 位摘要（各代共用，只计算一次）"""
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+    def contains(self, digest: bytes) -> bool:
+        # 最新的一代最可能命中
+        return any(bloom.contains(digest) for bloom in reversed(self.generations))
+
+    def add(self, digest: bytes):
+        current = self.generations[-1]
+        if current.full:
+            if len(self.generations) >= self.max_generations:
+                self.generations.pop(0)
+                self.retired += 1
+                # 代数已满：保持最后一代的容量和误判率，内存不再增长
+                current = BloomFilter(current.capacity, current.error_rate)
+            else:
+                current = BloomFilter(current.capacity * self.growth, current.error_rate * self.tightening)
+            self.generations.append(current)
+        current.add(digest)
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(bloom.memory_bytes for bloom in self.generations)
+
+    def __len__(self) -> int:
+        return sum(bloom.count for bloom in self.generations)
+
+
+class DedupFilter:
+    """id 去重：最近的 id 精确判断（LRU），更早的 id 由 Bloom filter 判断"""
+
+    def __init__(self, recent: int = 4096, capacity: int = 100_000,
+                 error_rate: float = 1e-6, max_generations: int = 4):
+        self.recent = recent
+        self._recent: 'OrderedDict[str, None]' = OrderedDict()
+        self.bloom = ScalableBloomFilter(capacity, error_rate, max_generations=max_generations)
+
+        # 统计
+        self.checked = 0
+        self.recent_hits = 0
+        self.bloom_hits = 0
+
+    def seen(self, key: str) -> bool:
+        """
+        判断 key 是否已见过，未见过时记录下来
+
+        Returns:
+            True 表示重复（调用方应跳过）
+        """
+        self.checked += 1
+
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            self.recent_hits += 1
+            return True
+
+        digest = ScalableBloomFilter.digest(key)
+        if self.bloom.contains(digest):
+            self.bloom_hits += 1
+            return True
+
+        self.bloom.add(digest)
+        self._recent[key] = None
+        if len(self._recent) > self.recent:
+            self._recent.popitem(last=False)
+        return False
+
+    def get_stats(self) -> Dict:
+        """去重统计（命中数、Bloom filter 代数和内存）"""
+        return {
+            'checked': self.checked,
+            'duplicates': self.recent_hits + self.bloom_hits,
+            'recent_hits': self.recent_hits,
+            'bloom_hits': self.bloom_hits,
+            'recent_size': len(self._recent),
+            'bloom_entries': len(self.bloom),
+            'bloom_generations': len(self.bloom.generations),
+            'bloom_retired': self.bloom.retired,
+            'bloom_memory_bytes': self.bloom.memory_bytes,
+        }
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+InotifyWatcher - Linux 原生 inotify 目录监控（asyncio 集成）
+
+- inotify fd 直接通过 loop.add_reader 注册到事件循环，不需要额外线程
+- fd 可读时一次读取所有待处理事件并批量解码
+- 回调在事件循环线程直接调用（没有跨线程提交、Future 或协程分配）
+- 递归监控：新建的子目录自动加入监控，并补报其中已存在的文件
+- 非递归模式：只监控根目录，新建子目录交给 on_directory 回调，
+  其他目录由调用方通过 watch() / unwatch() 管理（见 HotSetWatchManager）
+
+监控的事件：IN_MODIFY / IN_CREATE / IN_MOVED_TO / IN_MOVED_FROM / IN_DELETE / IN_DELETE_SELF
+（以及内核自动产生的 IN_IGNORED / IN_Q_OVERFLOW）。文件的新建、移入、移出和删除
+都按变化报告，由调用方根据文件身份判断具体的生命周期变化。
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+
+WATCH_MASK = (IN_MODIFY | IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+              | IN_DELETE_SELF | IN_ONLYDIR)
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_EVENT_HEADER = struct.Struct('iIII')
+
+# 单次 read() 的缓冲区大小
+DEFAULT_READ_SIZE = 64 * 1024
+
+
+def _load_libc():
+    """加载 libc 的 inotify 函数（非 Linux 或不可用时返回 None）"""
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+_libc = _load_libc()
+
+
+def is_available() -> bool:
+    """当前平台是否支持 inotify"""
+    return _libc is not None
+
+
+def parse_events(data: bytes) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    解码一批 inotify 事件
+
+    Returns:
+        (wd, mask, name) 迭代器（name 为 bytes，目录自身的事件为 b''）
+    """
+    offset = 0
+    end = len(data)
+
+    while offset + _EVENT_HEADER.size <= end:
+        wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        yield wd, mask, name
+
+
+class InotifyWatcher:
+    """inotify 递归目录监控"""
+
+    def __init__(self, root: str, on_change: Callable[[str], None],
+                 suffix: str = '.jsonl',
+                 on_overflow: Optional[Callable[[], None]] = None,
+                 recursive: bool = True,
+                 on_directory: Optional[Callable[[str], None]] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None,
+                 read_size: int = DEFAULT_READ_SIZE):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available on this platform')
+
+        self.root = root
+        self.on_change = on_change
+        self.suffix = suffix
+        self.on_overflow = on_overflow
+        self.recursive = recursive
+        self.on_directory = on_directory
+        self.loop = loop or asyncio.get_running_loop()
+        self.read_size = read_size
+
+        self.fd: Optional[int] = None
+        # watch descriptor → 目录路径
+        self._watches: Dict[int, str] = {}
+        # 目录路径 → watch descriptor
+        self._paths: Dict[str, int] = {}
+
+        # 统计
+        self.reads = 0
+        self.events = 0
+        self.notified = 0
+        self.overflows = 0
+
+    def start(self):
+        """创建 inotify 实例，递归添加监控并注册到事件循环"""
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self.fd = fd
+        try:
+            if self.recursive:
+                self._add_tree(self.root, report=False)
+            elif not self.watch(self.root):
+                raise OSError(errno.ENOENT, f'cannot watch {self.root}')
+        except Exception:
+            self.close()
+            raise
+
+        self.loop.add_reader(fd, self._on_readable)
+
+    def close(self):
+        """注销并关闭 inotify fd（内核自动移除所有 watch）"""
+        if self.fd is None:
+            return
+
+        try:
+            self.loop.remove_reader(self.fd)
+        except Exception:
+            pass
+        os.close(self.fd)
+        self.fd = None
+        self._watches.clear()
+        self._paths.clear()
+
+    def watch(self, directory: str) -> bool:
+        """添加单个目录监控（已监控时直接返回 True）"""
+        if directory in self._paths:
+            return True
+        return self._add_watch(directory)
+
+    def unwatch(self, directory: str):
+        """移除单个目录监控"""
+        wd = self._paths.get(directory)
+        if wd is not None:
+            self._remove_watch(wd)
+
+    def is_watching(self, directory: str) -> bool:
+        """目录是否正在监控"""
+        return directory in self._paths
+
+    @property
+    def watch_count(self) -> int:
+        """当前 watch 数量"""
+        return len(self._watches)
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取统计信息"""
+        return {
+            'watches': len(self._watches),
+            'reads': self.reads,
+            'events': self.events,
+            'notified': self.notified,
+            'overflows': self.overflows,
+        }
+
+    def _on_readable(self):
+        """fd 可读：读取并处理所有待处理事件"""
+        while self.fd is not None:
+            try:
+                data = os.read(self.fd, self.read_size)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                print(f"[InotifyWatcher] Read error: {e}")
+                return
+
+            if not data:
+                return
+
+            self.reads += 1
+            self._dispatch(data)
+
+    def _dispatch(self, data: bytes):
+        """批量解码并分发事件"""
+        for wd, mask, name in parse_events(data):
+            self.events += 1
+
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出：有通知丢失，由调用方重新同步
+                self.overflows += 1
+                if self.on_overflow is not None:
+                    self.on_overflow()
+                continue
+
+            if mask & IN_IGNORED:
+                # watch 已被内核移除（目录删除 / 文件系统卸载）
+                self._forget(wd)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+
+            if mask & IN_DELETE_SELF:
+                self._remove_watch(wd)
+                continue
+
+            path = os.path.join(directory, os.fsdecode(name))
+
+            if mask & IN_ISDIR:
+                # 新建 / 移入的子目录：加入监控，并补报其中已有的文件
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if self.recursive:
+                        self._add_tree(path, report=True)
+                    elif self.on_directory is not None:
+                        self.on_directory(path)
+                continue
+
+            if path.endswith(self.suffix):
+                self.notified += 1
+                self.on_change(path)
+
+    def _add_tree(self, root: str, report: bool):
+        """递归添加目录监控（report=True 时补报已存在的文件）"""
+        pending = [root]
+
+        while pending:
+            directory = pending.pop()
+            if not self._add_watch(directory):
+                continue
+
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                            elif report and entry.name.endswith(self.suffix):
+                                self.notified += 1
+                                self.on_change(entry.path)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+
+    def _add_watch(self, directory: str) -> bool:
+        """添加单个目录监控"""
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                print(f"[InotifyWatcher] Watch limit reached (fs.inotify.max_user_watches), skipping: {directory}")
+            elif err not in (errno.ENOENT, errno.ENOTDIR):
+                print(f"[InotifyWatcher] Cannot watch {directory}: {os.strerror(err)}")
+            return False
+
+        # 同一目录重复添加时内核返回相同的 wd
+        self._watches[wd] = directory
+        self._paths[directory] = wd
+        return True
+
+    def _remove_watch(self, wd: int):
+        """移除单个目录监控"""
+        if self._forget(wd) and self.fd is not None:
+            _libc.inotify_rm_watch(self.fd, wd)
+
+    def _forget(self, wd: int) -> bool:
+        """清除 watch 记录"""
+        directory = self._watches.pop(wd, None)
+        if directory is None:
+            return False
+        if self._paths.get(directory) == wd:
+            del self._paths[directory]
+        return True
+
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+JSONL 快速解码
+
+1. 字节级预分类：不做完整解析，直接从原始字节中提取顶层 "type"
+   （以及 subtype / stop_reason / messageId 等少量字段）
+2. 可插拔的 JSON 后端：优先 orjson，其次 msgspec，最后标准库 json
+3. RecordDecoder：无关记录、只需头部字段的记录、超大记录都不会被物化为字典；
+   提供 schemas 时直接解码为类型化的记录对象
+4. 读取时被截断的超长行（OversizedLine）只根据前缀分类和提取头部字段
+"""
+
+import json
+import re
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .jsonl_reader import OversizedLine
+
+# === JSON 后端（可选依赖，按速度优先级选择） ===
+try:
+    import orjson
+
+    def loads(data) -> Any:
+        return orjson.loads(data)
+
+    BACKEND = 'orjson'
+
+except ImportError:
+    try:
+        import msgspec
+
+        _msgspec_decoder = msgspec.json.Decoder()
+
+        def loads(data) -> Any:
+            return _msgspec_decoder.decode(data)
+
+        BACKEND = 'msgspec'
+
+    except ImportError:
+        def loads(data) -> Any:
+            # 标准库 json 不接受 memoryview（内存映射读取产出的行）
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            return json.loads(data)
+
+        BACKEND = 'json'
+
+
+# 顶层记录类型（Claude Code transcript）
+# 嵌套对象里的 "type"（message / text / tool_use / mcp_progress 等）不在此集合中
+RECORD_TYPES = frozenset({
+    'assistant',
+    'user',
+    'system',
+    'summary',
+    'progress',
+    'file-history-snapshot',
+    'queue-operation',
+})
+
+_TYPE_PATTERN = re.compile(rb'"type"\s*:\s*"([a-z-]+)"')
+_FIELD_PATTERNS: Dict[str, 're.Pattern'] = {}
+
+_BACKSLASH = ord('\\')
+# 不超过此长度、且没有转义的区间按引号切分后计数；其余区间逐个跳过字符串（memchr 查找引号）
+_SHORT_SEGMENT = 4096
+_OPEN = frozenset(b'[{')
+_CLOSE = frozenset(b']}')
+
+
+def _scan_depth(line: bytes, pos: int, end: int, depth: int) -> int:
+    """[pos, end) 区间（从结构位置开始）扫描后的嵌套深度：字符串按引号整体跳过，只统计字符串之外的括号"""
+    if end - pos <= _SHORT_SEGMENT and line.find(b'\\', pos, end) < 0:
+        # 没有转义：每个引号都是字符串边界，按引号切分后偶数段在字符串之外
+        outside = b''.join(line[pos:end].split(b'"')[::2])
+        return depth + outside.count(b'{') + outside.count(b'[') - outside.count(b'}') - outside.count(b']')
+
+    while pos < end:
+        quote = line.find(b'"', pos, end)
+        stop = end if quote < 0 else quote
+        # 字符串之间只有标点、数字和字面量，区间很短
+        for char in line[pos:stop]:
+            if char in _OPEN:
+                depth += 1
+            elif char in _CLOSE:
+                depth -= 1
+        if quote < 0:
+            break
+
+        # 跳到字符串的结束引号（前面的反斜杠为偶数个）
+        pos = quote + 1
+        while True:
+            quote = line.find(b'"', pos, end)
+            if quote < 0:
+                return depth
+            pos = quote + 1
+            index = quote - 1
+            while line[index] == _BACKSLASH:
+                index -= 1
+            if (quote - 1 - index) % 2 == 0:
+                break
+    return depth
+
+
+def _is_top_level(line: bytes, opening: int, match: 're.Match') -> bool:
+    """
+    快速判断：不看字符串边界，只用 memchr 查找括号，结论一定成立
+
+    - 匹配之前（外层 { 之后）没有任何 { / [：还没有进入嵌套
+    - 匹配之后没有 { / [ / ]，且只有一个 }（外层对象的结束）：已不在嵌套中
+    """
+    start = match.start()
+    if line.find(b'{', opening + 1, start) < 0 and line.find(b'[', opening + 1, start) < 0:
+        return True
+    if isinstance(line, OversizedLine):
+        return False  # 被截断的超长行没有行尾
+    end = match.end()
+    close = line.find(b'}', end)
+    return (close >= 0 and line.rfind(b'}', end) == close
+            and line.find(b'{', end) < 0 and line.find(b'[', end) < 0 and line.find(b']', end) < 0)
+
+
+def _find_top_level(line: bytes, pattern: 're.Pattern') -> Optional['re.Match']:
+    """
+    位于顶层对象中的匹配（键不在嵌套的对象 / 数组里）
+
+    字符串内部的引号都经过转义，所以只有真实的 JSON 键才会匹配 "key":"..."。
+    Claude Code transcript 的顶层键要么在所有嵌套对象之前，要么在之后（type / uuid 常在 message 之后），
+    先用 _is_top_level 快速判断；都不能确定时才从行首精确计算嵌套深度。
+    """
+    if isinstance(line, memoryview):
+        line = line.tobytes()  # 内存映射的行：复制一次（memcpy），之后用 bytes 的 memchr 查找
+
+    opening = line.find(b'{')
+    if opening < 0:
+        return None
+
+    depth = 0
+    pos = opening
+    for match in pattern.finditer(line, opening):
+        if _is_top_level(line, opening, match):
+            return match
+        depth = _scan_depth(line, pos, match.start(), depth)
+        if depth == 1:
+            return match
+        pos = match.end()
+    return None
+
+
+def classify(line: bytes) -> Optional[str]:
+    """
+    提取顶层记录类型（不做完整解析）
+
+    只取顶层对象的 "type"：message / content / data 等嵌套对象里的 "type"
+    （包括 "user" 这样与记录类型同名的值）不参与分类。
+
+    Returns:
+        记录类型，或 None（未知类型 / 非记录行）
+    """
+    match = _find_top_level(line, _TYPE_PATTERN)
+    if match is None:
+        return None
+    value = match.group(1).decode('ascii')
+    return value if value in RECORD_TYPES else None
+
+
+def extract_field(line: bytes, name: str) -> Optional[str]:
+    """提取顶层对象中名为 name 的字符串字段（不做完整解析）"""
+    pattern = _FIELD_PATTERNS.get(name)
+    if pattern is None:
+        pattern = re.compile(rb'"' + re.escape(name.encode('ascii')) + rb'"\s*:\s*"((?:[^"\\]|\\.)*)"')
+        _FIELD_PATTERNS[name] = pattern
+
+    match = _find_top_level(line, pattern)
+    if match is None:
+        return None
+    return match.group(1).decode('utf-8', errors='replace')
+
+
+class RecordDecoder:
+    """
+    JSONL 记录解码器
+
+    - 未知类型：直接跳过
+    - 只需头部字段的类型（header_fields 中配置）：用预分类提取字段，不解析
+    - 超过 max_record_bytes 的记录、读取时被截断的超长行：跳过
+    - 其余记录：使用 JSON 后端完整解析
+
+    schemas（记录类型 → 结构，需提供 decode(bytes) / convert(dict)）：
+    提供时返回类型化的记录对象，否则返回字典
+    """
+
+    # 默认：这些类型的处理器只需要少量头部字段
+    DEFAULT_HEADER_FIELDS = {
+        'user': ('uuid',),
+        'file-history-snapshot': ('messageId',),
+    }
+
+    def __init__(self, record_types=RECORD_TYPES,
+                 header_fields: Optional[Dict[str, Tuple[str, ...]]] = None,
+                 max_record_bytes: int = 8 * 1024 * 1024,
+                 loads_func: Callable[[Any], Any] = loads,
+                 schemas: Optional[Dict[str, Any]] = None):
+        self.record_types = frozenset(record_types)
+        self.header_fields = self.DEFAULT_HEADER_FIELDS if header_fields is None else header_fields
+        self.max_record_bytes = max_record_bytes
+        self.loads = loads_func
+        self.schemas = schemas or {}
+
+        # 统计
+        self.stats: Dict[str, int] = {
+            'lines': 0,
+            'decoded': 0,
+            'header_only': 0,
+            'skipped': 0,
+            'oversized': 0,
+            'truncated': 0,
+            'errors': 0,
+        }
+
+    def decode(self, line: bytes) -> Optional[Tuple[str, Any]]:
+        """
+        解码一行
+
+        Returns:
+            (记录类型, 记录字典或记录对象) 或 None（跳过）
+        """
+        self.stats['lines'] += 1
+
+        truncated = isinstance(line, OversizedLine)
+        if truncated:
+            self.stats['truncated'] += 1
+
+        record_type = classify(line)
+        if record_type is None or record_type not in self.record_types:
+            self.stats['skipped'] += 1
+            return None
+
+        schema = self.schemas.get(record_type)
+
+        fields = self.header_fields.get(record_type)
+        if fields is not None:
+            self.stats['header_only'] += 1
+            record = {'type': record_type}
+            for name in fields:
+                value = extract_field(line, name)
+                if value is not None:
+                    record[name] = value
+            if schema is not None:
+                record = schema.convert(record)
+            return record_type, record
+
+        if truncated or len(line) > self.max_record_bytes:
+            self.stats['oversized'] += 1
+            return None
+
+        try:
+            if schema is not None:
+                record = schema.decode(line)
+            else:
+                record = self.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError('expected JSON object')
+        except ValueError:
+            self.stats['errors'] += 1
+            return None
+
+        self.stats['decoded'] += 1
+        return record_type, record
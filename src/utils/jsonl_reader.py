@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+JSONL 增量读取工具
+
+JsonlTailReader：二进制增量尾读器
+- 每个文件保持一个打开的句柄
+- 只读取 [offset, EOF) 区间，按大块读取
+- 不完整的尾行保存在每个文件的缓冲区中，等待下次补全
+- offset 只按实际消费的完整行前进（不会丢行、不会跳字节）
+- 按 (device, inode) 跟踪文件身份：新建 / 截断 / 替换 / 删除时重置或清除状态
+- 超过 max_line_bytes 的行不会被完整读入内存：只保留前缀（OversizedLine），
+  其余部分在磁盘上流式跳过，峰值内存与最大单行无关
+
+read_tail_lines / find_last_line：从 EOF 按固定大小的块反向读取
+- 只读取尾部，启动开销为 O(尾部) 而不是 O(文件)
+- 也接受压缩归档（.jsonl.gz / .jsonl.zst）：seekable zstd 同样反向读取（只解压尾部的帧），
+  不支持随机访问的归档顺序解压一遍，只保留尾部
+"""
+
+import os
+from collections import deque
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .archive_reader import has_random_access, is_archive, open_transcript
+
+# 反向读取的块大小
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+# 超长行保留的前缀大小（用于预分类和提取头部字段）
+DEFAULT_PREFIX_BYTES = 64 * 1024
+
+# 文件生命周期变化（JsonlTailReader.check 的返回值）
+FILE_UNCHANGED = 'unchanged'
+FILE_CREATED = 'created'
+FILE_TRUNCATED = 'truncated'
+FILE_REPLACED = 'replaced'
+FILE_DELETED = 'deleted'
+
+
+class OversizedLine(bytes):
+    """超过 max_line_bytes 的行：内容只是前缀，size 为整行的实际字节数"""
+
+    def __new__(cls, prefix: bytes, size: int):
+        line = super().__new__(cls, prefix)
+        line.size = size
+        return line
+
+
+class JsonlTailReader:
+    """JSONL 二进制增量尾读器"""
+
+    # 单次 read() 的块大小
+    DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_line_bytes: Optional[int] = None,
+                 prefix_bytes: int = DEFAULT_PREFIX_BYTES,
+                 opener: Optional[Callable[[str], BinaryIO]] = None):
+        self.chunk_size = chunk_size
+        # 单行最多读入内存的字节数（None 表示不限制）
+        self.max_line_bytes = max_line_bytes or None
+        self.prefix_bytes = prefix_bytes
+        # 打开文件的函数（默认二进制打开；批量路径传入 open_transcript 以读取压缩归档）
+        self.opener = opener
+
+        # 已消费的字节位置（最后一个完整行之后）
+        self.offsets: Dict[str, int] = {}
+
+        # 每个文件的打开句柄
+        self._handles: Dict[str, BinaryIO] = {}
+
+        # 不完整的尾行缓冲
+        self._partials: Dict[str, bytes] = {}
+
+        # 正在跳过的超长行：(前缀, 已读取的字节数)
+        self._skipping: Dict[str, Tuple[bytes, int]] = {}
+
+        # 文件身份：(device, inode)
+        self.identities: Dict[str, Tuple[int, int]] = {}
+
+    def set_offset(self, file_path: str, offset: int):
+        """设置读取位置（丢弃未完成的尾行缓冲）"""
+        self.offsets[file_path] = offset
+        self._partials.pop(file_path, None)
+        self._skipping.pop(file_path, None)
+
+        handle = self._handles.get(file_path)
+        if handle is not None:
+            handle.seek(offset)
+
+    def check(self, file_path: str) -> str:
+        """
+        比较文件身份和大小，必要时重置读取位置（在 read_new_lines 之前调用）
+
+        - 第一次见到且没有读取位置：新文件，从 0 开始读
+        - inode 变化：文件被替换（重写 / 轮转），关闭旧句柄，从 0 开始读
+        - 大小小于已消费位置：文件被截断，从 0 开始读
+        - 文件不存在：清除该文件的所有状态
+
+        Returns:
+            FILE_UNCHANGED / FILE_CREATED / FILE_TRUNCATED / FILE_REPLACED / FILE_DELETED
+        """
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            if file_path not in self.offsets and file_path not in self.identities:
+                return FILE_UNCHANGED
+            self.forget(file_path)
+            return FILE_DELETED
+
+        identity = (st.st_dev, st.st_ino)
+        known = self.identities.get(file_path)
+        self.identities[file_path] = identity
+
+        if known is None and file_path not in self.offsets:
+            self.set_offset(file_path, 0)
+            return FILE_CREATED
+
+        if known is not None and known != identity:
+            self.close(file_path)
+            self.set_offset(file_path, 0)
+            return FILE_REPLACED
+
+        consumed = self.offsets.get(file_path, 0) + self._pending(file_path)
+        if st.st_size < consumed:
+            self.set_offset(file_path, 0)
+            return FILE_TRUNCATED
+
+        return FILE_UNCHANGED
+
+    def forget(self, file_path: str):
+        """关闭句柄并清除文件的读取位置、尾行缓冲和身份"""
+        self.close(file_path)
+        self.offsets.pop(file_path, None)
+        self.identities.pop(file_path, None)
+
+    def read_new_lines(self, file_path: str) -> List[bytes]:
+        """
+        读取新增的完整行
+
+        Returns:
+            完整行列表（bytes，不含换行符）
+        """
+        return self.read_lines(file_path)[0]
+
+    def read_lines(self, file_path: str, max_bytes: Optional[int] = None) -> Tuple[List[bytes], bool]:
+        """
+        读取新增的完整行，单次最多读取约 max_bytes 字节（按块对齐）
+
+        Returns:
+            (完整行列表, 是否因达到 max_bytes 而提前停止)
+        """
+        handle = self._get_handle(file_path)
+
+        limit = self.max_line_bytes
+        lines: List[bytes] = []
+        buffer = bytearray(self._partials.pop(file_path, b''))
+        skipping = self._skipping.pop(file_path, None)
+        read_bytes = 0
+        more = False
+
+        while True:
+            if max_bytes is not None and read_bytes >= max_bytes:
+                more = True
+                break
+
+            chunk = handle.read(self.chunk_size)
+            if not chunk:
+                break
+            read_bytes += len(chunk)
+            start = 0
+
+            # 正在跳过超长行：丢弃到下一个换行符为止
+            if skipping is not None:
+                index = chunk.find(b'\n')
+                if index < 0:
+                    skipping = (skipping[0], skipping[1] + len(chunk))
+                    continue
+                lines.append(OversizedLine(skipping[0], skipping[1] + index))
+                skipping = None
+                start = index + 1
+
+            # 只切分到最后一个换行符，剩余部分留作下次
+            end = chunk.rfind(b'\n', start)
+            if end < 0:
+                buffer += chunk[start:]
+            else:
+                buffer += chunk[start:end]
+                parts = bytes(buffer).split(b'\n')
+                if limit is not None:
+                    parts = [part if len(part) <= limit else OversizedLine(part[:self.prefix_bytes], len(part))
+                             for part in parts]
+                lines.extend(parts)
+                buffer = bytearray(chunk[end + 1:])
+
+            # 未完成的行超过上限：只保留前缀，之后的内容不再读入内存
+            if limit is not None and len(buffer) > limit:
+                skipping = (bytes(buffer[:self.prefix_bytes]), len(buffer))
+                buffer = bytearray()
+
+        if buffer:
+            self._partials[file_path] = bytes(buffer)
+        if skipping is not None:
+            self._skipping[file_path] = skipping
+
+        # 已消费位置 = 句柄位置 - 尚未完成的行
+        self.offsets[file_path] = handle.tell() - self._pending(file_path)
+
+        return lines, more
+
+    def close(self, file_path: str):
+        """关闭单个文件句柄"""
+        handle = self._handles.pop(file_path, None)
+        self._partials.pop(file_path, None)
+        self._skipping.pop(file_path, None)
+        if handle is not None:
+            handle.close()
+
+    def close_all(self):
+        """关闭所有句柄"""
+        for file_path in list(self._handles):
+            self.close(file_path)
+
+    def _get_handle(self, file_path: str) -> BinaryIO:
+        """获取（或打开）文件句柄，并定位到已消费位置之后"""
+        handle = self._handles.get(file_path)
+        if handle is None:
+            handle = self.opener(file_path) if self.opener else open(file_path, 'rb')
+            self._handles[file_path] = handle
+
+            handle.seek(self.offsets.get(file_path, 0) + self._pending(file_path))
+
+        return handle
+
+    def _pending(self, file_path: str) -> int:
+        """已读取但尚未完成的行的字节数（尾行缓冲或正在跳过的超长行）"""
+        skipping = self._skipping.get(file_path)
+        if skipping is not None:
+            return skipping[1]
+        return len(self._partials.get(file_path, b''))
+
+
+def read_tail_lines(file_path: str, count: int,
+                    block_size: int = DEFAULT_BLOCK_SIZE) -> Tuple[List[bytes], int]:
+    """
+    从 EOF 反向读取最后 count 个完整行
+
+    Returns:
+        (行列表（从旧到新，不含空行）, 最后一个完整行之后的字节位置)
+    """
+    if is_archive(file_path) and not has_random_access(file_path):
+        tail: deque = deque(maxlen=count)
+        end = 0
+        for _, line, end in _iter_stream_lines(file_path):
+            if line.strip():
+                tail.append(line)
+        return list(tail), end
+
+    with open_transcript(file_path) as f:
+        end = _find_tail_end(f, block_size)
+
+        lines: List[bytes] = []
+        for line in _iter_reverse_lines(f, end, block_size):
+            if line.strip():
+                lines.append(line)
+                if len(lines) >= count:
+                    break
+
+    lines.reverse()
+    return lines, end
+
+
+def find_last_line(file_path: str, predicate: Callable[[bytes], bool],
+                   max_bytes: Optional[int] = None,
+                   block_size: int = DEFAULT_BLOCK_SIZE) -> Optional[bytes]:
+    """
+    从 EOF 反向查找最后一个满足条件的完整行
+
+    Args:
+        predicate: 行判断函数
+        max_bytes: 最多向前扫描的字节数（None 表示不限制）
+
+    Returns:
+        匹配的行，或 None
+    """
+    if is_archive(file_path) and not has_random_access(file_path):
+        # 顺序解压：记录最后一个匹配行，扫描结束后再按 max_bytes 判断是否在范围内
+        found: Optional[Tuple[int, bytes]] = None
+        end = 0
+        for start, line, end in _iter_stream_lines(file_path):
+            if line.strip() and predicate(line):
+                found = (start, line)
+        if found is None or (max_bytes is not None and found[0] < end - max_bytes):
+            return None
+        return found[1]
+
+    with open_transcript(file_path) as f:
+        end = _find_tail_end(f, block_size)
+        start = 0 if max_bytes is None else max(0, end - max_bytes)
+
+        for line in _iter_reverse_lines(f, end, block_size, start):
+            if line.strip() and predicate(line):
+                return line
+
+    return None
+
+
+def _iter_stream_lines(file_path: str) -> Iterator[Tuple[int, bytes, int]]:
+    """
+    顺序解压并逐行产出 (行首位置, 行, 已产出的最后一个完整行之后的位置)
+
+    用于不支持随机访问的归档；不完整的尾行不会产出
+    """
+    reader = JsonlTailReader(opener=open_transcript)
+    pos = 0
+    try:
+        while True:
+            lines, more = reader.read_lines(file_path, max_bytes=reader.chunk_size)
+            for line in lines:
+                size = line.size if isinstance(line, OversizedLine) else len(line)
+                yield pos, line, pos + size + 1
+                pos += size + 1
+            if not more:
+                break
+    finally:
+        reader.close_all()
+
+
+def _find_tail_end(f: BinaryIO, block_size: int) -> int:
+    """定位最后一个换行符之后的位置（忽略不完整的尾行）"""
+    pos = f.seek(0, os.SEEK_END)
+
+    while pos > 0:
+        read_size = min(block_size, pos)
+        pos -= read_size
+        f.seek(pos)
+        index = f.read(read_size).rfind(b'\n')
+        if index >= 0:
+            return pos + index + 1
+
+    return 0
+
+
+def _iter_reverse_lines(f: BinaryIO, end: int, block_size: int,
+                        start: int = 0) -> Iterator[bytes]:
+    """从 end 向前逐行产出（从新到旧），读到 start 为止"""
+    pos = end
+    # 当前块之后、尚未遇到行首的片段（逆序保存，避免反复拼接大行）
+    pending: List[bytes] = []
+
+    while pos > start:
+        read_size = min(block_size, pos - start)
+        pos -= read_size
+        f.seek(pos)
+        block = f.read(read_size)
+
+        index = block.rfind(b'\n')
+        if index < 0:
+            pending.append(block)
+            continue
+
+        pending.append(block[index + 1:])
+        yield b''.join(reversed(pending))
+
+        parts = block[:index].split(b'\n')
+        for part in reversed(parts[1:]):
+            yield part
+        pending = [parts[0]]
+
+    # 到达扫描起点：只有从文件开头读起时，剩余片段才是完整行
+    if start == 0 and pending:
+        yield b''.join(reversed(pending))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+LoopLagMonitor - 事件循环延迟监控
+
+定期 sleep(interval)，实际唤醒时间与预期的差值即为循环延迟
+（期间有同步代码占用循环线程时延迟会变大）。
+保留最近 window 个样本，报告 p50 / p99 / 最大值和卡顿次数。
+"""
+
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+class LoopLagMonitor:
+    """事件循环延迟监控器"""
+
+    def __init__(self, interval: float = 0.1, window: int = 600, stall_threshold: float = 0.05):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+
+        self.samples: Deque[float] = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+        # 统计（整个运行期间）
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    def start(self):
+        """启动监控任务"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """停止监控任务"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def reset(self):
+        """清空样本和统计"""
+        self.samples.clear()
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    def get_stats(self) -> Dict[str, float]:
+        """获取统计信息（毫秒）"""
+        samples = sorted(self.samples)
+        count = len(samples)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(int(count * p), count - 1)] * 1000, 3)
+
+        return {
+            'samples': count,
+            'interval_ms': self.interval * 1000,
+            'lag_p50_ms': percentile(0.50),
+            'lag_p99_ms': percentile(0.99),
+            'lag_max_ms': round(self.max_lag * 1000, 3),
+            'stalls': self.stalls,
+        }
+
+    async def _run(self):
+        """测量循环"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            expected = loop.time() + self.interval
+            try:
+                await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                break
+
+            lag = max(loop.time() - expected, 0.0)
+            self.samples.append(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag > self.stall_threshold:
+                self.stalls += 1
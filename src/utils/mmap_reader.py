@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+MmapLineReader - 冷 transcript 的内存映射批量读取
+
+用于启动时的初始状态扫描和历史回填等批量路径（实时尾读仍使用 JsonlTailReader）：
+- 整个文件只读映射，按换行符在映射缓冲区上切分，不经过文件对象和逐行 read()
+- 产出的行是映射上的 memoryview 切片，不复制（解码器的预分类、orjson / msgspec 可直接处理）
+- 支持从 EOF 反向逐行扫描（初始状态只需要尾部几行）
+- 超过 max_line_bytes 的行只复制前缀（OversizedLine），与 JsonlTailReader 的语义一致
+- 页面由内核按需换入；顺序扫描时提示内核预读，并定期释放已扫描区间的映射页，
+  峰值 RSS 与文件大小无关
+
+注意：
+- 产出的 memoryview 只应在映射打开期间使用，需要保留的行请用 bytes(line) 复制
+  （仍被引用的切片会推迟映射的释放）
+- 映射长度在打开时固定：之后的追加不可见；只用于追加写入的 transcript
+  （映射期间文件被截断时访问越界页面会触发 SIGBUS）
+"""
+
+import mmap
+import os
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from .jsonl_reader import DEFAULT_PREFIX_BYTES, OversizedLine
+
+# 顺序扫描时每前进这么多字节，释放一次已扫描区间的映射页
+RELEASE_BYTES = 32 * 1024 * 1024
+
+
+class MmapLineReader:
+    """内存映射 JSONL 读取器"""
+
+    def __init__(self, file_path: str, max_line_bytes: Optional[int] = None,
+                 prefix_bytes: int = DEFAULT_PREFIX_BYTES):
+        self.file_path = file_path
+        self.max_line_bytes = max_line_bytes or None
+        self.prefix_bytes = prefix_bytes
+
+        self.size = 0
+        self._mmap: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+
+    def open(self) -> 'MmapLineReader':
+        """映射整个文件（空文件不映射）"""
+        if self._mmap is not None:
+            return self
+
+        with open(self.file_path, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size == 0:
+                return self
+            # 映射建立后即可关闭文件描述符
+            self._mmap = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ)
+
+        self._view = memoryview(self._mmap)
+        return self
+
+    def close(self):
+        """释放映射（仍有切片被引用时，映射在最后一个切片释放后由解释器回收）"""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+
+    def __enter__(self) -> 'MmapLineReader':
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def tail_end(self) -> int:
+        """最后一个换行符之后的位置（不完整的尾行不计入）"""
+        if self._mmap is None:
+            return 0
+        return self._mmap.rfind(b'\n') + 1
+
+    def iter_lines(self, start: int = 0, end: Optional[int] = None) -> Iterator[memoryview]:
+        """
+        顺序产出 [start, end) 区间内的完整行（不含换行符，跳过空行）
+
+        Args:
+            start: 起始位置（必须是行首）
+            end: 结束位置（默认为最后一个完整行之后）
+        """
+        if self._mmap is None:
+            return
+
+        mm, view = self._mmap, self._view
+        end = self.tail_end() if end is None else end
+        limit = self.max_line_bytes
+
+        # 按页对齐：提示内核顺序预读
+        released = start - start % mmap.PAGESIZE
+        if hasattr(mmap, 'MADV_SEQUENTIAL') and end > released:
+            mm.madvise(mmap.MADV_SEQUENTIAL, released, end - released)
+        can_release = hasattr(mmap, 'MADV_DONTNEED')
+
+        find = mm.find
+        pos = start
+        while pos < end:
+            # 已扫描的区间移出进程页表（只读文件映射：数据仍在页缓存中，再次访问时重新映射），
+            # 映射页不会累积到 RSS 中
+            if can_release and pos - released >= RELEASE_BYTES:
+                boundary = pos - pos % mmap.PAGESIZE
+                mm.madvise(mmap.MADV_DONTNEED, released, boundary - released)
+                released = boundary
+
+            newline = find(b'\n', pos, end)
+            if newline < 0:
+                newline = end
+            if newline > pos:
+                if limit is not None and newline - pos > limit:
+                    yield OversizedLine(view[pos:pos + self.prefix_bytes].tobytes(), newline - pos)
+                else:
+                    yield view[pos:newline]
+            pos = newline + 1
+
+    def iter_reverse_lines(self, end: Optional[int] = None, start: int = 0) -> Iterator[memoryview]:
+        """
+        从 end 向前逐行产出（从新到旧，跳过空行），读到 start 为止
+
+        start 不为 0 时，start 所在的不完整行不会产出
+        """
+        if self._mmap is None:
+            return
+
+        mm, view = self._mmap, self._view
+        pos = self.tail_end() if end is None else end
+        # end 位于行首：最后一个换行符属于上一行
+        if pos > start and mm[pos - 1:pos] == b'\n':
+            pos -= 1
+
+        rfind = mm.rfind
+        while pos > start:
+            newline = rfind(b'\n', start, pos)
+            if newline < 0:
+                if start == 0:
+                    yield view[0:pos]
+                return
+            if pos > newline + 1:
+                yield view[newline + 1:pos]
+            pos = newline
+
+    def tail_lines(self, count: int) -> Tuple[List[bytes], int]:
+        """
+        最后 count 个完整行（复制为 bytes）
+
+        Returns:
+            (行列表（从旧到新）, 最后一个完整行之后的字节位置)
+        """
+        end = self.tail_end()
+        lines: List[bytes] = []
+        for line in self.iter_reverse_lines(end):
+            data = line.tobytes()
+            if data.strip():
+                lines.append(data)
+                if len(lines) >= count:
+                    break
+
+        lines.reverse()
+        return lines, end
+
+    def find_last(self, predicate: Callable[[memoryview], bool],
+                  max_bytes: Optional[int] = None) -> Optional[bytes]:
+        """从 EOF 反向查找最后一个满足条件的完整行（最多向前扫描 max_bytes 字节）"""
+        end = self.tail_end()
+        start = 0 if max_bytes is None else max(0, end - max_bytes)
+
+        for line in self.iter_reverse_lines(end, start):
+            if predicate(line):
+                return line.tobytes()
+        return None
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+StatPoller - 自适应 stat 轮询（无可靠文件通知时的尾读模式）
+
+bind mount、容器卷、网络文件系统上 inotify / watchdog 通知可能缺失或延迟。
+
+- 每轮只 stat 热文件（最近有变化的文件），按 (mtime_ns, size) 签名判断变化，
+  并 scandir 热文件所在目录以发现新文件
+- 定期用 scandir 遍历整个目录，发现新文件并检查冷文件
+- 已知文件来自与监控器共用的读取位置表（offsets），新文件从位置 0 开始
+- 轮询间隔自适应：有变化时回到最小间隔，空闲时指数退避到最大间隔
+- 记录每轮的 CPU 时间
+- 每轮检查在 I/O 线程池中执行：读取位置表在事件循环中复制后传入，
+  轮询器自身的状态只由串行执行的检查修改
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# 文件签名：(mtime_ns, size)
+Signature = Tuple[int, int]
+
+
+class StatPoller:
+    """自适应 stat 轮询器"""
+
+    def __init__(self, root: str, offsets: Dict[str, int],
+                 on_change: Callable[[str], None],
+                 min_interval: float = 0.25,
+                 max_interval: float = 5.0,
+                 hot_seconds: float = 600.0,
+                 discovery_interval: float = 30.0,
+                 suffix: str = '.jsonl',
+                 io_executor: Optional[Executor] = None):
+        self.root = root
+        self.offsets = offsets
+        self.on_change = on_change
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.hot_seconds = hot_seconds
+        self.discovery_interval = discovery_interval
+        self.suffix = suffix
+        # 执行检查的线程池（None 为事件循环的默认线程池）
+        self.io_executor = io_executor
+
+        self.interval = min_interval
+
+        # 上次看到的文件签名
+        self._signatures: Dict[str, Signature] = {}
+        # 热文件 → 最后变化时间（time.time()，与 mtime 可比）
+        self._hot: Dict[str, float] = {}
+        self._last_discovery = 0.0
+
+        self._task: Optional[asyncio.Task] = None
+
+        # 统计
+        self.cycles = 0
+        self.discoveries = 0
+        self.changes = 0
+        self.stats_calls = 0
+        self.last_cycle_cpu = 0.0
+        self.total_cycle_cpu = 0.0
+
+    def start(self):
+        """启动自适应轮询任务"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """停止轮询任务"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def polling(self) -> bool:
+        """是否正在自适应轮询"""
+        return self._task is not None
+
+    def get_stats(self) -> Dict[str, float]:
+        """获取统计信息"""
+        return {
+            'cycles': self.cycles,
+            'discoveries': self.discoveries,
+            'changes': self.changes,
+            'stat_calls': self.stats_calls,
+            'hot_files': len(self._hot),
+            'interval': self.interval,
+            'last_cycle_cpu_us': round(self.last_cycle_cpu * 1e6, 1),
+            'avg_cycle_cpu_us': round(self.total_cycle_cpu / self.cycles * 1e6, 1) if self.cycles else 0.0,
+        }
+
+    def mtime(self, path: str) -> Optional[float]:
+        """上次看到的修改时间（秒）"""
+        signature = self._signatures.get(path)
+        return None if signature is None else signature[0] / 1e9
+
+    async def poll(self) -> List[str]:
+        """在线程池中执行一轮检查（不阻塞事件循环）"""
+        offsets = dict(self.offsets)
+        return await asyncio.get_running_loop().run_in_executor(self.io_executor, self.poll_once, offsets)
+
+    def poll_once(self, offsets: Optional[Dict[str, int]] = None) -> List[str]:
+        """
+        执行一轮检查（热文件 stat；到期时遍历整个目录）
+
+        Args:
+            offsets: 读取位置表的副本（在线程中执行时传入，默认直接读取共享的位置表）
+
+        Returns:
+            有变化的文件路径列表
+        """
+        offsets = self.offsets if offsets is None else offsets
+        cpu_start = time.thread_time()
+        now = time.time()
+        changed: List[str] = []
+
+        if now - self._last_discovery >= self.discovery_interval:
+            self._last_discovery = now
+            self.discoveries += 1
+            changed.extend(self._discover(now, offsets))
+        else:
+            # 热文件 + 读取位置表中尚未见过的文件（由监控器或处理函数新加入）
+            paths = list(self._hot)
+            paths.extend(path for path in offsets if path not in self._signatures)
+            # 热文件所在目录中新出现的文件（新会话通常出现在同一项目目录）
+            paths.extend(self._new_files({os.path.dirname(path) for path in self._hot}))
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # 已删除：记录占位签名，下次目录遍历时清理；已读取过的文件按变化报告
+                    self._hot.pop(path, None)
+                    self._signatures[path] = (0, -1)
+                    if path in offsets:
+                        changed.append(path)
+                    continue
+                self.stats_calls += 1
+                if self._check(path, st, now, offsets):
+                    changed.append(path)
+
+        # 长时间无变化的文件移出热集合（由目录遍历兜底）
+        for path, changed_at in list(self._hot.items()):
+            if now - changed_at > self.hot_seconds:
+                del self._hot[path]
+
+        self.cycles += 1
+        self.changes += len(changed)
+        self.last_cycle_cpu = time.thread_time() - cpu_start
+        self.total_cycle_cpu += self.last_cycle_cpu
+        return changed
+
+    async def _run(self):
+        """自适应轮询循环"""
+        while True:
+            try:
+                changed = await self.poll()
+                for path in changed:
+                    self.on_change(path)
+
+                if changed:
+                    self.interval = self.min_interval
+                else:
+                    self.interval = min(self.interval * 2, self.max_interval)
+
+                await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"[StatPoller] Poll error: {e}")
+                await asyncio.sleep(self.max_interval)
+
+    def _check(self, path: str, st: os.stat_result, now: float, offsets: Dict[str, int]) -> bool:
+        """比较签名，更新热集合"""
+        signature = (st.st_mtime_ns, st.st_size)
+        previous = self._signatures.get(path)
+        self._signatures[path] = signature
+
+        if previous is None:
+            # 第一次看到：与读取位置比较（新文件从 0 开始）
+            changed = st.st_size != offsets.get(path, 0)
+            if changed or now - st.st_mtime <= self.hot_seconds:
+                self._hot[path] = st.st_mtime
+            return changed
+
+        if signature == previous:
+            return False
+
+        self._hot[path] = now
+        return True
+
+    def _new_files(self, directories: Set[str]) -> List[str]:
+        """列出目录中尚未见过的文件"""
+        paths: List[str] = []
+        for directory in directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(self.suffix) and entry.path not in self._signatures:
+                            paths.append(entry.path)
+            except OSError:
+                pass
+        return paths
+
+    def _discover(self, now: float, offsets: Dict[str, int]) -> List[str]:
+        """scandir 遍历整个目录：发现新文件并检查所有文件"""
+        changed: List[str] = []
+        seen = set()
+        pending = [self.root]
+
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                            elif entry.name.endswith(self.suffix):
+                                st = entry.stat()
+                                self.stats_calls += 1
+                                seen.add(entry.path)
+                                if self._check(entry.path, st, now, offsets):
+                                    changed.append(entry.path)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+
+        # 已删除的文件（已读取过的按变化报告）
+        for path in [p for p in self._signatures if p not in seen]:
+            self._signatures.pop(path, None)
+            self._hot.pop(path, None)
+            if path in offsets:
+                changed.append(path)
+
+        return changed
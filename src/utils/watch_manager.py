@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+HotSetWatchManager - 热目录监控管理（inotify watch 预算）
+
+递归监控 ~/.claude/projects 会给历史上每个项目 / 会话 / subagents 目录都加 watch，
+长期使用后会耗尽 fs.inotify.max_user_watches，启动也越来越慢。
+
+- 根目录始终监控（新项目目录立即可见）
+- 只监控最近活跃的 N 个目录（热集合，LRU），N 为 watch 预算
+- 新建目录、出现新文件的目录被提升为热目录；超出预算或长时间无活动的目录被降级
+- 冷目录由定期的 scandir 扫描兜底：比较 *.jsonl 的 (mtime, size) 快照，
+  有变化时报告文件并提升该目录
+- 所有 scandir / stat 都在 I/O 线程池中执行，线程中只读取文件系统并返回结果，
+  热集合、快照等状态只在事件循环中修改
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .inotify_watcher import InotifyWatcher
+
+# 冷目录快照：文件名 → (mtime_ns, size)
+Snapshot = Dict[str, Tuple[int, int]]
+
+# 冷目录扫描结果：(快照, 子目录列表)，目录已删除时为 None
+Listing = Optional[Tuple[Snapshot, List[str]]]
+
+
+class HotSetWatchManager:
+    """热目录监控管理器"""
+
+    def __init__(self, root: str, on_change: Callable[[str], None],
+                 budget: int = 128,
+                 idle_seconds: float = 1800.0,
+                 sweep_interval: float = 5.0,
+                 suffix: str = '.jsonl',
+                 on_overflow: Optional[Callable[[], None]] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None,
+                 io_executor: Optional[Executor] = None):
+        self.root = root
+        self.on_change = on_change
+        self.budget = max(budget, 1)
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        self.suffix = suffix
+        self.loop = loop or asyncio.get_running_loop()
+        # 目录扫描使用的线程池（None 为事件循环的默认线程池）
+        self.io_executor = io_executor
+
+        self.watcher = InotifyWatcher(
+            root,
+            on_change=self._on_file_change,
+            suffix=suffix,
+            on_overflow=on_overflow,
+            recursive=False,
+            on_directory=self._on_new_directory,
+            loop=self.loop
+        )
+
+        # 根目录以下的所有已知目录
+        self._known: Set[str] = set()
+        # 热目录 → 最后活动时间（monotonic），按活动时间排序（LRU）
+        self._hot: 'OrderedDict[str, float]' = OrderedDict()
+        # 冷目录快照
+        self._snapshots: Dict[str, Snapshot] = {}
+        # 正在线程池中记录快照的目录（扫描时跳过）
+        self._pending: Set[str] = set()
+
+        self._sweep_task: Optional[asyncio.Task] = None
+        # 后台扫描任务（新目录补报、降级快照）
+        self._tasks: Set[asyncio.Task] = set()
+
+        # 统计
+        self.promotions = 0
+        self.demotions = 0
+        self.sweeps = 0
+        self.sweep_hits = 0
+        self.last_sweep_seconds = 0.0
+
+    async def start(self):
+        """监控根目录，提升最近活跃的目录，并启动冷目录扫描"""
+        self.watcher.start()
+
+        # 按最近活动时间排序，最新的 budget 个目录直接监控
+        activity = await self._run_io(self._scan_tree)
+        self._known.update(activity)
+        ranked = sorted(activity.items(), key=lambda item: item[1], reverse=True)
+        now_wall, now = time.time(), time.monotonic()
+
+        for directory, mtime in reversed(ranked[:self.budget]):
+            self._promote(directory, now - max(now_wall - mtime, 0.0))
+
+        cold = [directory for directory, _ in ranked[self.budget:]]
+        snapshots = await self._run_io(self._snapshot_all, cold)
+        for directory, snapshot in snapshots.items():
+            if directory not in self._hot:
+                self._snapshots.setdefault(directory, snapshot)
+
+        self._sweep_task = self.loop.create_task(self._sweep_loop())
+
+    async def close(self):
+        """停止扫描并关闭 inotify"""
+        tasks = list(self._tasks)
+        if self._sweep_task:
+            tasks.append(self._sweep_task)
+            self._sweep_task = None
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        self.watcher.close()
+        self._hot.clear()
+        self._snapshots.clear()
+
+    def get_stats(self) -> Dict[str, float]:
+        """获取统计信息"""
+        return {
+            'hot': len(self._hot),
+            'cold': len(self._known) - len(self._hot),
+            'budget': self.budget,
+            'promotions': self.promotions,
+            'demotions': self.demotions,
+            'sweeps': self.sweeps,
+            'sweep_hits': self.sweep_hits,
+            'last_sweep_ms': round(self.last_sweep_seconds * 1000, 3),
+            **self.watcher.get_stats(),
+        }
+
+    def _on_file_change(self, path: str):
+        """热目录中的文件变化：刷新目录活动时间并转发"""
+        directory = os.path.dirname(path)
+        if directory != self.root:
+            self._promote(directory)
+        self.on_change(path)
+
+    def _on_new_directory(self, directory: str):
+        """监控中的目录下新建了子目录：提升，并在线程池中列出其中已有的内容后补报"""
+        self._known.add(directory)
+        self._promote(directory)
+        self._spawn(self._report_tree(directory))
+
+    async def _report_tree(self, directory: str):
+        """补报新目录下已有的子目录和文件"""
+        directories, files = await self._run_io(self._walk, directory)
+        for path in directories:
+            if path not in self._known:
+                self._known.add(path)
+                self._promote(path)
+        for path in files:
+            self.on_change(path)
+
+    def _promote(self, directory: str, active_at: Optional[float] = None):
+        """提升为热目录（已是热目录时只刷新活动时间）"""
+        active_at = time.monotonic() if active_at is None else active_at
+
+        if directory in self._hot:
+            self._hot[directory] = active_at
+            self._hot.move_to_end(directory)
+            return
+
+        if not self.watcher.watch(directory):
+            # 无法监控（目录已删除 / 达到系统上限）：留在冷集合
+            if directory in self._known and directory not in self._snapshots:
+                self._make_cold(directory, unwatch=False)
+            return
+
+        self._snapshots.pop(directory, None)
+        self._hot[directory] = active_at
+        self.promotions += 1
+
+        while len(self._hot) > self.budget:
+            self._demote(next(iter(self._hot)))
+
+    def _demote(self, directory: str):
+        """降级为冷目录（watch 保留到快照记录完成，中间的写入不会丢失）"""
+        self._hot.pop(directory, None)
+        self.demotions += 1
+        self._make_cold(directory, unwatch=True)
+
+    def _make_cold(self, directory: str, unwatch: bool):
+        """在线程池中记录快照，完成后移入冷集合"""
+        if directory not in self._pending:
+            self._pending.add(directory)
+            self._spawn(self._finish_cold(directory, unwatch))
+
+    async def _finish_cold(self, directory: str, unwatch: bool):
+        try:
+            snapshot = await self._run_io(self._snapshot, directory)
+        finally:
+            self._pending.discard(directory)
+
+        # 等待期间重新变为热目录：保留 watch
+        if directory in self._hot:
+            return
+        self._snapshots[directory] = snapshot
+        if unwatch:
+            self.watcher.unwatch(directory)
+
+    async def _sweep_loop(self):
+        """定期降级空闲目录并扫描冷目录"""
+        while True:
+            try:
+                await asyncio.sleep(self.sweep_interval)
+                await self._sweep()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"[HotSetWatchManager] Sweep error: {e}")
+
+    async def _sweep(self):
+        """一次扫描（目录读取在线程池中执行，比较和状态更新在事件循环中执行）"""
+        start = time.perf_counter()
+        self.sweeps += 1
+
+        # 已被内核移除的热目录；空闲的热目录待降级
+        now = time.monotonic()
+        idle: Dict[str, float] = {}
+        for directory, active_at in list(self._hot.items()):
+            if not self.watcher.is_watching(directory):
+                self._hot.pop(directory, None)
+                self._known.discard(directory)
+            elif now - active_at > self.idle_seconds:
+                idle[directory] = active_at
+
+        cold = [d for d in self._known if d not in self._hot and d not in self._pending]
+        snapshots, listings = await self._run_io(self._read_directories, list(idle), cold)
+
+        # 降级空闲目录（先记录快照再移除 watch；等待期间又有活动的目录保留）
+        for directory, snapshot in snapshots.items():
+            if self._hot.get(directory) == idle[directory]:
+                self._hot.pop(directory)
+                self._snapshots[directory] = snapshot
+                self.watcher.unwatch(directory)
+                self.demotions += 1
+
+        # 比较冷目录快照
+        for directory, listing in listings.items():
+            if directory not in self._hot and directory not in self._pending:
+                self._sweep_directory(directory, listing)
+
+        self.last_sweep_seconds = time.perf_counter() - start
+
+    def _sweep_directory(self, directory: str, listing: Listing):
+        """比较冷目录快照，报告变化的文件"""
+        if listing is None:
+            # 目录已删除
+            self._known.discard(directory)
+            self._snapshots.pop(directory, None)
+            return
+
+        current, subdirectories = listing
+        previous = self._snapshots.get(directory, {})
+        changed = [name for name, signature in current.items() if previous.get(name) != signature]
+        # 已删除的文件
+        changed.extend(name for name in previous if name not in current)
+        self._snapshots[directory] = current
+
+        if changed:
+            self.sweep_hits += 1
+            self._promote(directory)
+            for name in changed:
+                self.on_change(os.path.join(directory, name))
+
+        for path in subdirectories:
+            if path not in self._known:
+                self._on_new_directory(path)
+
+    async def _run_io(self, func, *args):
+        """在 I/O 线程池中执行目录读取"""
+        return await self.loop.run_in_executor(self.io_executor, func, *args)
+
+    def _spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[HotSetWatchManager] Scan error: {task.exception()}")
+
+    # 以下方法在 I/O 线程中执行：只读取文件系统，不修改管理器状态
+
+    def _scan_tree(self) -> Dict[str, float]:
+        """
+        列出根目录以下的所有目录及其最近活动时间
+
+        有 *.jsonl 的目录取文件的最大 mtime，否则取目录自身的 mtime
+        """
+        activity: Dict[str, float] = {}
+        pending = [self.root]
+
+        while pending:
+            directory = pending.pop()
+            latest = 0.0
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                                activity[entry.path] = entry.stat(follow_symlinks=False).st_mtime
+                            elif entry.name.endswith(self.suffix):
+                                latest = max(latest, entry.stat().st_mtime)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+
+            if latest and directory != self.root:
+                activity[directory] = latest
+
+        return activity
+
+    def _snapshot(self, directory: str) -> Snapshot:
+        """记录目录中 *.jsonl 的 (mtime_ns, size)"""
+        snapshot: Snapshot = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(self.suffix):
+                        try:
+                            st = entry.stat()
+                            snapshot[entry.name] = (st.st_mtime_ns, st.st_size)
+                        except OSError:
+                            pass
+        except OSError:
+            pass
+        return snapshot
+
+    def _snapshot_all(self, directories: List[str]) -> Dict[str, Snapshot]:
+        """记录多个目录的快照"""
+        return {directory: self._snapshot(directory) for directory in directories}
+
+    def _read_directories(self, idle: List[str], cold: List[str]) -> Tuple[Dict[str, Snapshot], Dict[str, Listing]]:
+        """一次扫描的目录读取：空闲热目录的快照，冷目录的快照和子目录"""
+        return self._snapshot_all(idle), {directory: self._list(directory) for directory in cold}
+
+    def _list(self, directory: str) -> Listing:
+        """列出冷目录中 *.jsonl 的 (mtime_ns, size) 和子目录（目录已删除时返回 None）"""
+        current: Snapshot = {}
+        subdirectories: List[str] = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                        elif entry.name.endswith(self.suffix):
+                            st = entry.stat()
+                            current[entry.name] = (st.st_mtime_ns, st.st_size)
+                    except OSError:
+                        pass
+        except OSError:
+            return None
+        return current, subdirectories
+
+    def _walk(self, directory: str) -> Tuple[List[str], List[str]]:
+        """递归列出新目录下的子目录和 *.jsonl 文件"""
+        directories: List[str] = []
+        files: List[str] = []
+        pending = [directory]
+        while pending:
+            try:
+                with os.scandir(pending.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                directories.append(entry.path)
+                                pending.append(entry.path)
+                            elif entry.name.endswith(self.suffix):
+                                files.append(entry.path)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+        return directories, files
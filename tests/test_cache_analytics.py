@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+CacheAnalytics：缓存失效检测和原因推断、按序号拉取事件、HTTP 线程并发查询
+"""
+
+import threading
+
+import pytest
+
+from src.middleware.cache_analytics import CacheAnalytics
+from src.plugins.base import UsageDelta
+
+
+def turn(analytics, i, input, cache_write, cache_read, timestamp, model='opus', session_id='s'):
+    return analytics.apply(UsageDelta(
+        source='test', project='p', session_id=session_id, message_id=f'm{i}', model=model,
+        input=input, cache_write=cache_write, cache_read=cache_read, timestamp=timestamp
+    ))
+
+
+@pytest.fixture
+def analytics():
+    return CacheAnalytics({'window_turns': 3})
+
+
+def test_bust_reasons(analytics):
+    assert turn(analytics, 1, 10, 20000, 0, 0) is None
+    assert turn(analytics, 2, 10, 500, 20000, 10) is None
+
+    event = turn(analytics, 3, 10, 21000, 0, 20)
+    assert event['reason'] == 'prefix_changed'
+    assert event['rewritten_tokens'] == 20500
+    assert turn(analytics, 4, 10, 21000, 0, 20 + 400)['reason'] == 'ttl_expired'
+    assert turn(analytics, 5, 10, 3000, 0, 430)['reason'] == 'context_shrunk'
+    assert turn(analytics, 6, 10, 3000, 0, 440, model='haiku')['reason'] == 'model_changed'
+
+    stats = analytics.get_stats()
+    assert stats['busts'] == 4
+    assert stats['turns'] == 6
+
+
+def test_followup_lines_update_the_turn(analytics):
+    turn(analytics, 1, 10, 100, 900, 0)
+    analytics.apply(UsageDelta(source='test', project='p', session_id='s', message_id='m1',
+                               output=50, new_message=False, timestamp=1))
+    session = analytics.get_session('p', 's')
+    assert session['turns'] == 1
+    assert session['recent_turns'][-1]['output'] == 50
+    assert session['hit_ratio'] == round(900 / 1010, 4)
+
+
+def test_events_since(analytics):
+    turn(analytics, 1, 10, 20000, 0, 0)
+    for i in range(2, 6):
+        turn(analytics, i, 10, 21000, 0, i)
+    events = analytics.get_events(2)
+    assert [event['seq'] for event in events['events']] == [3, 4]
+    assert events['last_seq'] == 4
+
+
+def test_queries_from_another_thread(analytics):
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        while not stop.is_set():
+            try:
+                analytics.get_events()
+                analytics.get_stats(limit=None)
+            except RuntimeError as e:  # deque / dict mutated during iteration
+                errors.append(e)
+                return
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        for i in range(20000):
+            # 每隔一轮缓存前缀被重写，持续产生失效事件
+            turn(analytics, i, 10, 20000, 0 if i % 2 else 20000, i, session_id=f's{i % 50}')
+    finally:
+        stop.set()
+        thread.join()
+    assert not errors
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+检查点热启动：SQLite 读写在 I/O 线程中执行，已删除文件的检查点被清理
+"""
+
+import asyncio
+import json
+import threading
+
+from src.plugins.claude_log import ClaudeLogPlugin
+from src.utils.checkpoint import CheckpointStore
+
+
+def start_and_stop(config):
+    async def main():
+        plugin = ClaudeLogPlugin(config)
+        await plugin.start()
+        await plugin.stop()
+        return plugin
+
+    return asyncio.run(main())
+
+
+def test_resume_runs_sqlite_off_loop(tmp_path, monkeypatch):
+    projects = tmp_path / 'projects'
+    (projects / 'p').mkdir(parents=True)
+    kept = projects / 'p' / 'kept.jsonl'
+    gone = projects / 'p' / 'gone.jsonl'
+    for path in (kept, gone):
+        path.write_text(json.dumps({'type': 'user', 'uuid': path.name, 'message': {'content': 'hi'}}) + '\n')
+
+    config = {
+        'projects_dir': str(projects),
+        'checkpoint_file': str(tmp_path / 'checkpoints.db'),
+        'backfill_file': '',
+        'watch_backend': 'poll',
+    }
+    start_and_stop(config)
+    assert set(CheckpointStore(config['checkpoint_file']).load()) == {str(kept), str(gone)}
+
+    gone.unlink()
+    threads = []
+    for name in ('remove', 'get_state'):
+        original = getattr(CheckpointStore, name)
+
+        def recording(self, *args, _original=original, **kwargs):
+            threads.append(threading.current_thread().name)
+            return _original(self, *args, **kwargs)
+
+        monkeypatch.setattr(CheckpointStore, name, recording)
+
+    start_and_stop(config)
+    assert threads and all(name.startswith('claude-log-io') for name in threads)
+    assert set(CheckpointStore(config['checkpoint_file']).load()) == {str(kept)}
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+ClaudeLogPlugin 用量增量：同一消息的多行只计一次，带 stop_reason 的最后一行也要计入
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from src.plugins.claude_log import ClaudeLogPlugin
+
+
+@pytest.fixture
+def plugin(tmp_path):
+    plugin = ClaudeLogPlugin({'projects_dir': str(tmp_path), 'checkpoint_file': '', 'backfill_file': ''})
+    plugin.deltas = []
+    plugin.register_usage_callback(plugin.deltas.append)
+    return plugin
+
+
+def assistant(uuid, message_id, output, stop_reason=None, block='text', input_tokens=10):
+    content = [{'type': block, 'text': 'x'}] if block != 'tool_use' else \
+        [{'type': 'tool_use', 'id': 't-' + uuid, 'name': 'Read', 'input': {'file_path': '/a'}}]
+    return json.dumps({
+        'type': 'assistant',
+        'uuid': uuid,
+        'message': {
+            'id': message_id,
+            'model': 'claude-test',
+            'stop_reason': stop_reason,
+            'content': content,
+            'usage': {'input_tokens': input_tokens, 'output_tokens': output},
+        },
+    }).encode()
+
+
+def feed(plugin, path, lines):
+    async def run():
+        for line in lines:
+            await plugin._handle_new_line(line, path)
+    asyncio.run(run())
+
+
+def totals(plugin, message_id):
+    deltas = [delta for delta in plugin.deltas if delta.message_id == message_id]
+    return sum(delta.input for delta in deltas), sum(delta.output for delta in deltas), \
+        sum(1 for delta in deltas if delta.new_message)
+
+
+def test_end_turn_line_carries_final_output(plugin, tmp_path):
+    path = str(tmp_path / 'proj' / 'session.jsonl')
+    feed(plugin, path, [
+        assistant('u1', 'm1', 1, block='thinking'),
+        assistant('u2', 'm1', 1),
+        assistant('u3', 'm1', 50, stop_reason='end_turn'),
+    ])
+    assert totals(plugin, 'm1') == (10, 50, 1)
+
+
+@pytest.mark.parametrize('stop_reason', ['end_turn', 'stop_sequence', 'tool_use'])
+def test_single_line_message_is_counted(plugin, tmp_path, stop_reason):
+    path = str(tmp_path / 'proj' / 'session.jsonl')
+    block = 'tool_use' if stop_reason == 'tool_use' else 'text'
+    feed(plugin, path, [assistant('u1', 'm2', 7, stop_reason=stop_reason, block=block)])
+    assert totals(plugin, 'm2') == (10, 7, 1)
+
+
+def test_replayed_lines_are_not_counted_twice(plugin, tmp_path):
+    path = str(tmp_path / 'proj' / 'session.jsonl')
+    lines = [assistant('u1', 'm3', 5), assistant('u2', 'm3', 9, stop_reason='end_turn')]
+    feed(plugin, path, lines + lines)
+    assert totals(plugin, 'm3') == (10, 9, 1)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+字节级预分类：只取顶层对象的 "type" / 头部字段，嵌套对象中的同名键不参与
+"""
+
+import json
+
+import pytest
+
+from src.utils.jsonl_decoder import RecordDecoder, classify, extract_field
+
+
+def line(record) -> bytes:
+    return json.dumps(record).encode()
+
+
+@pytest.mark.parametrize('record, expected', [
+    # 嵌套的 "type":"user" 出现在顶层 "type" 之前
+    ({'message': {'type': 'user', 'content': []}, 'type': 'assistant'}, 'assistant'),
+    ({'data': {'message': {'type': 'user'}}, 'type': 'progress'}, 'progress'),
+    ({'items': [{'type': 'summary'}], 'type': 'system', 'subtype': 'x'}, 'system'),
+    # 字符串中的括号和转义引号不影响嵌套深度
+    ({'cwd': 'a{[b', 'text': '"type":"user"', 'type': 'summary'}, 'summary'),
+    # 只有嵌套的记录类型：不是记录
+    ({'message': {'type': 'user'}}, None),
+    # 顶层类型未知：不回退到嵌套的值
+    ({'type': 'custom-thing', 'message': {'type': 'assistant'}}, None),
+    ({'type': 'user', 'message': {'type': 'message'}}, 'user'),
+])
+def test_classify_uses_top_level_type(record, expected):
+    assert classify(line(record)) == expected
+
+
+def test_extract_field_skips_nested_keys():
+    data = line({'toolUseResult': {'uuid': 'nested'}, 'type': 'user', 'uuid': 'top'})
+    assert extract_field(data, 'uuid') == 'top'
+    assert extract_field(line({'message': {'uuid': 'nested'}}), 'uuid') is None
+
+
+def test_decoder_routes_by_top_level_type():
+    decoder = RecordDecoder()
+    record_type, record = decoder.decode(line({
+        'message': {'role': 'user', 'type': 'user'},
+        'type': 'assistant',
+        'uuid': 'a1',
+    }))
+    assert record_type == 'assistant'
+    assert record['uuid'] == 'a1'
+
+
+def test_memoryview_lines():
+    data = line({'message': {'type': 'user', 'text': 'a\\"b'}, 'type': 'assistant', 'uuid': 'x'})
+    view = memoryview(data)
+    assert classify(view) == 'assistant'
+    assert extract_field(view, 'uuid') == 'x'
+
+
+@pytest.mark.parametrize('record', [
+    # 顶层 type 在 message 之后（transcript 的实际布局），行尾的字符串含括号和转义
+    {'message': {'type': 'message', 'content': [{'type': 'user'}]}, 'type': 'assistant',
+     'uuid': 'x', 'cwd': 'a}]\\"{'},
+    {'type': 'user', 'message': {'content': [{'type': 'tool_result', 'content': '}}\\\\'}]}},
+    {'a': [1, {'b': '\\\\"'}], 'type': 'progress', 'data': {'type': 'user', 'x': '[['}},
+])
+def test_classify_matches_full_parse(record):
+    assert classify(line(record)) == json.loads(line(record))['type']
+
+
+def test_oversized_prefix_is_not_misrouted():
+    from src.utils.jsonl_reader import OversizedLine
+    data = line({'message': {'type': 'user', 'content': 'x' * 100}, 'type': 'assistant'})
+    assert classify(OversizedLine(data[:60], len(data))) is None
+
+
+@pytest.mark.parametrize('text', ['x' * 10000, 'a\\"{[' * 2000, '}' * 5000 + '\\\\'])
+def test_long_nested_strings(text):
+    record = {'cwd': '[', 'message': {'type': 'user', 'content': text}, 'type': 'assistant',
+              'toolUseResult': {'stdout': text}}
+    assert classify(line(record)) == 'assistant'
+    record = {'message': {'type': 'user', 'content': text}, 'uuid': 'u'}
+    assert classify(line(record)) is None
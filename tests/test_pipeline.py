@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+PipelineStage 溢出策略：block（同步提交的待入队缓冲有界）、drop_oldest、coalesce_latest_status
+"""
+
+import asyncio
+
+from src.middleware.pipeline import (
+    OVERFLOW_BLOCK, OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST, EventPipeline, PipelineStage
+)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def collect(stage: PipelineStage, items, release: asyncio.Event, processed: list):
+    """工作任务被 release 阻塞时提交所有 items，然后放行并等待处理完成"""
+    stage.start()
+    await asyncio.sleep(0)
+    items = list(items)
+    # 第一个事件被工作任务取走后阻塞在 handler 中
+    stage.submit(items[0])
+    for _ in range(3):
+        await asyncio.sleep(0)
+    for item in items[1:]:
+        stage.submit(item)
+    stats = stage.get_stats()
+    release.set()
+    while stage.get_stats()['depth'] or stage.get_stats()['pending'] or stage._drain_task:
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.01)
+    await stage.stop()
+    return stats
+
+
+def make_stage(overflow, processed, release, **kwargs):
+    async def handler(item):
+        await release.wait()
+        processed.append(item)
+    return PipelineStage('test', handler, maxsize=4, overflow=overflow, **kwargs)
+
+
+def test_block_keeps_order_and_bounds_pending():
+    async def main():
+        processed, release = [], asyncio.Event()
+        stage = make_stage(OVERFLOW_BLOCK, processed, release, max_pending=8)
+        stats = await collect(stage, range(20), release, processed)
+        return stage, stats, processed
+
+    stage, stats, processed = run(main())
+    # 工作任务取走 1 个，队列 4 个，待入队 8 个；其余最旧的待入队事件被丢弃
+    assert stats['pending'] == 8
+    assert stage.dropped == 7
+    assert processed == [0, 1, 2, 3, 4] + list(range(12, 20))
+
+
+def test_block_without_overflow_drops_nothing():
+    async def main():
+        processed, release = [], asyncio.Event()
+        stage = make_stage(OVERFLOW_BLOCK, processed, release)
+        await collect(stage, range(9), release, processed)
+        return stage, processed
+
+    stage, processed = run(main())
+    assert processed == list(range(9))
+    assert stage.dropped == 0
+
+
+def test_drop_oldest():
+    async def main():
+        processed, release = [], asyncio.Event()
+        stage = make_stage(OVERFLOW_DROP_OLDEST, processed, release)
+        await collect(stage, range(10), release, processed)
+        return stage, processed
+
+    stage, processed = run(main())
+    assert processed == [0, 6, 7, 8, 9]
+    assert stage.dropped == 5
+
+
+def test_coalesce_latest_status():
+    async def main():
+        processed, release = [], asyncio.Event()
+        stage = make_stage(OVERFLOW_COALESCE, processed, release,
+                           can_coalesce=lambda old, new: old[0] == new[0])
+        items = [('a', 0), ('b', 1), ('c', 2), ('d', 3), ('e', 4), ('e', 5), ('e', 6), ('f', 7)]
+        await collect(stage, items, release, processed)
+        return stage, processed
+
+    stage, processed = run(main())
+    assert processed == [('a', 0), ('c', 2), ('d', 3), ('e', 6), ('f', 7)]
+    assert stage.coalesced == 2
+    assert stage.dropped == 1
+
+
+def test_pipeline_stage_config():
+    pipeline = EventPipeline({'queue_size': 8, 'max_pending': 2, 'stages': {'b': {'max_pending': 5}}})
+
+    async def handler(item):
+        return item
+
+    assert pipeline.add_stage('a', handler).max_pending == 2
+    assert pipeline.add_stage('b', handler).max_pending == 5
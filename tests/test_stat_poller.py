@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+StatPoller：每轮检查在 I/O 线程中执行，发现新文件 / 追加 / 删除
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils import stat_poller
+from src.utils.stat_poller import StatPoller
+
+
+def run(poller, rounds):
+    async def main():
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='io') as executor:
+            poller.io_executor = executor
+            results = []
+            for before in rounds:
+                before()
+                results.append(sorted(await poller.poll()))
+            return results
+
+    return asyncio.run(main())
+
+
+def test_poll_detects_changes_off_loop(tmp_path, monkeypatch):
+    threads = []
+    stat = os.stat
+    scandir = os.scandir
+
+    def recording_stat(path, *args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return stat(path, *args, **kwargs)
+
+    def recording_scandir(path):
+        threads.append(threading.current_thread().name)
+        return scandir(path)
+
+    monkeypatch.setattr(stat_poller.os, 'stat', recording_stat)
+    monkeypatch.setattr(stat_poller.os, 'scandir', recording_scandir)
+
+    project = tmp_path / 'project'
+    project.mkdir()
+    known = project / 'known.jsonl'
+    known.write_text('{}\n')
+    offsets = {str(known): 3}
+    poller = StatPoller(str(tmp_path), offsets, on_change=lambda path: None, discovery_interval=3600)
+
+    new = project / 'new.jsonl'
+
+    def append():
+        with open(known, 'a') as f:
+            f.write('{"a": 1}\n')
+
+    results = run(poller, [
+        lambda: None,
+        append,
+        lambda: new.write_text('{}\n'),
+        known.unlink,
+    ])
+
+    assert results == [[], [str(known)], [str(new)], [str(known)]]
+    assert threads and all(name.startswith('io') for name in threads)
+
+
+def test_offsets_added_on_loop_are_seen(tmp_path):
+    path = tmp_path / 'session.jsonl'
+    path.write_text('{}\n')
+    offsets = {}
+    poller = StatPoller(str(tmp_path), offsets, on_change=lambda p: None, discovery_interval=3600)
+
+    def add_offset():
+        offsets[str(path)] = 0
+
+    # 第一轮遍历时位置表为空（新文件从 0 开始，按变化报告）；之后监控器加入的位置不影响已见过的签名
+    results = run(poller, [lambda: None, add_offset])
+    assert results == [[str(path)], []]
+    assert poller.cycles == 2
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+TokenLedger：运行合计、会话 LRU 淘汰、HTTP 线程并发读取
+"""
+
+import threading
+
+from src.middleware.token_ledger import TokenLedger
+from src.plugins.base import UsageDelta
+
+
+def delta(session_id, project='p', input=10, output=5, new_message=True):
+    return UsageDelta(source='test', project=project, session_id=session_id,
+                      input=input, output=output, new_message=new_message)
+
+
+def test_totals_and_session_eviction():
+    ledger = TokenLedger(max_sessions=2)
+    for session_id in ('a', 'b', 'c'):
+        ledger.apply(delta(session_id))
+    ledger.apply(delta('c', new_message=False))
+
+    assert ledger.totals()['sum'] == 60
+    assert ledger.totals()['messages'] == 3
+    assert ledger.project('p')['input'] == 40
+    assert list(ledger.by_session()) == ['p/c', 'p/b']
+    assert ledger.session('p', 'a')['sum'] == 0
+    assert ledger.evicted_sessions == 1
+
+
+def test_by_session_while_applying_from_another_thread():
+    ledger = TokenLedger(max_sessions=64)
+    stop = threading.Event()
+    errors = []
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            ledger.apply(delta(f's{i % 500}', project=f'p{i % 7}'))
+            i += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(2000):
+            try:
+                ledger.by_session()
+                ledger.by_project()
+            except RuntimeError as e:  # dictionary changed size during iteration
+                errors.append(e)
+                break
+    finally:
+        stop.set()
+        thread.join()
+    assert not errors
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+TokenRollup：窗口合计跨秒 / 分钟 / 小时三级拼接，迟到的增量，HTTP 线程并发查询
+"""
+
+import threading
+
+import pytest
+
+from src.middleware.token_rollup import TokenRollup, parse_window
+
+START = 1_700_000_000 - 1_700_000_000 % 3600
+
+
+def test_parse_window():
+    assert parse_window('30s') == 30
+    assert parse_window('5m') == 300
+    assert parse_window('2h') == 7200
+    assert parse_window(90) == 90
+    with pytest.raises(ValueError):
+        parse_window('0m')
+    with pytest.raises(ValueError):
+        parse_window('soon')
+
+
+def test_window_sums_across_levels():
+    rollup = TokenRollup(seconds=120, minutes=120, hours=48)
+    # 每分钟一个增量，持续 3 小时
+    for minute in range(180):
+        rollup.add(START + minute * 60 + 1, (10, 1, 0, 0))
+    now = START + 180 * 60
+
+    assert rollup.window('60s', now=now)['input'] == 10
+    assert rollup.window('10m', now=now)['input'] == 100
+    # 超出秒级环的部分由分钟桶补齐
+    assert rollup.window('1h', now=now)['input'] == 600
+    # 超出分钟级环（120 分钟）的部分由小时桶补齐
+    window = rollup.window('3h', now=now)
+    assert window['input'] == 1800
+    assert window['output'] == 180
+    assert window['sum'] == 1980
+    assert window['resolution'] == 3600
+
+
+def test_late_delta_updates_coarse_buckets():
+    rollup = TokenRollup(seconds=120, minutes=120, hours=48)
+    rollup.add(START + 10, (1, 0, 0, 0))
+    rollup.add(START + 7200, (1, 0, 0, 0))
+    # 迟到的增量：所在分钟 / 小时已汇总
+    rollup.add(START + 20, (5, 0, 0, 0))
+    now = START + 7200 + 1
+    assert rollup.window('3h', now=now)['input'] == 7
+    assert rollup.window('1h', now=now)['input'] == 1
+
+
+def test_series_points_sum_to_window():
+    rollup = TokenRollup()
+    for second in range(0, 300, 7):
+        rollup.add(START + second, (1, 2, 3, 4))
+    now = START + 300
+    series = rollup.series('5m', step='1m', now=now)
+    assert series['step_seconds'] == 60
+    assert len(series['input']) == 5
+    assert sum(series['input']) == rollup.window('5m', now=now)['input']
+    assert sum(series['cache_read']) == 4 * len(range(0, 300, 7))
+
+
+def test_queries_from_another_thread():
+    rollup = TokenRollup(seconds=120, minutes=120, hours=48)
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        while not stop.is_set():
+            try:
+                rollup.window('2h', now=START + 10 ** 6)
+                rollup.series('10m', now=START + 10 ** 6)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        for i in range(20000):
+            rollup.add(START + i, (1, 0, 0, 0))
+    finally:
+        stop.set()
+        thread.join()
+    assert not errors
+    assert rollup.added + rollup.dropped == 20000
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+TokenStore：崩溃后重放日志、截断写了一半的记录、重读的行按消息去重
+"""
+
+import asyncio
+import json
+
+from src.middleware.token_store import JOURNAL_FILE, TokenStore
+from src.plugins.base import UsageDelta
+from src.plugins.claude_log import ClaudeLogPlugin
+
+
+def delta(message_id, input=0, output=0, new_message=True, timestamp=1_700_000_000.0):
+    return UsageDelta(source='test', project='p', session_id='s', message_id=message_id, model='m',
+                      input=input, output=output, new_message=new_message, timestamp=timestamp)
+
+
+def crash(store):
+    """模拟崩溃：已 fsync 的日志保留，不写快照、不关闭"""
+    store._journal.close()
+    store._dict.close()
+
+
+def test_replay_after_crash(tmp_path):
+    store = TokenStore(str(tmp_path))
+    store.open()
+    store.append(delta('m1', input=10, output=1))
+    store.append(delta('m1', output=49, new_message=False))
+    store.append(delta('m2', input=3, output=4))
+    store.flush()
+    store.append(delta('m3', input=100))  # 未落盘
+    crash(store)
+
+    restored = TokenStore(str(tmp_path))
+    restored.open()
+    assert restored.replayed == 3
+    assert restored.cells[('m', 'p', 's', 'main')] == [13, 54, 0, 0, 2]
+    assert restored.message_usage() == {'m1': (10, 50, 0, 0), 'm2': (3, 4, 0, 0)}
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    store = TokenStore(str(tmp_path))
+    store.open()
+    store.append(delta('m1', input=10))
+    store.append(delta('m2', input=20))
+    store.flush()
+    crash(store)
+    with open(tmp_path / JOURNAL_FILE, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 10)
+
+    restored = TokenStore(str(tmp_path))
+    restored.open()
+    assert restored.replayed == 1
+    assert restored.truncated_bytes > 0
+    assert restored.cells[('m', 'p', 's', 'main')][0] == 10
+
+
+def test_message_usage_survives_compaction(tmp_path):
+    store = TokenStore(str(tmp_path), max_messages=2)
+    store.open()
+    for i in range(3):
+        store.append(delta(f'm{i}', input=i + 1))
+    store.compact()
+    crash(store)
+
+    restored = TokenStore(str(tmp_path), max_messages=2)
+    restored.open()
+    assert restored.replayed == 0
+    assert restored.message_usage() == {'m1': (2, 0, 0, 0), 'm2': (3, 0, 0, 0)}
+
+
+def assistant(uuid, message_id, output, stop_reason=None):
+    return json.dumps({
+        'type': 'assistant',
+        'uuid': uuid,
+        'timestamp': '2025-01-01T12:00:00.000Z',
+        'message': {
+            'id': message_id, 'model': 'm', 'stop_reason': stop_reason,
+            'content': [{'type': 'text', 'text': 'x'}],
+            'usage': {'input_tokens': 10, 'output_tokens': output},
+        },
+    }).encode()
+
+
+def test_reread_lines_after_crash_are_not_counted_twice(tmp_path):
+    path = str(tmp_path / 'proj' / 'session.jsonl')
+    lines = [assistant('u1', 'm1', 1), assistant('u2', 'm1', 20), assistant('u3', 'm1', 50, 'end_turn')]
+
+    def run(store, lines):
+        plugin = ClaudeLogPlugin({'projects_dir': str(tmp_path), 'checkpoint_file': '', 'backfill_file': ''})
+        plugin.restore_message_usage(store.message_usage())
+        plugin.register_usage_callback(store.append)
+
+        async def feed():
+            for line in lines:
+                await plugin._handle_new_line(line, path)
+        asyncio.run(feed())
+
+    store = TokenStore(str(tmp_path / 'tokens'))
+    store.open()
+    run(store, lines[:2])
+    store.flush()
+    crash(store)
+
+    # 检查点落后于日志：重启后从第一行重读
+    store = TokenStore(str(tmp_path / 'tokens'))
+    store.open()
+    run(store, lines)
+    assert store.cells[('m', 'proj', 'session', 'main')] == [10, 50, 0, 0, 1]
+    assert store.message_usage() == {'m1': (10, 50, 0, 0)}
+    assert store.first_usage == 1735732800.0
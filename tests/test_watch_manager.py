@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+HotSetWatchManager：目录遍历和冷目录扫描在 I/O 线程中执行，状态在事件循环中更新
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.utils import inotify_watcher, watch_manager
+from src.utils.watch_manager import HotSetWatchManager
+
+pytestmark = pytest.mark.skipif(not inotify_watcher.is_available(), reason='inotify not available')
+
+
+@pytest.fixture
+def scandir_threads(monkeypatch):
+    """记录调用 os.scandir 的线程名"""
+    threads = []
+    scandir = os.scandir
+
+    def recording(path):
+        threads.append(threading.current_thread().name)
+        return scandir(path)
+
+    monkeypatch.setattr(watch_manager.os, 'scandir', recording)
+    return threads
+
+
+def make_tree(root, count):
+    directories = []
+    for i in range(count):
+        directory = root / f'project-{i}'
+        directory.mkdir()
+        (directory / 'session.jsonl').write_text('{}\n')
+        # 越靠后的目录越新
+        os.utime(directory / 'session.jsonl', (1_000_000 + i, 1_000_000 + i))
+        directories.append(str(directory))
+    return directories
+
+
+def run(tmp_path, scenario, budget=2):
+    changes = []
+
+    async def main():
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='io') as executor:
+            manager = HotSetWatchManager(str(tmp_path), on_change=changes.append, budget=budget,
+                                         sweep_interval=3600, io_executor=executor)
+            await manager.start()
+            try:
+                await scenario(manager, changes)
+            finally:
+                await manager.close()
+
+    asyncio.run(main())
+    return changes
+
+
+def test_start_scans_off_loop(tmp_path, scandir_threads):
+    directories = make_tree(tmp_path, 4)
+
+    async def scenario(manager, changes):
+        assert list(manager._hot) == directories[2:]
+        assert set(manager._snapshots) == set(directories[:2])
+        assert manager._snapshots[directories[0]]['session.jsonl'][1] == 3
+
+    run(tmp_path, scenario)
+    assert scandir_threads and all(name.startswith('io') for name in scandir_threads)
+
+
+def test_sweep_reports_cold_changes_and_new_directories(tmp_path, scandir_threads):
+    directories = make_tree(tmp_path, 3)
+
+    async def scenario(manager, changes):
+        with open(os.path.join(directories[0], 'session.jsonl'), 'a') as f:
+            f.write('{"a": 1}\n')
+        nested = os.path.join(directories[1], 'subagents')
+        os.mkdir(nested)
+        with open(os.path.join(nested, 'agent.jsonl'), 'w') as f:
+            f.write('{}\n')
+
+        await manager._sweep()
+        # 新目录的补报在后台任务中完成
+        while manager._tasks:
+            await asyncio.sleep(0.01)
+
+        assert os.path.join(directories[0], 'session.jsonl') in changes
+        assert os.path.join(nested, 'agent.jsonl') in changes
+        assert manager.sweep_hits == 1
+        assert directories[0] in manager._hot
+        assert nested in manager._known
+
+    run(tmp_path, scenario)
+    assert all(name.startswith('io') for name in scandir_threads)
+
+
+def test_demotion_keeps_watch_until_snapshot(tmp_path):
+    directories = make_tree(tmp_path, 2)
+    extra = tmp_path / 'project-new'
+
+    async def scenario(manager, changes):
+        assert list(manager._hot) == directories
+        extra.mkdir()
+        manager._known.add(str(extra))
+        manager._promote(str(extra))
+
+        # 超出预算：最久未活动的目录立即离开热集合，watch 保留到快照完成
+        assert directories[0] not in manager._hot
+        assert manager.watcher.is_watching(directories[0])
+        while manager._tasks:
+            await asyncio.sleep(0.01)
+        assert not manager.watcher.is_watching(directories[0])
+        assert 'session.jsonl' in manager._snapshots[directories[0]]
+        assert manager.demotions == 1
+
+    run(tmp_path, scenario)
+
+
+def test_idle_directories_are_demoted_by_sweep(tmp_path):
+    directories = make_tree(tmp_path, 2)
+
+    async def scenario(manager, changes):
+        manager.idle_seconds = 0
+        await asyncio.sleep(0.01)
+        await manager._sweep()
+        assert not manager._hot
+        assert set(manager._snapshots) == set(directories)
+        assert not any(manager.watcher.is_watching(d) for d in directories)
+        assert changes == []
+
+    run(tmp_path, scenario)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+WebSocket 客户端发送队列：落后时按会话合并状态消息，非状态消息不被替换或丢弃
+"""
+
+import asyncio
+
+from src.adapters.websocket_adapter import _ClientChannel
+
+
+class SlowSocket:
+    """send() 阻塞到 release() 为止"""
+
+    def __init__(self):
+        self.sent = []
+        self.released = asyncio.Event()
+
+    async def send(self, message):
+        await self.released.wait()
+        self.sent.append(message)
+
+    async def close(self, code=1000, reason=''):
+        pass
+
+
+def run(scenario):
+    async def main():
+        websocket = SlowSocket()
+        channel = _ClientChannel(websocket, queue_size=3, send_timeout=5.0)
+        # 写任务取走第一条消息后阻塞在 send()
+        channel.push('first', ('status', 's0', None))
+        await asyncio.sleep(0)
+        scenario(channel)
+        websocket.released.set()
+        while channel.queue:
+            await asyncio.sleep(0)
+        await channel.close()
+        return websocket.sent, channel
+
+    return asyncio.run(main())
+
+
+def test_same_session_status_is_replaced():
+    def scenario(channel):
+        channel.push('s1-busy', ('status', 's1', None))
+        channel.push('bust-1')
+        channel.push('s2-busy', ('status', 's2', None))
+        channel.push('s1-idle', ('status', 's1', None))
+
+    sent, channel = run(scenario)
+    assert sent == ['first', 'bust-1', 's2-busy', 's1-idle']
+    assert channel.coalesced == 1
+
+
+def test_oldest_status_is_dropped_for_other_sessions():
+    def scenario(channel):
+        channel.push('s1-busy', ('status', 's1', None))
+        channel.push('bust-1')
+        channel.push('s2-busy', ('status', 's2', None))
+        channel.push('s3-busy', ('status', 's3', None))
+
+    sent, _ = run(scenario)
+    assert sent == ['first', 'bust-1', 's2-busy', 's3-busy']
+
+
+def test_non_status_messages_are_never_dropped():
+    def scenario(channel):
+        for i in range(3):
+            channel.push(f'bust-{i}')
+        channel.push('turn')
+        channel.push('s1-busy', ('status', 's1', None))
+        assert channel.lag(float('inf')) > 0
+
+    sent, channel = run(scenario)
+    assert sent == ['first', 'bust-0', 'bust-1', 'bust-2', 'turn', 's1-busy']
+    assert channel.coalesced == 0